@@ -1,9 +1,17 @@
+import time
+startup_time = time.perf_counter()
+
 import streamlit as st
+from src.startup import StartupTimer, ResourceWarmup
 from src.utils import ParsedArgs, ArgsParser, Settings
 from src.chatbot_pipeline import ChatbotPipeline
 from src.data_pipeline import DataPipeline
 from src.embedding import Embedder
+from src.model_registry import ModelRegistry
+from src.profiler import profiler
+from src.query_cache import QueryLog, QueryCache
 import warnings
+import os
 
 warnings.filterwarnings("ignore", category=FutureWarning)
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -13,53 +21,145 @@ st.title(body="RAG-based Chatbot (eLife and BioRxiv Articles)")
 
 @st.cache_resource 
 def initialize_streamlit_app():
+    startup_timer = StartupTimer(start_time=startup_time)
+    startup_timer.record("import modules", startup_time, time.perf_counter())
+
     # get args
     args_parser = ArgsParser()
     parsed_args = ParsedArgs(args_parser.parse_args())
-    
+
     embedding_device = parsed_args.embedding_device
     n_files = parsed_args.n_files
     n_docs = parsed_args.n_docs
     build_vector_store = parsed_args.build_vector_store
     use_ollama = parsed_args.use_ollama
-    
+    prompt_prefix_cache = parsed_args.prompt_prefix_cache
+    prewarm_top_n = parsed_args.prewarm_top_n
+    vector_store_snapshot = parsed_args.vector_store_snapshot
+    hf_n_samples = parsed_args.hf_n_samples
+    xml_source = parsed_args.xml_source
+    skip_deduplication = parsed_args.skip_deduplication
+    restart_ingestion = parsed_args.restart_ingestion
+    pdf_extractive_budget = parsed_args.pdf_extractive_budget
+    summarizer_backend = parsed_args.summarizer_backend
+    vector_storage = parsed_args.vector_storage
+    cascade_n_candidates = parsed_args.cascade_n_candidates
+    n_shards = parsed_args.n_shards
+    shard_by = parsed_args.shard_by
+    rss_budget_mib = parsed_args.rss_budget_mib
+    summarizer_threads = parsed_args.summarizer_threads
+    summarizer_interop_threads = parsed_args.summarizer_interop_threads
+    xml_extractive_budget = parsed_args.xml_extractive_budget
+    hf_shard_index = parsed_args.hf_shard_index
+    hf_n_shards = parsed_args.hf_n_shards
+    profile_stages = parsed_args.profile_stages
+    profiler_port = parsed_args.profiler_port
+
     # get paths and global vars
     settings = Settings()
     paths_as_strings = settings.get_paths_as_strings()
-    
+
     llm_path = paths_as_strings["OLLAMA_LLM_PATH"] if use_ollama else paths_as_strings["HF_LLM_PATH"]
+    ollama_base_url = paths_as_strings["OLLAMA_BASE_URL"]
+    ollama_keep_alive = paths_as_strings["OLLAMA_KEEP_ALIVE"]
     vector_store_dir_path = paths_as_strings["VECTOR_STORE_DIR_PATH"]
     hf_embedding_model_path = paths_as_strings["HF_EMBEDDING_MODEL_PATH"]
     question_answerer_prompt_path = paths_as_strings["QUESTION_ANSWERER_PROMPT_PATH"]
     question_contextualizer_prompt_path = paths_as_strings["QUESTION_CONTEXTUALIZER_PROMPT_PATH"]
     chat_summarizer_prompt_path = paths_as_strings["CHAT_SUMMARIZER_PROMPT_PATH"]
+    # with the prompt prefix cache, the prompts are a shared prefix (system prompt and chat history) followed by task-specific suffixes
+    prompt_prefix_path = paths_as_strings["CHAT_PREFIX_PROMPT_PATH"] if prompt_prefix_cache else None
+    if prompt_prefix_cache:
+        question_answerer_prompt_path = paths_as_strings["QUESTION_ANSWERER_SUFFIX_PROMPT_PATH"]
+        question_contextualizer_prompt_path = paths_as_strings["QUESTION_CONTEXTUALIZER_SUFFIX_PROMPT_PATH"]
     huggingface_api_token = paths_as_strings["HUGGINGFACE_API_TOKEN"]
     hf_summarizer_model_path = paths_as_strings["HF_SUMMARIZER_MODEL_PATH"]
     hf_data_path = paths_as_strings["HF_DATA_PATH"]
     google_drive_chroma_url = paths_as_strings["GOOGLE_DRIVE_CHROMA_URL"]
-    
-    # set embedding function
+    quantized_store_dir_path = paths_as_strings["QUANTIZED_STORE_DIR_PATH"]
+    cascade_store_dir_path = paths_as_strings["CASCADE_STORE_DIR_PATH"]
+    sharded_store_dir_path = paths_as_strings["SHARDED_STORE_DIR_PATH"]
+    hf_fast_embedding_model_path = paths_as_strings["HF_FAST_EMBEDDING_MODEL_PATH"]
+    dedup_report_path = paths_as_strings["DEDUP_REPORT_PATH"]
+    ingestion_journal_path = paths_as_strings["INGESTION_JOURNAL_PATH"]
+    query_log_path = paths_as_strings["QUERY_LOG_PATH"]
+    elife_xml_mirror_dir_path = paths_as_strings["ELIFE_XML_MIRROR_DIR_PATH"]
+    elife_xml_remote_url = paths_as_strings["ELIFE_XML_REMOTE_URL"]
+    profiles_dir_path = paths_as_strings["PROFILES_DIR_PATH"]
+
+    # sample the given stages until exit, and/or on demand from the admin endpoint (Streamlit does not run the script on the main thread, so no signal handler)
+    profiler.enable(stages=profile_stages, port=profiler_port, output_dir_path=profiles_dir_path)
+
+    # models and vector store loaded, reference counted and unloaded (summarizer after ingestion, expired ones by the reaper thread) within the memory budget
+    model_registry = ModelRegistry(rss_budget_mib=rss_budget_mib).start()
+    # anonymized log of the questions asked, whose most frequent ones are answered in the background once the chains are ready (only with prewarming)
+    query_log = QueryLog(log_path=query_log_path) if prewarm_top_n else None
+    query_cache = QueryCache() if prewarm_top_n else None
+
+    # run the data pipeline (fetch data -> handle data -> create vector store) once the embedding function (and the fast one of the cascade) is loaded
+    def prepare_vector_store(embedding_function, fast_embedding_function=None):
+        data_pipeline = DataPipeline(n_files=n_files, embedding_function=embedding_function,
+                                     hf_data_path=hf_data_path, hf_summarizer_model_path=hf_summarizer_model_path,
+                                     vector_store_dir_path=vector_store_dir_path, google_drive_chroma_url=google_drive_chroma_url,
+                                     build_vector_store=build_vector_store, vector_store_snapshot=vector_store_snapshot,
+                                     hf_n_samples=hf_n_samples, hf_shard_index=hf_shard_index, hf_n_shards=hf_n_shards,
+                                     deduplicate=not skip_deduplication, dedup_report_path=dedup_report_path,
+                                     pdf_extractive_budget=pdf_extractive_budget, xml_extractive_budget=xml_extractive_budget,
+                                     summarizer_backend=summarizer_backend, summarizer_threads=summarizer_threads,
+                                     summarizer_interop_threads=summarizer_interop_threads,
+                                     journal_path=ingestion_journal_path, restart_ingestion=restart_ingestion,
+                                     n_shards=n_shards if vector_storage == 'sharded' else 1, shard_by=shard_by,
+                                     sharded_store_dir_path=sharded_store_dir_path, model_registry=model_registry,
+                                     xml_source=xml_source, elife_xml_mirror_dir_path=elife_xml_mirror_dir_path,
+                                     elife_xml_remote_url=elife_xml_remote_url, profiles_dir_path=profiles_dir_path,
+                                     quantized_store_dir_path=os.path.join(quantized_store_dir_path, vector_storage) if vector_storage in ('float16', 'int8') else None,
+                                     fast_embedding_function=fast_embedding_function, cascade_store_dir_path=cascade_store_dir_path if vector_storage == 'cascade' else None)
+        data_pipeline.run_pipeline()
+
+    # load and warm up the embedding model and the vector store in the background
     embedder = Embedder(embedding_device=embedding_device, hf_embedding_model_path=hf_embedding_model_path)
-    embedding_function = embedder.set_embedding_function()
-    
-    # run the data pipeline (fetch data -> handle data -> create vector store)
-    data_pipeline = DataPipeline(n_files=n_files, embedding_function=embedding_function,
-                                 hf_data_path=hf_data_path, hf_summarizer_model_path=hf_summarizer_model_path,
-                                 vector_store_dir_path=vector_store_dir_path, google_drive_chroma_url=google_drive_chroma_url,
-                                 build_vector_store=build_vector_store)
-    data_pipeline.run_pipeline()
-    
-    # init a chatbot instantance
-    chatbot_pipeline = ChatbotPipeline(embedding_function=embedding_function, vector_store_dir_path=vector_store_dir_path,
-                                       n_docs=n_docs, llm_path=llm_path, use_ollama=use_ollama,
-                                       huggingface_api_token=huggingface_api_token,
-                                       question_contextualizer_prompt_path=question_contextualizer_prompt_path,
-                                       question_answerer_prompt_path=question_answerer_prompt_path,
-                                       chat_summarizer_prompt_path=chat_summarizer_prompt_path)
-    chatbot = chatbot_pipeline.init_chatbot()
-    return chatbot
+    fast_embedder = Embedder(embedding_device=embedding_device, hf_embedding_model_path=hf_fast_embedding_model_path) if vector_storage == 'cascade' else None
+    resource_warmup = ResourceWarmup(embedder=embedder, vector_store_dir_path=vector_store_dir_path,
+                                     prepare_vector_store=prepare_vector_store, startup_timer=startup_timer,
+                                     vector_storage=vector_storage, quantized_store_dir_path=quantized_store_dir_path,
+                                     fast_embedder=fast_embedder, cascade_store_dir_path=cascade_store_dir_path,
+                                     cascade_n_candidates=cascade_n_candidates, sharded_store_dir_path=sharded_store_dir_path,
+                                     n_shards=n_shards, shard_by=shard_by, model_registry=model_registry,
+                                     query_cache=query_cache)
+    resource_warmup.start()
+
+    # set up the LLM client in the meantime
+    with startup_timer.measure("set up LLM client"):
+        chatbot_pipeline = ChatbotPipeline(vector_store_dir_path=vector_store_dir_path,
+                                           n_docs=n_docs, llm_path=llm_path, use_ollama=use_ollama,
+                                           huggingface_api_token=huggingface_api_token,
+                                           question_contextualizer_prompt_path=question_contextualizer_prompt_path,
+                                           question_answerer_prompt_path=question_answerer_prompt_path,
+                                           chat_summarizer_prompt_path=chat_summarizer_prompt_path,
+                                           ollama_base_url=ollama_base_url, ollama_keep_alive=ollama_keep_alive,
+                                           prompt_prefix_path=prompt_prefix_path, max_history_chars=6000 if prompt_prefix_cache else None,
+                                           query_log=query_log, query_cache=query_cache, prewarm_top_n=prewarm_top_n)
+
+    # init the chains shared by all the sessions (each session gets its own chatbot and chat history on top of them)
+    with startup_timer.measure("wait for background warm-up"):
+        embedding_function = resource_warmup.get_embedding_function()
+        vector_store = resource_warmup.get_vector_store()
+    with startup_timer.measure("init chains"):
+        chatbot_pipeline.init_chains(embedding_function=embedding_function, vector_store=vector_store, summary_workers=4)
+    startup_timer.report()
+    model_registry.memory_report()
+    return chatbot_pipeline
+
+def get_session_chatbot(chatbot_pipeline):
+    """
+    Returns the chatbot of the current browser session, created on its first run (chat histories are never shared between sessions)
+    """
+    if "chatbot" not in st.session_state:
+        st.session_state.chatbot = chatbot_pipeline.new_chatbot()
+    return st.session_state.chatbot
 
 if __name__ == "__main__":
-    chatbot = initialize_streamlit_app()
+    with st.spinner("Loading models and vector store..."):
+        chatbot_pipeline = initialize_streamlit_app()
+    chatbot = get_session_chatbot(chatbot_pipeline)
     chatbot.run_app_chat()
-
@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+import logging
+from benchmarks.common import percentiles, save_results
+from src.cascade_store import CascadeVectorStore
+from src.embedding import Embedder
+from src.utils import DataUtils, Settings
+from src.vector_store import DocumentRetriever
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("CascadeRetrievalBenchmark")
+
+DEFAULT_QUERIES = ["What is insomnia?", "What is fMRI?", "How does the immune system work?", "What are place cells?", "How does the retina work?"]
+
+
+def run_benchmark(chroma_vector_store, cascade_vector_store, queries, k, candidate_counts):
+    """
+    Compares the single-stage Chroma search, the exact main-model search and the cascade at several candidate counts
+    (latency percentiles and recall@k of the cascade against the exact main-model top-k)
+    """
+    import numpy as np
+    results = []
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        chroma_vector_store.similarity_search(query, k=k)
+        latencies.append(time.perf_counter() - start)
+    results.append({'retriever': 'chroma (single stage)', 'latency_seconds': percentiles(latencies)})
+
+    exact_ids, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        query_vector = np.asarray(cascade_vector_store.embedding_function.embed_query(query), dtype=np.float32)
+        exact_ids.append(set(np.argsort(-(np.asarray(cascade_vector_store.vectors) @ query_vector))[:k].tolist()))
+        latencies.append(time.perf_counter() - start)
+    results.append({'retriever': 'exact main model (brute force)', f'recall@{k}': 1.0, 'latency_seconds': percentiles(latencies)})
+
+    for n_candidates in candidate_counts:
+        latencies, recalls = [], []
+        for query, exact in zip(queries, exact_ids):
+            start = time.perf_counter()
+            fast_query_vector, main_query_vector = cascade_vector_store.embed_query(query)
+            candidate_ids, _ = cascade_vector_store.get_candidates(fast_query_vector, main_query_vector, n_candidates)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(exact & set(candidate_ids[:k].tolist())) / k)
+        results.append({'retriever': 'cascade', 'n_candidates': n_candidates, f'recall@{k}': float(np.mean(recalls)),
+                        'latency_seconds': percentiles(latencies)})
+
+    for result in results:
+        logger.info(f"{result['retriever']} {result.get('n_candidates', '')}: p50 {result['latency_seconds']['p50'] * 1000:.1f} ms, "
+                    f"p95 {result['latency_seconds']['p95'] * 1000:.1f} ms, recall@{k}: {result.get(f'recall@{k}', 'n/a')}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and recall of the two-stage (cascade) retrieval against the single-stage baseline")
+    parser.add_argument('--embedding_device', type=str, default='cpu', choices=['cpu', 'cuda'])
+    parser.add_argument('--queries_path', type=str, default=None, help="Text file with one query per line (default: example questions and document titles)")
+    parser.add_argument('--n_title_queries', type=int, default=100, help="Number of document titles used as queries when no query file is given")
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--candidate_counts', type=int, nargs='+', default=[20, 50, 100, 200])
+    parser.add_argument('--output_path', type=str, default=None)
+    args = parser.parse_args()
+
+    settings = Settings()
+    embedding_function = Embedder(args.embedding_device, settings.HF_EMBEDDING_MODEL_PATH).set_embedding_function()
+    fast_embedding_function = Embedder(args.embedding_device, settings.HF_FAST_EMBEDDING_MODEL_PATH).set_embedding_function()
+    chroma_vector_store = DocumentRetriever.load_vector_store(embedding_function, str(settings.VECTOR_STORE_DIR_PATH))
+    fingerprint = DataUtils.read_fingerprint(settings.VECTOR_STORE_DIR_PATH) or DocumentRetriever.fingerprint_vector_store(chroma_vector_store, settings.VECTOR_STORE_DIR_PATH)
+    if DataUtils.read_fingerprint(settings.CASCADE_STORE_DIR_PATH) != fingerprint:
+        CascadeVectorStore.build_from_chroma(chroma_vector_store, fast_embedding_function, settings.CASCADE_STORE_DIR_PATH, fingerprint=fingerprint)
+    cascade_vector_store = DocumentRetriever.load_vector_store(embedding_function, str(settings.VECTOR_STORE_DIR_PATH), vector_storage='cascade',
+                                                               fast_embedding_function=fast_embedding_function,
+                                                               cascade_store_dir_path=str(settings.CASCADE_STORE_DIR_PATH))
+    if args.queries_path:
+        with open(args.queries_path) as file:
+            queries = [line.strip() for line in file if line.strip()]
+    else:
+        titles = [document['metadata'].get('article_title') for document in cascade_vector_store.documents]
+        titles = [title for title in titles if title]
+        queries = DEFAULT_QUERIES + random.Random(0).sample(titles, min(args.n_title_queries, len(titles)))
+
+    results = run_benchmark(chroma_vector_store, cascade_vector_store, queries, args.k, args.candidate_counts)
+    output_path = save_results("cascade_retrieval", {'n_queries': len(queries), 'k': args.k, 'runs': results}, args.output_path)
+    logger.info(f"Results saved to {output_path}")
@@ -0,0 +1,74 @@
+from pathlib import Path
+from collections import Counter
+import json
+import platform
+import re
+import time
+
+RESULTS_DIR_PATH = Path(__file__).resolve().parent / 'results'
+
+
+def tokenize(text):
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def rouge_n(reference, candidate, n=1):
+    """
+    ROUGE-N F1 between two texts (n-gram overlap)
+    """
+    reference_tokens, candidate_tokens = tokenize(reference), tokenize(candidate)
+    reference_ngrams = Counter(tuple(reference_tokens[i:i + n]) for i in range(len(reference_tokens) - n + 1))
+    candidate_ngrams = Counter(tuple(candidate_tokens[i:i + n]) for i in range(len(candidate_tokens) - n + 1))
+    overlap = sum((reference_ngrams & candidate_ngrams).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(candidate_ngrams.values())
+    recall = overlap / sum(reference_ngrams.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_l(reference, candidate):
+    """
+    ROUGE-L F1 between two texts (longest common subsequence of tokens)
+    """
+    reference_tokens, candidate_tokens = tokenize(reference), tokenize(candidate)
+    if not reference_tokens or not candidate_tokens:
+        return 0.0
+    previous = [0] * (len(candidate_tokens) + 1)
+    for reference_token in reference_tokens:
+        current = [0]
+        for j, candidate_token in enumerate(candidate_tokens):
+            current.append(previous[j] + 1 if reference_token == candidate_token else max(previous[j + 1], current[j]))
+        previous = current
+    lcs = previous[-1]
+    if not lcs:
+        return 0.0
+    precision, recall = lcs / len(candidate_tokens), lcs / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_scores(reference, candidate):
+    return {'rouge1': rouge_n(reference, candidate, 1), 'rouge2': rouge_n(reference, candidate, 2), 'rougeL': rouge_l(reference, candidate)}
+
+
+def percentiles(values, quantiles=(50, 95, 99)):
+    """
+    Nearest-rank percentiles of a list of values
+    """
+    if not values:
+        return {f'p{q}': None for q in quantiles}
+    ordered = sorted(values)
+    return {f'p{q}': ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))] for q in quantiles}
+
+
+def save_results(benchmark_name, results, output_path=None):
+    """
+    Saves benchmark results as indented, key-sorted JSON (diffable between versions) with the run environment
+    """
+    output_path = Path(output_path) if output_path else RESULTS_DIR_PATH / f"{benchmark_name}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {'benchmark': benchmark_name, 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    with open(output_path, 'w') as file:
+        json.dump(payload, file, indent=2, sort_keys=True)
+    return output_path
@@ -0,0 +1,313 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import argparse
+import json
+import random
+import tempfile
+import threading
+import time
+import uuid
+import logging
+from benchmarks.common import percentiles, save_results
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ConversationReplay")
+
+PHASES = ('contextualize', 'retrieve', 'generate', 'summarize')
+
+DEFAULT_CONVERSATIONS = [
+    ["What is insomnia?", "What are its main causes?", "How is it treated?"],
+    ["What is fMRI?", "What does it measure in the brain?", "What are its limitations?"],
+    ["How does the immune system work?", "What is the role of T cells?", "And B cells?", "How do vaccines use them?"],
+    ["What are place cells?", "Where are they found?", "How were they discovered?"],
+    ["How does the retina work?", "What are rods and cones?"],
+]
+
+
+def load_conversations(conversations_path):
+    """
+    Loads recorded conversations from a JSON file: a list of conversations, each a list of queries or of
+    {"query": ..., "think_time": seconds} turns (default: example conversations)
+    """
+    conversations = DEFAULT_CONVERSATIONS
+    if conversations_path:
+        with open(conversations_path) as file:
+            conversations = json.load(file)
+    return [[turn if isinstance(turn, dict) else {'query': turn} for turn in conversation] for conversation in conversations]
+
+
+class ChatSession:
+    """
+    A conversation with the chatbot running the steps of ConversationRAGChain one by one, so that each turn is timed
+    per phase: contextualize (question rewritten from the chat history), retrieve, generate (streamed) and summarize
+    """
+    def __init__(self, chatbot_pipeline):
+        from src.chatbot import Chatbot
+        from langchain_core.output_parsers import StrOutputParser
+        self.chatbot_pipeline = chatbot_pipeline
+        # the chat history is summarized synchronously here, so that the summarize phase is measured
+        self.chatbot = Chatbot(conversation_rag_chain=chatbot_pipeline.conversation_rag_chain, chat_summarizer_chain=chatbot_pipeline.chat_summarizer_chain,
+                               max_history_chars=chatbot_pipeline.max_history_chars)
+        retriever_chain = chatbot_pipeline.retriever_chain
+        self.contextualizer_chain = retriever_chain.prompt | retriever_chain.llm | StrOutputParser()
+        self.retriever = retriever_chain.retriever
+        self.stuff_document_chain = chatbot_pipeline.conversation_rag_chain.stuff_document_chain
+
+    def run_turn(self, query, on_token=None):
+        """
+        Runs one turn and returns its timings (seconds): time to first token and latency of the answer, duration of the turn
+        with the summary, and duration of each phase (or the phase that failed)
+        """
+        timings = {}
+        phase = PHASES[0]
+        start = time.perf_counter()
+        try:
+            chat_history = self.chatbot.get_chat_history()
+            # as in create_history_aware_retriever, the question is only rewritten once there is a chat history
+            standalone_query = self.contextualizer_chain.invoke({'chat_history': chat_history, 'input': query}) if chat_history else query
+            contextualized = time.perf_counter()
+            timings['contextualize'] = contextualized - start
+
+            phase = 'retrieve'
+            documents = self.retriever.invoke(standalone_query)
+            retrieved = time.perf_counter()
+            timings['retrieve'] = retrieved - contextualized
+
+            phase = 'generate'
+            answer, first_token = "", None
+            for chunk in self.stuff_document_chain.stream({'context': documents, 'chat_history': chat_history, 'input': query}):
+                if first_token is None:
+                    first_token = time.perf_counter()
+                answer += chunk
+                if on_token is not None:
+                    on_token(chunk)
+            generated = time.perf_counter()
+            first_token = first_token or generated
+            timings.update({'generate': generated - retrieved, 'generate_ttft': first_token - retrieved,
+                            'ttft': first_token - start, 'latency': generated - start})
+
+            phase = 'summarize'
+            self.chatbot.update_chat_history(user_query=query, full_response=answer)
+            self.chatbot.summarize_chat_history()
+            summarized = time.perf_counter()
+            timings.update({'summarize': summarized - generated, 'turn': summarized - start})
+        except Exception as e:
+            return {'error_phase': phase, 'error': f"{type(e).__name__}: {e}", 'timings': timings}
+        return {'timings': timings}
+
+
+class InProcessTarget:
+    def __init__(self, chatbot_pipeline):
+        self.chatbot_pipeline = chatbot_pipeline
+
+    def new_session(self):
+        return ChatSession(self.chatbot_pipeline)
+
+
+class EndpointSession:
+    """
+    A conversation with a chatbot served over HTTP (see `serve`): the answer is streamed as JSON lines, followed by the
+    per-phase timings measured by the server
+    """
+    def __init__(self, endpoint_url, timeout=300):
+        self.endpoint_url = endpoint_url.rstrip('/')
+        self.session_id = uuid.uuid4().hex
+        self.timeout = timeout
+
+    def run_turn(self, query, on_token=None):
+        import requests
+        start = time.perf_counter()
+        first_token, result = None, None
+        try:
+            with requests.post(f"{self.endpoint_url}/chat", json={'session_id': self.session_id, 'query': query}, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                # read byte by byte, so that the first token is seen as soon as it is sent
+                for line in response.iter_lines(chunk_size=1):
+                    if not line:
+                        continue
+                    message = json.loads(line)
+                    if 'token' in message and first_token is None:
+                        first_token = time.perf_counter()
+                    if 'result' in message:
+                        result = message['result']
+        except Exception as e:
+            return {'error_phase': 'request', 'error': f"{type(e).__name__}: {e}", 'timings': {}}
+        if result is None:
+            return {'error_phase': 'request', 'error': "No result received", 'timings': {}}
+        # the time to first token and the latency are the ones seen by the client (network included)
+        if 'error_phase' not in result:
+            result['timings'].update({'ttft': (first_token or time.perf_counter()) - start, 'turn': time.perf_counter() - start})
+        return result
+
+
+class EndpointTarget:
+    def __init__(self, endpoint_url):
+        self.endpoint_url = endpoint_url
+
+    def new_session(self):
+        return EndpointSession(self.endpoint_url)
+
+
+def serve(chatbot_pipeline, host='127.0.0.1', port=8765):
+    """
+    Serves the chatbot over HTTP: POST /chat {"session_id", "query"} streams {"token"} JSON lines and a final {"result"} line
+    (one chat session per session id, each request handled in its own thread)
+    """
+    sessions, lock = {}, threading.Lock()
+
+    class ChatRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.0'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            if self.path != '/chat':
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            with lock:
+                if request['session_id'] not in sessions:
+                    sessions[request['session_id']] = ChatSession(chatbot_pipeline)
+                session = sessions[request['session_id']]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.end_headers()
+
+            def write_token(token):
+                self.wfile.write((json.dumps({'token': token}) + '\n').encode('utf-8'))
+                self.wfile.flush()
+            result = session.run_turn(request['query'], on_token=write_token)
+            self.wfile.write((json.dumps({'result': result}) + '\n').encode('utf-8'))
+
+    server = ThreadingHTTPServer((host, port), ChatRequestHandler)
+    logger.info(f"Serving the chatbot on http://{host}:{port}/chat")
+    server.serve_forever()
+
+
+def run_load(target, conversations, n_users, arrival_rate, think_time, seed=0):
+    """
+    Starts `n_users` users at a Poisson arrival rate (users/second), each replaying a conversation with its recorded
+    think times (or exponential think times of mean `think_time`), and returns the record of every turn
+    """
+    generator = random.Random(seed)
+    records, lock = [], threading.Lock()
+    active_users = {'current': 0, 'max': 0}
+    benchmark_start = time.perf_counter()
+
+    def run_user(user_index, conversation, user_generator):
+        with lock:
+            active_users['current'] += 1
+            active_users['max'] = max(active_users['max'], active_users['current'])
+        session = target.new_session()
+        for turn_index, turn in enumerate(conversation):
+            if turn_index:
+                time.sleep(turn.get('think_time', user_generator.expovariate(1 / think_time) if think_time else 0))
+            turn_start = time.perf_counter() - benchmark_start
+            record = session.run_turn(turn['query'])
+            record.update({'user': user_index, 'turn': turn_index, 'start': turn_start})
+            with lock:
+                records.append(record)
+        with lock:
+            active_users['current'] -= 1
+
+    threads = []
+    for user_index in range(n_users):
+        if user_index:
+            time.sleep(generator.expovariate(arrival_rate))
+        conversation = conversations[user_index % len(conversations)]
+        thread = threading.Thread(target=run_user, args=(user_index, conversation, random.Random(seed + user_index + 1)), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - benchmark_start, active_users['max']
+
+
+def summarize_records(records, wall_seconds, max_active_users):
+    """
+    Latency percentiles (end to end and per phase), throughput and error rates of a load run
+    """
+    successful = [record for record in records if 'error_phase' not in record]
+    errors_by_phase = {}
+    for record in records:
+        if 'error_phase' in record:
+            errors_by_phase[record['error_phase']] = errors_by_phase.get(record['error_phase'], 0) + 1
+    metrics = sorted({metric for record in successful for metric in record['timings']})
+    return {'n_turns': len(records), 'n_errors': len(records) - len(successful), 'error_rate': (len(records) - len(successful)) / len(records) if records else 0.0,
+            'errors_by_phase': errors_by_phase, 'wall_seconds': wall_seconds, 'turns_per_second': len(successful) / wall_seconds if wall_seconds else None,
+            'max_active_users': max_active_users,
+            'latency_seconds': {metric: percentiles([record['timings'][metric] for record in successful if metric in record['timings']]) for metric in metrics}}
+
+
+def create_chatbot_pipeline(args):
+    """
+    Sets up the chatbot pipeline as main.py does, or with stand-in models (fake streaming LLM, pseudo-random embeddings and a
+    small float16 store of synthetic documents) to exercise the load generator without any model
+    """
+    from src.chatbot_pipeline import ChatbotPipeline
+    from src.utils import Settings
+    paths_as_strings = Settings().get_paths_as_strings()
+    llm_path = paths_as_strings["OLLAMA_LLM_PATH"] if args.use_ollama else paths_as_strings["HF_LLM_PATH"]
+    llm, embedding_function, vector_store = None, None, None
+
+    if args.stand_in_models:
+        from langchain_core.language_models.fake import FakeStreamingListLLM
+        from benchmarks.fixtures import StandInEmbeddings, generate_paragraph
+        from src.quantized_store import QuantizedVectorStore
+        llm = FakeStreamingListLLM(responses=["This is a stand-in answer generated to exercise the chat pipeline under load."], sleep=args.stand_in_token_delay)
+        embedding_function = StandInEmbeddings()
+        documents = [{'page_content': generate_paragraph(random.Random(i)), 'metadata': {'article_title': f"Article {i}"}} for i in range(1000)]
+        store_dir_path = Path(tempfile.mkdtemp()) / 'stand_in_store'
+        QuantizedVectorStore.build(embedding_function.embed_documents([document['page_content'] for document in documents]), documents, store_dir_path, 'float16')
+        vector_store = QuantizedVectorStore(store_dir_path, embedding_function)
+    else:
+        from src.embedding import Embedder
+        from src.vector_store import DocumentRetriever
+        embedding_function = Embedder(embedding_device=args.embedding_device, hf_embedding_model_path=paths_as_strings["HF_EMBEDDING_MODEL_PATH"]).set_embedding_function()
+        vector_store = DocumentRetriever.load_vector_store(embedding_function, paths_as_strings["VECTOR_STORE_DIR_PATH"])
+
+    chatbot_pipeline = ChatbotPipeline(vector_store_dir_path=paths_as_strings["VECTOR_STORE_DIR_PATH"], n_docs=args.n_docs, llm_path=llm_path,
+                                       use_ollama=args.use_ollama, huggingface_api_token=paths_as_strings["HUGGINGFACE_API_TOKEN"],
+                                       question_contextualizer_prompt_path=paths_as_strings["QUESTION_CONTEXTUALIZER_PROMPT_PATH"],
+                                       question_answerer_prompt_path=paths_as_strings["QUESTION_ANSWERER_PROMPT_PATH"],
+                                       chat_summarizer_prompt_path=paths_as_strings["CHAT_SUMMARIZER_PROMPT_PATH"],
+                                       ollama_base_url=paths_as_strings["OLLAMA_BASE_URL"], ollama_keep_alive=paths_as_strings["OLLAMA_KEEP_ALIVE"], llm=llm)
+    return chatbot_pipeline.init_chains(embedding_function=embedding_function, vector_store=vector_store)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays multi-turn conversations against the chatbot (in-process or over a local endpoint) "
+                                                 "and reports time to first token, latency per phase, throughput and errors")
+    parser.add_argument('command', nargs='?', default='replay', choices=['replay', 'serve'], help="Replay conversations, or serve the chatbot over HTTP")
+    parser.add_argument('--endpoint_url', type=str, default=None, help="Replay against a chatbot served with the 'serve' command (default: in-process)")
+    parser.add_argument('--conversations_path', type=str, default=None, help="JSON file of recorded conversations (default: example conversations)")
+    parser.add_argument('--n_users', type=int, default=20)
+    parser.add_argument('--arrival_rates', type=float, nargs='+', default=[0.5, 1.0, 2.0], help="User arrival rates (users/second), one load run each")
+    parser.add_argument('--think_time', type=float, default=5.0, help="Mean think time between the turns of a user when not recorded (seconds)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--n_docs', type=int, default=2)
+    parser.add_argument('--use_ollama', action='store_true')
+    parser.add_argument('--embedding_device', type=str, default='cpu', choices=['cpu', 'cuda'])
+    parser.add_argument('--stand_in_models', action='store_true', help="Use a fake streaming LLM and pseudo-random embeddings instead of the models")
+    parser.add_argument('--stand_in_token_delay', type=float, default=0.01, help="Delay between the streamed characters of the stand-in LLM (seconds)")
+    parser.add_argument('--output_path', type=str, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(create_chatbot_pipeline(args), port=args.port)
+    else:
+        target = EndpointTarget(args.endpoint_url) if args.endpoint_url else InProcessTarget(create_chatbot_pipeline(args))
+        conversations = load_conversations(args.conversations_path)
+        runs = []
+        for arrival_rate in args.arrival_rates:
+            records, wall_seconds, max_active_users = run_load(target, conversations, args.n_users, arrival_rate, args.think_time)
+            summary = summarize_records(records, wall_seconds, max_active_users)
+            summary['arrival_rate'] = arrival_rate
+            runs.append(summary)
+            ttft = summary['latency_seconds'].get('ttft', {})
+            logger.info(f"{arrival_rate} users/s (up to {max_active_users} concurrent users): {summary['turns_per_second'] or 0:.2f} turns/s, "
+                        f"TTFT p50/p95/p99 {'/'.join(f'{v:.2f}' if v is not None else '-' for v in ttft.values())}s, error rate {summary['error_rate']:.1%}")
+        output_path = save_results("conversation_replay", {'target': args.endpoint_url or 'in-process', 'n_users': args.n_users,
+                                                           'think_time': args.think_time, 'runs': runs}, args.output_path)
+        logger.info(f"Results saved to {output_path}")
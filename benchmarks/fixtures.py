@@ -0,0 +1,129 @@
+from pathlib import Path
+import hashlib
+import random
+
+WORDS = ("cell neuron protein signal brain memory gene expression receptor cortex synapse mouse model response activity "
+         "pathway tissue structure function development evolution species fossil sample analysis data result method "
+         "control increase decrease level region network behaviour learning immune infection virus host growth").split()
+
+SECTION_TITLES = ('Introduction', 'Results', 'Discussion', 'Methods')
+
+
+def generate_sentence(generator, n_words=None):
+    n_words = n_words or generator.randint(8, 25)
+    words = [generator.choice(WORDS) for _ in range(n_words)]
+    return ' '.join(words).capitalize() + '.'
+
+
+def generate_paragraph(generator, n_sentences=None):
+    return ' '.join(generate_sentence(generator) for _ in range(n_sentences or generator.randint(3, 8)))
+
+
+def generate_title(generator):
+    return generate_sentence(generator, generator.randint(6, 12)).rstrip('.')
+
+
+def generate_jats_xml(index, n_paragraphs=12, seed=0):
+    """
+    Generates a JATS XML article (title, copyright year and body sections of paragraphs) like the eLife articles
+    """
+    generator = random.Random(seed * 1000003 + index)
+    sections = []
+    for section_title in SECTION_TITLES:
+        paragraphs = ''.join(f"<p>{generate_paragraph(generator)}</p>" for _ in range(max(1, n_paragraphs // len(SECTION_TITLES))))
+        sections.append(f"<sec><title>{section_title}</title>{paragraphs}</sec>")
+    return (f'<?xml version="1.0" encoding="UTF-8"?><article><front><article-meta><title-group><article-title>{generate_title(generator)}'
+            f'</article-title></title-group><permissions><copyright-year>{2012 + index % 12}</copyright-year></permissions>'
+            f'</article-meta></front><body>{"".join(sections)}</body><back><ref-list><title>References</title>'
+            f'<ref><mixed-citation>{generate_sentence(generator)}</mixed-citation></ref></ref-list></back></article>')
+
+
+def generate_pdf(pdf_path, index, n_pages=6, seed=0):
+    """
+    Writes a preprint-like PDF (running header, page numbers, body sections and a references section) with PyMuPDF
+    """
+    import fitz
+    generator = random.Random(seed * 1000003 + index)
+    title = generate_title(generator)
+    document = fitz.open()
+    document.set_metadata({'title': title, 'creationDate': f"D:{2020 + index % 4}0101000000"})
+    for page_number in range(1, n_pages + 1):
+        page = document.new_page()
+        lines = [f"bioRxiv preprint doi: 10.1101/{index:06d}", ""]
+        if page_number == 1:
+            lines += [title, ""]
+        section_title = SECTION_TITLES[min(len(SECTION_TITLES) - 1, (page_number - 1) * len(SECTION_TITLES) // n_pages)]
+        lines += [section_title] + [generate_sentence(generator) for _ in range(20)]
+        if page_number == n_pages:
+            lines += ["References"] + [generate_sentence(generator) for _ in range(8)]
+        lines += ["", str(page_number)]
+        page.insert_textbox(fitz.Rect(50, 40, 560, 800), '\n'.join(lines), fontsize=8)
+    document.save(str(pdf_path))
+    document.close()
+
+
+def generate_parquet(parquet_path, n_rows, seed=0, row_group_size=1024):
+    """
+    Writes a parquet file with the columns of the eLife lay summaries dataset
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    generator = random.Random(seed)
+    columns = {'article': [], 'summary': [], 'section_headings': [], 'keywords': [], 'year': [], 'title': []}
+    for _ in range(n_rows):
+        columns['article'].append(' '.join(generate_paragraph(generator) for _ in range(6)))
+        columns['summary'].append(generate_paragraph(generator, 6))
+        columns['section_headings'].append(', '.join(SECTION_TITLES))
+        columns['keywords'].append(', '.join(generator.sample(WORDS, 3)))
+        columns['year'].append(str(generator.randint(2012, 2023)))
+        columns['title'].append(generate_title(generator))
+    pq.write_table(pa.table(columns), str(parquet_path), row_group_size=row_group_size)
+
+
+def generate_fixtures(fixtures_dir_path, n_documents, n_pdf_pages=6, seed=0):
+    """
+    Writes `n_documents` JATS XML articles, PDFs and parquet rows into a folder (generated once per folder) and returns their paths
+    """
+    fixtures_dir_path = Path(fixtures_dir_path)
+    xml_dir_path, pdf_dir_path = fixtures_dir_path / 'xml', fixtures_dir_path / 'pdf'
+    parquet_path = fixtures_dir_path / 'data.parquet'
+    if not parquet_path.is_file():
+        xml_dir_path.mkdir(parents=True, exist_ok=True)
+        pdf_dir_path.mkdir(parents=True, exist_ok=True)
+        for index in range(n_documents):
+            (xml_dir_path / f'article_{index:06d}.xml').write_text(generate_jats_xml(index, seed=seed))
+            generate_pdf(pdf_dir_path / f'preprint_{index:06d}.pdf', index, n_pages=n_pdf_pages, seed=seed)
+        generate_parquet(parquet_path, n_documents, seed=seed)
+    return {'xml': sorted(xml_dir_path.glob('*.xml')), 'pdf': sorted(pdf_dir_path.glob('*.pdf')), 'parquet': parquet_path}
+
+
+class StandInSummarizer:
+    """
+    A lightweight stand-in for TextSummarizer (same interface): the summary is the first sentences of the text
+    """
+    def __init__(self, n_words=120):
+        self.n_words = n_words
+
+    def count_tokens(self, text):
+        return len(text.split())
+
+    def summarize_by_batch(self, text):
+        return ' '.join(text.split()[:self.n_words])
+
+
+class StandInEmbeddings:
+    """
+    A lightweight stand-in for the embedding function (same interface): deterministic normalized pseudo-random vectors
+    seeded by the hash of the text
+    """
+    def __init__(self, dimension=1024):
+        self.dimension = dimension
+
+    def embed_query(self, text):
+        import numpy as np
+        seed = int.from_bytes(hashlib.sha1(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
@@ -0,0 +1,130 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import multiprocessing
+import argparse
+import resource
+import sys
+import tempfile
+import time
+import logging
+from benchmarks.common import save_results
+from benchmarks.fixtures import generate_fixtures
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("IngestionBenchmark")
+
+STAGES = ('xml', 'pdf', 'parquet', 'parquet_batches', 'documents', 'vector_store')
+
+
+def get_peak_rss_mib():
+    """
+    Peak resident set size of the current process (ru_maxrss is in KiB on Linux and in bytes on macOS)
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 2**20 if sys.platform == 'darwin' else peak_rss / 2**10
+
+
+def prepare_stage(stage, fixtures, work_dir_path):
+    """
+    Loads the fixtures needed by a stage and returns the function running the stage (which returns the number of items processed)
+    """
+    from benchmarks.fixtures import StandInSummarizer, StandInEmbeddings
+    from src.handlers import XMLDataHandler, PDFDataHandler, ParquetDataHandler, ParquetBatchDataHandler, DocumentCreator
+    summarizer = StandInSummarizer()
+
+    if stage == 'xml':
+        fetched_data = [{'url': str(path), 'content': path.read_text()} for path in fixtures['xml']]
+        return lambda: len(XMLDataHandler(summarizer=summarizer, fetched_data=fetched_data).process_fetched_data())
+
+    if stage == 'pdf':
+        from src.fetchers import BiorxivDataFetcher
+        biorxiv_data_fetcher = BiorxivDataFetcher(categories=[], start_date=None, end_date=None, n_files=len(fixtures['pdf']))
+        def run():
+            # the PDFs are parsed page by page while they are processed, as in the pipeline
+            fetched_data = [{'url': str(path), 'content': biorxiv_data_fetcher.fetch_pdf_content(str(path))} for path in fixtures['pdf']]
+            return len(PDFDataHandler(summarizer=summarizer, fetched_data=fetched_data).process_fetched_data())
+        return run
+
+    if stage == 'parquet':
+        import pyarrow.parquet as pq
+        fetched_data = pq.read_table(str(fixtures['parquet'])).to_pylist()
+        return lambda: len(ParquetDataHandler(fetched_data=fetched_data).process_fetched_data())
+
+    if stage == 'parquet_batches':
+        import pyarrow.parquet as pq
+        def run():
+            record_batches = pq.ParquetFile(str(fixtures['parquet'])).iter_batches(batch_size=1024, columns=['summary', 'year', 'title'])
+            return sum(1 for _ in ParquetBatchDataHandler(record_batches=record_batches).process_fetched_data())
+        return run
+
+    import pyarrow.parquet as pq
+    processed_data = pq.read_table(str(fixtures['parquet']), columns=['summary', 'year', 'title']).to_pylist()
+    for item in processed_data:
+        item['source'] = str(fixtures['parquet'])
+
+    if stage == 'documents':
+        return lambda: len(DocumentCreator(processed_data).create_documents_from_data())
+
+    if stage == 'vector_store':
+        from src.vector_store import VectorStoreBuilder
+        # the pipeline writes the records as they are, without creating Document objects
+        documents = list(DocumentCreator(processed_data).iter_records())
+        def run():
+            VectorStoreBuilder(documents=documents, embedding_function=StandInEmbeddings(), vector_store_dir_path=str(work_dir_path / 'chroma')).build_vector_store()
+            return len(documents)
+        return run
+
+    raise ValueError(f"Unknown stage '{stage}', expected one of {STAGES}")
+
+
+def measure_stage(stage, fixtures, work_dir_path):
+    """
+    Runs one stage (in a fresh worker process, so that its peak RSS is its own) and returns its time, throughput and memory
+    """
+    logging.disable(logging.INFO)
+    run = prepare_stage(stage, fixtures, Path(work_dir_path))
+    setup_peak_rss_mib = get_peak_rss_mib()
+    start = time.perf_counter()
+    n_items = run()
+    seconds = time.perf_counter() - start
+    peak_rss_mib = get_peak_rss_mib()
+    return {'stage': stage, 'n_items': n_items, 'seconds': seconds, 'items_per_second': n_items / seconds if seconds else None,
+            'peak_rss_mib': peak_rss_mib, 'stage_rss_growth_mib': peak_rss_mib - setup_peak_rss_mib}
+
+
+def run_benchmark(scales, stages, fixtures_dir_path, n_pdf_pages):
+    """
+    Measures every stage at every scale and adds the scaling efficiency (throughput relative to the smallest scale)
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for n_documents in scales:
+        fixtures = generate_fixtures(Path(fixtures_dir_path) / f'{n_documents}_documents', n_documents, n_pdf_pages=n_pdf_pages)
+        for stage in stages:
+            with tempfile.TemporaryDirectory() as work_dir_path, ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(measure_stage, stage, fixtures, work_dir_path).result()
+            result['n_documents'] = n_documents
+            results.append(result)
+            logger.info(f"{stage} ({n_documents} documents): {result['items_per_second']:.1f} items/s, {result['seconds']:.2f}s, "
+                        f"peak RSS {result['peak_rss_mib']:.0f} MiB (+{result['stage_rss_growth_mib']:.0f} MiB during the stage)")
+
+    for stage in stages:
+        stage_results = [result for result in results if result['stage'] == stage]
+        for result in stage_results:
+            result['scaling_efficiency'] = result['items_per_second'] / stage_results[0]['items_per_second'] if stage_results[0]['items_per_second'] else None
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage ingestion throughput, peak RSS and scaling on synthetic XML, PDF and parquet fixtures")
+    parser.add_argument('--scales', type=int, nargs='+', default=[10, 100, 1000], help="Numbers of documents per source")
+    parser.add_argument('--stages', type=str, nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--n_pdf_pages', type=int, default=6)
+    parser.add_argument('--fixtures_dir_path', type=str, default=None, help="Folder where the fixtures are generated and kept between runs (default: temporary)")
+    parser.add_argument('--output_path', type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_dir_path:
+        results = run_benchmark(args.scales, args.stages, args.fixtures_dir_path or temporary_dir_path, args.n_pdf_pages)
+    output_path = save_results("ingestion", {'scales': args.scales, 'n_pdf_pages': args.n_pdf_pages, 'runs': results}, args.output_path)
+    logger.info(f"Results saved to {output_path}")
@@ -0,0 +1,75 @@
+import argparse
+import tempfile
+import time
+import logging
+from benchmarks.common import percentiles, save_results
+from src.quantized_store import QuantizedVectorStore, VectorQuantizer
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("QuantizedStoreBenchmark")
+
+
+def generate_vectors(n_vectors, dimension, seed=0):
+    """
+    Generates L2-normalized vectors (clustered, so that neighbours are not all at the same distance)
+    """
+    import numpy as np
+    generator = np.random.default_rng(seed)
+    centers = generator.normal(size=(max(1, n_vectors // 100), dimension)).astype(np.float32)
+    vectors = centers[generator.integers(0, len(centers), n_vectors)] + 0.5 * generator.normal(size=(n_vectors, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def run_benchmark(vectors, queries, k, rescore_factors, modes):
+    """
+    Measures memory, query latency and recall@k against exact brute force search for each mode and rescoring factor
+    """
+    import numpy as np
+    exact_ids = [set(np.argsort(-(vectors @ query))[:k].tolist()) for query in queries]
+    documents = [{'page_content': "", 'metadata': {'id': i}} for i in range(len(vectors))]
+    results = []
+    for mode in modes:
+        with tempfile.TemporaryDirectory() as store_dir_path:
+            QuantizedVectorStore.build(vectors, documents, store_dir_path, mode)
+            quantized_vector_store = QuantizedVectorStore(store_dir_path, embedding_function=None)
+            memory = quantized_vector_store.memory_report()
+            for rescore_factor in rescore_factors:
+                latencies, recalls = [], []
+                for query, exact in zip(queries, exact_ids):
+                    start = time.perf_counter()
+                    candidate_ids, _ = quantized_vector_store.get_shortlist(query, k * rescore_factor)
+                    latencies.append(time.perf_counter() - start)
+                    recalls.append(len(exact & set(candidate_ids[:k].tolist())) / k)
+                # rescore_factor 1 only reorders the k candidates found on the compressed vectors (exact scores on the float32 vectors)
+                results.append({'mode': mode, 'rescore_factor': rescore_factor, f'recall@{k}': float(np.mean(recalls)),
+                                'latency_seconds': percentiles(latencies), **memory})
+                logger.info(f"{mode} (rescore x{rescore_factor}): recall@{k} {np.mean(recalls):.4f}, p50 {results[-1]['latency_seconds']['p50'] * 1000:.2f} ms, "
+                            f"{memory['codes_bytes'] / 2**20:.1f} MiB resident vs {memory['float32_bytes'] / 2**20:.1f} MiB float32 ({memory['compression_ratio']:.1f}x), "
+                            f"{memory['disk_bytes'] / 2**20:.1f} MiB on disk")
+
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        np.argsort(-(vectors @ query))[:k]
+        latencies.append(time.perf_counter() - start)
+    results.append({'mode': 'float32 (exact)', f'recall@{k}': 1.0, 'latency_seconds': percentiles(latencies),
+                    'float32_bytes': vectors.nbytes, 'n_vectors': len(vectors)})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory and recall@k of the float16/int8 quantized vector store against float32")
+    parser.add_argument('--n_vectors', type=int, default=100000)
+    parser.add_argument('--dimension', type=int, default=1024)
+    parser.add_argument('--n_queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rescore_factors', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--modes', type=str, nargs='+', default=list(VectorQuantizer.MODES), choices=list(VectorQuantizer.MODES))
+    parser.add_argument('--output_path', type=str, default=None)
+    args = parser.parse_args()
+
+    vectors = generate_vectors(args.n_vectors + args.n_queries, args.dimension)
+    vectors, queries = vectors[:args.n_vectors], vectors[args.n_vectors:]
+    results = run_benchmark(vectors, queries, args.k, args.rescore_factors, args.modes)
+    output_path = save_results("quantized_store", {'n_vectors': args.n_vectors, 'dimension': args.dimension, 'k': args.k, 'runs': results}, args.output_path)
+    logger.info(f"Results saved to {output_path}")
@@ -0,0 +1,251 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import multiprocessing
+import argparse
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import logging
+from benchmarks.common import percentiles, save_results
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("RetrievalScalingBenchmark")
+
+CONFIGS = ('chroma', 'float16', 'int8', 'cascade', 'sharded')
+
+
+class LookupEmbeddings:
+    """
+    An embedding function returning the precomputed vectors of the benchmark queries (queries are named 'query-<index>'),
+    so that every store is queried through its usual text interface without running an embedding model
+    """
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_query(self, text):
+        return self.vectors[int(text.split('-')[1])].tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def generate_corpus(data_dir_path, n_vectors, n_queries, dimension, k, fast_dimension=384, seed=0, chunk_size=50000):
+    """
+    Writes clustered L2-normalized vectors, queries, their exact top-k (brute force) and the vectors of a smaller 'fast' model
+    (a random projection of the main vectors) as .npy files, chunk by chunk so that 1M vectors do not have to fit in memory twice
+    """
+    import numpy as np
+    data_dir_path = Path(data_dir_path)
+    if (data_dir_path / 'exact_ids.npy').is_file():
+        return data_dir_path
+    data_dir_path.mkdir(parents=True, exist_ok=True)
+    generator = np.random.default_rng(seed)
+    centers = generator.normal(size=(max(1, n_vectors // 100), dimension)).astype(np.float32)
+    projection = (generator.normal(size=(dimension, fast_dimension)) / np.sqrt(fast_dimension)).astype(np.float32)
+
+    def sample(n):
+        vectors = centers[generator.integers(0, len(centers), n)] + 0.5 * generator.normal(size=(n, dimension)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def project(vectors):
+        fast_vectors = vectors @ projection
+        return fast_vectors / np.linalg.norm(fast_vectors, axis=1, keepdims=True)
+
+    queries = sample(n_queries)
+    vectors = np.lib.format.open_memmap(data_dir_path / 'vectors.npy', mode='w+', dtype=np.float32, shape=(n_vectors, dimension))
+    fast_vectors = np.lib.format.open_memmap(data_dir_path / 'fast_vectors.npy', mode='w+', dtype=np.float32, shape=(n_vectors, fast_dimension))
+    best_scores = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    best_ids = np.zeros((n_queries, k), dtype=np.int64)
+    for start in range(0, n_vectors, chunk_size):
+        chunk = sample(min(chunk_size, n_vectors - start))
+        vectors[start:start + len(chunk)] = chunk
+        fast_vectors[start:start + len(chunk)] = project(chunk)
+        # running exact top-k over the chunks
+        scores = np.concatenate([best_scores, queries @ chunk.T], axis=1)
+        ids = np.concatenate([best_ids, np.broadcast_to(np.arange(start, start + len(chunk)), (n_queries, len(chunk)))], axis=1)
+        top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        best_scores, best_ids = np.take_along_axis(scores, top, axis=1), np.take_along_axis(ids, top, axis=1)
+    vectors.flush()
+    fast_vectors.flush()
+    np.save(data_dir_path / 'queries.npy', queries)
+    np.save(data_dir_path / 'fast_queries.npy', project(queries))
+    np.save(data_dir_path / 'exact_ids.npy', best_ids)
+    return data_dir_path
+
+
+def get_rss_mib(pid='self'):
+    """
+    Current resident set size of a process (Linux only, None elsewhere)
+    """
+    try:
+        with open(f'/proc/{pid}/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+def get_size_on_disk_mib(dir_path):
+    return sum(path.stat().st_size for path in Path(dir_path).rglob('*') if path.is_file()) / 2**20
+
+
+def iter_document_batches(vectors, batch_size=5000):
+    for start in range(0, len(vectors), batch_size):
+        ids = range(start, min(start + batch_size, len(vectors)))
+        yield ([str(i) for i in ids], vectors[start:start + len(ids)].tolist(), [f"document {i}" for i in ids], [{'id': i} for i in ids])
+
+
+def build_store(config, data_dir_path, store_dir_path, n_shards):
+    """
+    Builds the store of a configuration from the corpus vectors (inserted directly, without embedding anything)
+    """
+    import numpy as np
+    from src.vector_store import import_chroma
+    vectors = np.load(data_dir_path / 'vectors.npy', mmap_mode='r')
+
+    if config == 'chroma':
+        Chroma = import_chroma()
+        collection = Chroma(persist_directory=str(store_dir_path))._collection
+        for ids, embeddings, documents, metadatas in iter_document_batches(vectors):
+            collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    elif config == 'sharded':
+        from src.sharded_store import ShardedVectorStore
+        Chroma = import_chroma()
+        collections = [Chroma(persist_directory=str(ShardedVectorStore.get_shard_dir_path(store_dir_path, shard_index)))._collection
+                       for shard_index in range(n_shards)]
+        for ids, embeddings, documents, metadatas in iter_document_batches(vectors):
+            for shard_index, collection in enumerate(collections):
+                # round-robin partition of the ids (what the hash partition tends to on uniform ids)
+                collection.upsert(ids=ids[shard_index::n_shards], embeddings=embeddings[shard_index::n_shards],
+                                  documents=documents[shard_index::n_shards], metadatas=metadatas[shard_index::n_shards])
+        ShardedVectorStore.write_manifest(store_dir_path, n_shards, 'hash')
+
+    elif config in ('float16', 'int8'):
+        from src.quantized_store import QuantizedVectorStore
+        documents = ({'page_content': f"document {i}", 'metadata': {'id': i}} for i in range(len(vectors)))
+        QuantizedVectorStore.build(vectors, documents, store_dir_path, config)
+
+    elif config == 'cascade':
+        store_dir_path.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(data_dir_path / 'vectors.npy', store_dir_path / 'vectors.npy')
+        shutil.copyfile(data_dir_path / 'fast_vectors.npy', store_dir_path / 'fast_vectors.npy')
+        with open(store_dir_path / 'documents.jsonl', 'w') as file:
+            for i in range(len(vectors)):
+                file.write(json.dumps({'page_content': f"document {i}", 'metadata': {'id': i}}) + '\n')
+
+    else:
+        raise ValueError(f"Unknown configuration '{config}', expected one of {CONFIGS}")
+
+
+def open_store(config, data_dir_path, store_dir_path, cascade_n_candidates, n_shards):
+    import numpy as np
+    from src.vector_store import DocumentRetriever
+    embedding_function = LookupEmbeddings(np.load(data_dir_path / 'queries.npy'))
+    if config == 'cascade':
+        from src.cascade_store import CascadeVectorStore
+        fast_embedding_function = LookupEmbeddings(np.load(data_dir_path / 'fast_queries.npy'))
+        return CascadeVectorStore(store_dir_path, embedding_function, fast_embedding_function, n_candidates=cascade_n_candidates)
+    if config in ('float16', 'int8'):
+        from src.quantized_store import QuantizedVectorStore
+        return QuantizedVectorStore(store_dir_path, embedding_function)
+    return DocumentRetriever.load_vector_store(embedding_function, str(store_dir_path), vector_storage=config, sharded_store_dir_path=str(store_dir_path),
+                                               n_shards=n_shards, shard_by='hash')
+
+
+def measure_config(config, data_dir_path, k, mmr_k, concurrency_levels, n_shards, cascade_n_candidates):
+    """
+    Builds and opens the store of a configuration (in a fresh worker process), then measures its size, latency, throughput and recall
+    """
+    import numpy as np
+    logging.disable(logging.INFO)
+    data_dir_path = Path(data_dir_path)
+    exact_ids = np.load(data_dir_path / 'exact_ids.npy')
+    queries = [f"query-{i}" for i in range(len(exact_ids))]
+    with tempfile.TemporaryDirectory() as temporary_dir_path:
+        store_dir_path = Path(temporary_dir_path) / config
+        start = time.perf_counter()
+        build_store(config, data_dir_path, store_dir_path, n_shards)
+        build_seconds = time.perf_counter() - start
+        size_on_disk_mib = get_size_on_disk_mib(store_dir_path)
+
+        # the store modules are imported first, so that the RAM measured is the one of the opened index
+        for module_name in ('src.vector_store', 'src.quantized_store', 'src.cascade_store'):
+            importlib.import_module(module_name)
+        rss_before_mib = get_rss_mib()
+        store = open_store(config, data_dir_path, store_dir_path, cascade_n_candidates, n_shards)
+
+        recalls, search_latencies = [], []
+        for query, exact in zip(queries, exact_ids):
+            start = time.perf_counter()
+            documents = store.similarity_search(query, k=k)
+            search_latencies.append(time.perf_counter() - start)
+            recalls.append(len(set(exact.tolist()) & {document.metadata['id'] for document in documents}) / k)
+
+        # MMR search with the settings of DocumentRetriever (fetch_k = k + 4)
+        def mmr_search(query):
+            start = time.perf_counter()
+            store.max_marginal_relevance_search(query, k=mmr_k, fetch_k=mmr_k + 4, lambda_mult=0.5)
+            return time.perf_counter() - start
+        mmr_latencies = [mmr_search(query) for query in queries]
+
+        throughput = {}
+        for concurrency in concurrency_levels:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                start = time.perf_counter()
+                list(executor.map(mmr_search, queries))
+                throughput[str(concurrency)] = len(queries) / (time.perf_counter() - start)
+
+        ram_mib = None
+        if rss_before_mib is not None:
+            # the shards are searched by worker processes, whose memory counts for the store
+            worker_pids = [pid for executor in getattr(store, 'executors', []) for pid in executor._processes]
+            ram_mib = get_rss_mib() - rss_before_mib + sum(get_rss_mib(pid) or 0 for pid in worker_pids)
+        if hasattr(store, 'close'):
+            store.close()
+
+    return {'config': config, 'build_seconds': build_seconds, 'size_on_disk_mib': size_on_disk_mib, 'ram_mib': ram_mib,
+            f'recall@{k}': float(np.mean(recalls)), 'search_latency_seconds': percentiles(search_latencies),
+            'mmr_latency_seconds': percentiles(mmr_latencies), 'mmr_queries_per_second': throughput}
+
+
+def run_benchmark(scales, configs, work_dir_path, n_queries, dimension, k, mmr_k, concurrency_levels, n_shards, cascade_n_candidates):
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for n_vectors in scales:
+        data_dir_path = generate_corpus(Path(work_dir_path) / f'{n_vectors}_vectors', n_vectors, n_queries, dimension, k)
+        for config in configs:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(measure_config, config, str(data_dir_path), k, mmr_k, concurrency_levels, n_shards, cascade_n_candidates).result()
+            result['n_vectors'] = n_vectors
+            results.append(result)
+            logger.info(f"{config} ({n_vectors} vectors): built in {result['build_seconds']:.1f}s, {result['size_on_disk_mib']:.0f} MiB on disk, "
+                        f"{result['ram_mib'] or 0:.0f} MiB in RAM, recall@{k} {result[f'recall@{k}']:.3f}, MMR p50/p95/p99 "
+                        f"{'/'.join(f'{v * 1000:.1f}' for v in result['mmr_latency_seconds'].values())} ms, "
+                        f"QPS {', '.join(f'{qps:.0f} (x{c})' for c, qps in result['mmr_queries_per_second'].items())}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build time, size, latency, throughput and recall@k of every retriever configuration at several corpus scales")
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--configs', type=str, nargs='+', default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument('--dimension', type=int, default=1024)
+    parser.add_argument('--n_queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10, help="Number of neighbours of the recall@k")
+    parser.add_argument('--mmr_k', type=int, default=2, help="Number of documents returned by the MMR search (n_docs)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help="Numbers of concurrent MMR queries")
+    parser.add_argument('--n_shards', type=int, default=4)
+    parser.add_argument('--cascade_n_candidates', type=int, default=50)
+    parser.add_argument('--work_dir_path', type=str, default=None, help="Folder where the corpora are generated and kept between runs (default: temporary)")
+    parser.add_argument('--output_path', type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_dir_path:
+        results = run_benchmark(args.scales, args.configs, args.work_dir_path or temporary_dir_path, args.n_queries, args.dimension,
+                                args.k, args.mmr_k, args.concurrency, args.n_shards, args.cascade_n_candidates)
+    output_path = save_results("retrieval_scaling", {'scales': args.scales, 'dimension': args.dimension, 'n_queries': args.n_queries,
+                                                     'k': args.k, 'mmr_k': args.mmr_k, 'runs': results}, args.output_path)
+    logger.info(f"Results saved to {output_path}")
@@ -0,0 +1,68 @@
+import argparse
+import time
+import logging
+from benchmarks.common import rouge_scores, save_results
+from benchmarks.summarizer_prefilter import load_articles
+from src.handlers import XMLDataHandler
+from src.summarizer import TextSummarizer
+from src.utils import Settings
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("SummarizerBackendBenchmark")
+
+
+def run_backend(backend, texts, hf_summarizer_model_path, intra_op_threads):
+    """
+    Summarizes the texts with one backend and returns the summaries with the load time and the throughput
+    """
+    start = time.perf_counter()
+    summarizer = TextSummarizer(force_cache=False, hf_summarizer_model_path=hf_summarizer_model_path, backend=backend,
+                                intra_op_threads=intra_op_threads)
+    load_seconds = time.perf_counter() - start
+
+    input_tokens = sum(summarizer.count_tokens(text) for text in texts)
+    start = time.perf_counter()
+    summaries = [summarizer.summarize_by_batch(text) for text in texts]
+    seconds = time.perf_counter() - start
+    return summaries, {'backend': backend, 'intra_op_threads': intra_op_threads, 'load_seconds': load_seconds, 'seconds': seconds,
+                       'input_tokens': input_tokens, 'input_tokens_per_second': input_tokens / seconds if seconds else None}
+
+
+def run_benchmark(texts, hf_summarizer_model_path, backends, threads):
+    """
+    Runs every backend at every thread count and scores the agreement (ROUGE) of their summaries with the fp32 summaries
+    """
+    reference_summaries, reference_result = run_backend('fp32', texts, hf_summarizer_model_path, threads[0])
+    results = [reference_result]
+    for backend in backends:
+        for intra_op_threads in threads:
+            if backend == 'fp32' and intra_op_threads == threads[0]:
+                continue
+            summaries, result = run_backend(backend, texts, hf_summarizer_model_path, intra_op_threads)
+            scores = [rouge_scores(reference, summary) for reference, summary in zip(reference_summaries, summaries)]
+            result.update({metric: sum(score[metric] for score in scores) / len(scores) for metric in scores[0]})
+            results.append(result)
+
+    for result in results:
+        result['speedup'] = reference_result['seconds'] / result['seconds'] if result['seconds'] else None
+        logger.info(f"{result['backend']} ({result['intra_op_threads']} threads): {result['input_tokens_per_second']:.1f} input tokens/s "
+                    f"({result['speedup']:.2f}x), ROUGE-1/2/L vs fp32: {result.get('rouge1', 1.0):.3f}/{result.get('rouge2', 1.0):.3f}/{result.get('rougeL', 1.0):.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and agreement (vs fp32) benchmark of the summarizer inference backends")
+    parser.add_argument('--n_files', type=int, default=3, help="Number of XML articles to summarize (default: 3)")
+    parser.add_argument('--xml_dir_path', type=str, default=None, help="Folder of eLife XML articles (default: fetched from GitHub)")
+    parser.add_argument('--backends', type=str, nargs='+', default=['fp32', 'int8'], choices=list(TextSummarizer.BACKENDS))
+    parser.add_argument('--threads', type=int, nargs='+', default=[None], help="Intra-op thread counts to run each backend with")
+    parser.add_argument('--output_path', type=str, default=None)
+    args = parser.parse_args()
+
+    settings = Settings()
+    articles = load_articles(args.xml_dir_path, args.n_files)
+    xml_data_handler = XMLDataHandler(summarizer=None, fetched_data=articles)
+    texts = [xml_data_handler.get_paragraphs_from_xml(article['content']) for article in articles]
+    results = run_benchmark(texts, settings.HF_SUMMARIZER_MODEL_PATH, args.backends, args.threads)
+    output_path = save_results("summarizer_backend", {'n_articles': len(texts), 'runs': results}, args.output_path)
+    logger.info(f"Results saved to {output_path}")
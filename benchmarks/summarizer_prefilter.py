@@ -0,0 +1,72 @@
+from pathlib import Path
+import argparse
+import time
+import logging
+from benchmarks.common import rouge_scores, save_results
+from src.fetchers import GithubDataFetcher
+from src.handlers import XMLDataHandler
+from src.summarizer import TextSummarizer, ExtractiveCondenser
+from src.utils import Settings
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("SummarizerPrefilterBenchmark")
+
+
+def load_articles(xml_dir_path, n_files):
+    """
+    Loads eLife XML articles from a local folder, or fetches them from the eLife GitHub repository
+    """
+    if xml_dir_path:
+        return [{'url': str(path), 'content': path.read_text()} for path in sorted(Path(xml_dir_path).glob('*.xml'))[:n_files]]
+    github_data_fetcher = GithubDataFetcher(owner='elifesciences', repo='elife-article-xml', path='articles', n_files=n_files)
+    return github_data_fetcher.fetch_data()
+
+
+def run_benchmark(articles, summarizer, budgets):
+    """
+    Summarizes every article with the extractive pre-stage off and at each token budget, measuring the time and the
+    ROUGE agreement of each summary with the summary of the full text
+    """
+    xml_data_handler = XMLDataHandler(summarizer=summarizer, fetched_data=articles)
+    texts = [xml_data_handler.get_paragraphs_from_xml(article['content']) for article in articles]
+
+    reference_summaries = []
+    start = time.perf_counter()
+    for text in texts:
+        reference_summaries.append(summarizer.summarize_by_batch(text))
+    results = [{'token_budget': None, 'seconds': time.perf_counter() - start,
+                'input_tokens': sum(summarizer.count_tokens(text) for text in texts)}]
+
+    for budget in budgets:
+        condenser = ExtractiveCondenser(token_budget=budget, count_tokens=summarizer.count_tokens)
+        start = time.perf_counter()
+        condensed_texts = [condenser.condense(text) for text in texts]
+        condense_seconds = time.perf_counter() - start
+        summaries = [summarizer.summarize_by_batch(text) for text in condensed_texts]
+        scores = [rouge_scores(reference, summary) for reference, summary in zip(reference_summaries, summaries)]
+        results.append({'token_budget': budget, 'seconds': time.perf_counter() - start, 'condense_seconds': condense_seconds,
+                        'input_tokens': sum(summarizer.count_tokens(text) for text in condensed_texts),
+                        **{metric: sum(score[metric] for score in scores) / len(scores) for metric in scores[0]}})
+
+    for result in results:
+        speedup = results[0]['seconds'] / result['seconds'] if result['seconds'] else float('nan')
+        result['speedup'] = speedup
+        logger.info(f"token_budget={result['token_budget']}: {result['seconds']:.1f}s ({speedup:.2f}x), {result['input_tokens']} input tokens, "
+                    f"ROUGE-1/2/L vs full text: {result.get('rouge1', 1.0):.3f}/{result.get('rouge2', 1.0):.3f}/{result.get('rougeL', 1.0):.3f}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the extractive pre-stage of the summarizer (ingestion time and summary agreement)")
+    parser.add_argument('--n_files', type=int, default=5, help="Number of XML articles to summarize (default: 5)")
+    parser.add_argument('--xml_dir_path', type=str, default=None, help="Folder of eLife XML articles (default: fetched from GitHub)")
+    parser.add_argument('--budgets', type=int, nargs='+', default=[1024, 2048, 4096], help="Token budgets of the extractive pre-stage")
+    parser.add_argument('--output_path', type=str, default=None)
+    args = parser.parse_args()
+
+    settings = Settings()
+    summarizer = TextSummarizer(force_cache=False, hf_summarizer_model_path=settings.HF_SUMMARIZER_MODEL_PATH)
+    articles = load_articles(args.xml_dir_path, args.n_files)
+    results = run_benchmark(articles, summarizer, args.budgets)
+    output_path = save_results("summarizer_prefilter", {'n_articles': len(articles), 'runs': results}, args.output_path)
+    logger.info(f"Results saved to {output_path}")
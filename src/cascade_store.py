@@ -0,0 +1,129 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import logging
+from src.utils import DataUtils
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+
+class CascadeVectorStore(VectorStore):
+    """
+    A read-only two-stage vector store: a small fast embedding model searches its own index for a wide candidate set,
+    then only the candidates are rescored on their stored vectors of the main embedding model (one main query embedding)
+    """
+    def __init__(self, store_dir_path, embedding_function, fast_embedding_function, n_candidates=50):
+        import numpy as np
+        self.store_dir_path = Path(store_dir_path)
+        self.embedding_function = embedding_function
+        self.fast_embedding_function = fast_embedding_function
+        self.n_candidates = n_candidates
+        self.fast_vectors = np.load(self.store_dir_path / 'fast_vectors.npy')
+        self.vectors = np.load(self.store_dir_path / 'vectors.npy', mmap_mode='r')
+        with open(self.store_dir_path / 'documents.jsonl') as file:
+            self.documents = [json.loads(line) for line in file]
+        # the two query embeddings are computed concurrently
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="CascadeEmbedding")
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"CascadeVectorStore loaded from {self.store_dir_path} ({len(self.documents)} documents, "
+                         f"fast dimension: {self.fast_vectors.shape[1]}, main dimension: {self.vectors.shape[1]})")
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @classmethod
+    def build_from_chroma(cls, chroma_vector_store, fast_embedding_function, store_dir_path, batch_size=256, fingerprint=None):
+        """
+        Exports the main vectors and documents of a Chroma vector store and embeds the documents with the fast model, recording
+        the fingerprint of the collection last (so that an interrupted export is out of date)
+        """
+        import numpy as np
+        store_dir_path = Path(store_dir_path)
+        store_dir_path.mkdir(parents=True, exist_ok=True)
+        collection = chroma_vector_store._collection
+        fingerprint = fingerprint or DataUtils.get_collection_fingerprint(collection)
+        DataUtils.clear_fingerprint(store_dir_path)
+        vectors, fast_vectors = [], []
+        with open(store_dir_path / 'documents.jsonl', 'w') as file:
+            for start in range(0, collection.count(), batch_size):
+                batch = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=batch_size, offset=start)
+                vectors.append(np.asarray(batch['embeddings'], dtype=np.float32))
+                fast_vectors.append(np.asarray(fast_embedding_function.embed_documents(batch['documents']), dtype=np.float32))
+                for text, metadata in zip(batch['documents'], batch['metadatas']):
+                    file.write(json.dumps({'page_content': text, 'metadata': metadata or {}}) + '\n')
+        np.save(store_dir_path / 'vectors.npy', np.concatenate(vectors))
+        np.save(store_dir_path / 'fast_vectors.npy', np.concatenate(fast_vectors))
+        DataUtils.write_fingerprint(store_dir_path, fingerprint)
+        logging.getLogger(cls.__name__).info(f"CascadeVectorStore of {sum(len(v) for v in vectors)} documents built in {store_dir_path}")
+
+    def embed_query(self, query):
+        """
+        Embeds the query with the fast and the main models concurrently
+        """
+        import numpy as np
+        fast_future = self.executor.submit(self.fast_embedding_function.embed_query, query)
+        main_future = self.executor.submit(self.embedding_function.embed_query, query)
+        return np.asarray(fast_future.result(), dtype=np.float32), np.asarray(main_future.result(), dtype=np.float32)
+
+    def get_candidates(self, fast_query_vector, main_query_vector, n_candidates):
+        """
+        Returns the ids of the best candidates of the fast index, reranked with their main vectors
+        """
+        import numpy as np
+        fast_scores = self.fast_vectors @ fast_query_vector
+        n_candidates = min(n_candidates, len(fast_scores))
+        candidate_ids = np.argpartition(-fast_scores, n_candidates - 1)[:n_candidates]
+        candidate_ids.sort()
+        main_scores = np.asarray(self.vectors[candidate_ids]) @ main_query_vector
+        order = np.argsort(-main_scores, kind='stable')
+        return candidate_ids[order], main_scores[order]
+
+    def to_document(self, doc_id):
+        return Document(page_content=self.documents[doc_id]['page_content'], metadata=self.documents[doc_id]['metadata'])
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        fast_query_vector, main_query_vector = self.embed_query(query)
+        candidate_ids, scores = self.get_candidates(fast_query_vector, main_query_vector, max(self.n_candidates, k))
+        return [(self.to_document(doc_id), float(score)) for doc_id, score in zip(candidate_ids[:k], scores[:k])]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k=k)]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        """
+        MMR over the fetch_k best reranked candidates, using their main vectors
+        """
+        import numpy as np
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+        fast_query_vector, main_query_vector = self.embed_query(query)
+        candidate_ids, _ = self.get_candidates(fast_query_vector, main_query_vector, max(self.n_candidates, fetch_k))
+        candidate_ids = candidate_ids[:fetch_k]
+        selected = maximal_marginal_relevance(main_query_vector, np.asarray(self.vectors[candidate_ids]), k=k, lambda_mult=lambda_mult)
+        return [self.to_document(candidate_ids[i]) for i in selected]
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("CascadeVectorStore is read-only, rebuild it from the Chroma vector store")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("CascadeVectorStore is built with CascadeVectorStore.build_from_chroma")
+
+
+if __name__ == "__main__":
+    from src.embedding import Embedder
+    from src.utils import Settings
+    from src.vector_store import DocumentRetriever
+
+    parser = argparse.ArgumentParser(description="Builds the fast embedding index of the two-stage retrieval from the Chroma vector store")
+    parser.add_argument('--embedding_device', type=str, default='cpu', choices=['cpu', 'cuda'])
+    args = parser.parse_args()
+
+    settings = Settings()
+    fast_embedder = Embedder(embedding_device=args.embedding_device, hf_embedding_model_path=settings.HF_FAST_EMBEDDING_MODEL_PATH)
+    chroma_vector_store = DocumentRetriever.load_vector_store(embedding_function=None, vector_store_dir_path=str(settings.VECTOR_STORE_DIR_PATH))
+    CascadeVectorStore.build_from_chroma(chroma_vector_store, fast_embedder.set_embedding_function(), settings.CASCADE_STORE_DIR_PATH,
+                                         fingerprint=DataUtils.read_fingerprint(settings.VECTOR_STORE_DIR_PATH))
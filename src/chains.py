@@ -1,9 +1,5 @@
-from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain.chains.history_aware_retriever import create_history_aware_retriever
-from langchain.chains.retrieval import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
 from src.utils import DataUtils
+from src.profiler import profiler, create_stage_callback_handler
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
@@ -12,25 +8,30 @@ class RetrieverChain:
     """
     Chain that integrates a retriever with a LLM to contextualize a question
     """
-    def __init__(self, retriever, llm, question_contextualizer_prompt_path):
+    def __init__(self, retriever, llm, question_contextualizer_prompt_path, prompt_prefix_path=None):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.retriever = retriever
         self.llm = llm
         self.question_contextualizer_prompt_path = question_contextualizer_prompt_path
+        self.prompt_prefix_path = prompt_prefix_path
         self.prompt = self.set_prompt()
         self.retriever_chain = self.set_context_retriever_chain()
         
     def set_prompt(self):
         """
-        Reads and sets the prompt template from a file path
+        Reads and sets the prompt template from a file path (after the shared prompt prefix, if given)
         """
+        from langchain_core.prompts import PromptTemplate
         template = DataUtils.read_text(file_path=self.question_contextualizer_prompt_path)
+        if self.prompt_prefix_path is not None:
+            template = DataUtils.read_text(file_path=self.prompt_prefix_path) + template
         return PromptTemplate.from_template(template=template)
     
     def set_context_retriever_chain(self):
         """
         Creates a history-aware retriever chain using an LLM, a retriever, and a prompt
         """
+        from langchain.chains.history_aware_retriever import create_history_aware_retriever
         self.logger.info("RetrieverChain initialized successfully")
         return create_history_aware_retriever(
             self.llm,
@@ -42,39 +43,64 @@ class ConversationRAGChain:
     """
     Chain that uses a retriever and LLM to handle question answering in a conversation context
     """
-    def __init__(self, retriever_chain, llm, question_answerer_prompt_path):
+    def __init__(self, retriever_chain, llm, question_answerer_prompt_path, prompt_prefix_path=None, query_cache=None):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.retriever_chain = retriever_chain
         self.llm = llm
         self.question_answerer_prompt_path = question_answerer_prompt_path
+        self.prompt_prefix_path = prompt_prefix_path
+        self.query_cache = query_cache
         self.prompt = self.set_prompt()
         self.conversation_rag_chain = self.set_conversation_rag_chain()
         
         
     def set_prompt(self):
         """
-        Reads and sets the prompt template from a file path
+        Reads and sets the prompt template from a file path (after the shared prompt prefix, if given)
         """
+        from langchain_core.prompts import PromptTemplate
         template = DataUtils.read_text(file_path=self.question_answerer_prompt_path)
+        if self.prompt_prefix_path is not None:
+            template = DataUtils.read_text(file_path=self.prompt_prefix_path) + template
         return PromptTemplate.from_template(template=template)
 
     def set_conversation_rag_chain(self):
         """
         Creates a retrieval chain by combining a retriever chain and a document processing chain
         """
-        stuff_document_chain = create_stuff_documents_chain(self.llm, self.prompt)
+        from langchain.chains.retrieval import create_retrieval_chain
+        from langchain.chains.combine_documents import create_stuff_documents_chain
+        self.stuff_document_chain = create_stuff_documents_chain(self.llm, self.prompt)
         self.logger.info("ConversationRAGChain initialized successfully")
-        return create_retrieval_chain(self.retriever_chain, stuff_document_chain)
+        return create_retrieval_chain(self.retriever_chain, self.stuff_document_chain)
 
     def get_response(self, chat_history, user_query):
         """
-        Streams a response based on chat history and user query
+        Streams a response based on chat history and user query (the answers to questions asked without chat history are cached, if a query cache is given)
         """
+        # while profiling, the contextualize, retrieve and generate steps are marked as stages
+        config = {"callbacks": [create_stage_callback_handler(profiler)]} if profiler.running else None
+        if self.query_cache is not None and not chat_history:
+            return self.get_standalone_response(user_query, config)
         response_stream = self.conversation_rag_chain.stream({
             "chat_history": chat_history,
             "input": user_query
-        })
+        }, config=config)
         return response_stream
+
+    def get_standalone_response(self, user_query, config=None):
+        """
+        Streams the cached answer to a question asked without chat history, or streams and caches a new one
+        """
+        answer = self.query_cache.get('answers', user_query)
+        if answer is not None:
+            yield {"input": user_query, "answer": answer}
+            return
+        answer = ""
+        for chunk in self.conversation_rag_chain.stream({"chat_history": "", "input": user_query}, config=config):
+            answer += chunk.get("answer", "")
+            yield chunk
+        self.query_cache.put('answers', user_query, answer)
     
 class ChatSummarizerChain:
     """
@@ -91,6 +117,7 @@ class ChatSummarizerChain:
         """
         Reads and sets the prompt template from the provided file path
         """
+        from langchain_core.prompts import PromptTemplate
         template = DataUtils.read_text(file_path=self.chat_summarizer_prompt_path)
         return PromptTemplate.from_template(template=template)
 
@@ -98,6 +125,7 @@ class ChatSummarizerChain:
         """
         Creates a chain that processes and summarizes chat text
         """
+        from langchain_core.output_parsers import StrOutputParser
         self.logger.info("ChatSummarizerChain initialized successfully")
         return self.prompt | self.llm | StrOutputParser()
 
@@ -1,5 +1,5 @@
 from src.chains import ChatSummarizerChain, ConversationRAGChain
-import streamlit as st
+from src.profiler import profiler
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
@@ -8,37 +8,79 @@ class Chatbot:
     """
     A class that initialize a chat session between the user and the assistant via CLI or a Streamlit app
     """
+    TEMPLATE_QUESTIONS = (
+        "What is insomnia?",
+        "What is fMRI?",
+        "How does the immune system work?",
+        "What are place cells?",
+        "How does the retina work?"
+    )
+
     def __init__(self, conversation_rag_chain: ConversationRAGChain,
-                 chat_summarizer_chain: ChatSummarizerChain):
+                 chat_summarizer_chain: ChatSummarizerChain, summary_executor=None, max_history_chars=None, query_log=None):
         self.conversation_rag_chain = conversation_rag_chain
         self.chat_summarizer_chain = chat_summarizer_chain
+        self.summary_executor = summary_executor
+        self.max_history_chars = max_history_chars
+        self.query_log = query_log
+        self.summary_future = None
         self.chat_history = ""
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.info("Chatbot initialized with conversation_rag_chain, and chat_summarizer_chain")
+        self.logger.info(f"Chatbot initialized with conversation_rag_chain, and chat_summarizer_chain (background summarization: {summary_executor is not None})")
+
+    def get_chat_history(self):
+        """
+        Returns the chat history, waiting for the summarization of the previous turn if it is still running in the background
+        """
+        if self.summary_future is not None:
+            self.chat_history = self.summary_future.result()
+            self.summary_future = None
+        return self.chat_history
 
     def get_full_response(self, user_query):
         """
         Retrieve a response to a query and streams it through a print and returns the full response
         """
+        self.record_query(user_query)
         full_response = ""
-        for chunk in self.conversation_rag_chain.get_response(chat_history=self.chat_history,
-                                                              user_query=user_query):
-            answer_chunk = chunk.get("answer", "")
-            print(answer_chunk, end="", flush=True)
-            full_response += answer_chunk
+        with profiler.stage('turn'):
+            for chunk in self.conversation_rag_chain.get_response(chat_history=self.get_chat_history(),
+                                                                  user_query=user_query):
+                answer_chunk = chunk.get("answer", "")
+                print(answer_chunk, end="", flush=True)
+                full_response += answer_chunk
         return full_response
 
+    def record_query(self, user_query):
+        """
+        Counts the query in the (anonymized) query log, used to prewarm the caches with the most frequent questions
+        """
+        if self.query_log is not None:
+            self.query_log.record(user_query)
+
     def update_chat_history(self, user_query, full_response):
         """
         Update the chat history with the latest Human message (user) and AI Assistant massage (assistant)
         """
-        self.chat_history += "\n" + "* Human: " + user_query + "\n" + "* AI Assistant: " + full_response + "\n"
+        self.chat_history = self.get_chat_history() + "\n" + "* Human: " + user_query + "\n" + "* AI Assistant: " + full_response + "\n"
 
     def summarize_chat_history(self):
         """
-        Summarize the accumulated chat history using the summarization chain
+        Summarize the accumulated chat history using the summarization chain (in the background when a summary executor is given,
+        so that the answer is not held back by the summary); with `max_history_chars`, the history is kept append-only (so that
+        it stays a stable prompt prefix) until it exceeds this length
         """
-        self.chat_history = self.chat_summarizer_chain.summarize(self.chat_history).strip()
+        if self.max_history_chars is not None and len(self.get_chat_history()) <= self.max_history_chars:
+            return
+        if self.summary_executor is not None:
+            chat_history = self.get_chat_history()
+            self.summary_future = self.summary_executor.submit(self.summarize, chat_history)
+        else:
+            self.chat_history = self.summarize(self.chat_history)
+
+    def summarize(self, chat_history):
+        with profiler.stage('summarize'):
+            return self.chat_summarizer_chain.summarize(chat_history).strip()
 
     def run_cli_chat(self):
         """
@@ -60,16 +102,19 @@ class Chatbot:
         """
         Handle user queries and update the Streamlit app interface accordingly
         """
+        import streamlit as st
         st.chat_message("user").markdown(user_query)
         st.session_state.messages.append({"role": "user", "content": user_query})
 
         with st.chat_message('assistant'):
             message_placeholder = st.empty()
+            self.record_query(user_query)
             full_response = ""
-            for chunk in self.conversation_rag_chain.get_response(chat_history=self.chat_history,
-                                                                  user_query=user_query):
-                full_response += chunk.get("answer", "")
-                message_placeholder.markdown(full_response + "▌")
+            with profiler.stage('turn'):
+                for chunk in self.conversation_rag_chain.get_response(chat_history=self.get_chat_history(),
+                                                                      user_query=user_query):
+                    full_response += chunk.get("answer", "")
+                    message_placeholder.markdown(full_response + "▌")
             message_placeholder.markdown(full_response)
             st.session_state.messages.append({"role": "assistant", "content": full_response})
             self.update_chat_history(user_query=user_query, full_response=full_response)
@@ -79,6 +124,7 @@ class Chatbot:
         """
         Run the Streamlit app chat interface
         """
+        import streamlit as st
         self.logger.info("Running chat session (Streamlit App)")
         if "messages" not in st.session_state:
             st.session_state.messages = []
@@ -92,15 +138,7 @@ class Chatbot:
         # Add example questions
         with st.sidebar:
             st.markdown("### Example Questions")
-            template_questions = [
-                "What is insomnia?",
-                "What is fMRI?",
-                "How does the immune system work?",
-                "What are place cells?",
-                "How does the retina work?"
-            ]
-
-            for question in template_questions:
+            for question in self.TEMPLATE_QUESTIONS:
                 if st.button(question):
                     user_query = question
 
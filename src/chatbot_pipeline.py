@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from src.chains import ChatSummarizerChain, RetrieverChain, ConversationRAGChain
 from src.llm import LLMClient
 from src.vector_store import DocumentRetriever
@@ -7,38 +8,100 @@ class ChatbotPipeline:
     """
     Pipeline to initialize and configure a chatbot with document retrieval chain, and a conversation summarization chain
     """
-    def __init__(self, embedding_function, vector_store_dir_path,
+    def __init__(self, vector_store_dir_path,
                  n_docs, llm_path, use_ollama, huggingface_api_token, question_contextualizer_prompt_path,
-                 question_answerer_prompt_path, chat_summarizer_prompt_path):
+                 question_answerer_prompt_path, chat_summarizer_prompt_path,
+                 ollama_base_url="http://localhost:11434", ollama_keep_alive="30m",
+                 prompt_prefix_path=None, max_history_chars=None, llm=None, query_log=None, query_cache=None, prewarm_top_n=0):
 
-        document_retriever = DocumentRetriever(embedding_function=embedding_function,
-                                            vector_store_dir_path=vector_store_dir_path,
-                                            n_docs=n_docs)
-        
-        llm_client = LLMClient(llm_path=llm_path, temperature=0.0008, 
-                               use_ollama=use_ollama, 
-                               huggingface_api_token=huggingface_api_token)
-
-        self.llm = llm_client.set_llm()
-        self.retriever = document_retriever.set_retriever()
-        
+        # with a shared prompt prefix (system prompt and chat history first, retrieved context last), the prompts of consecutive
+        # calls share their beginning and Ollama reuses the cached prefix
+        llm_client = LLMClient(llm_path=llm_path, temperature=0.0008,
+                               use_ollama=use_ollama,
+                               huggingface_api_token=huggingface_api_token,
+                               ollama_base_url=ollama_base_url,
+                               ollama_keep_alive=ollama_keep_alive,
+                               prefix_cache=prompt_prefix_path is not None)
+
+        # an already created LLM (e.g. a stand-in for load tests) can be given instead
+        self.llm = llm if llm is not None else llm_client.set_llm()
+        self.prompt_cache_monitor = llm_client.prompt_cache_monitor
+
+        self.vector_store_dir_path = vector_store_dir_path
+        self.n_docs = n_docs
         self.question_contextualizer_prompt_path = question_contextualizer_prompt_path
         self.question_answerer_prompt_path = question_answerer_prompt_path
         self.chat_summarizer_prompt_path = chat_summarizer_prompt_path
-    
-    def init_chatbot(self):
+        self.prompt_prefix_path = prompt_prefix_path
+        self.max_history_chars = max_history_chars
+        self.retriever_chain = None
+        self.conversation_rag_chain = None
+        self.chat_summarizer_chain = None
+        self.summary_executor = None
+        self.query_log = query_log
+        self.query_cache = query_cache
+        self.prewarm_top_n = prewarm_top_n
+        self.cache_prewarmer = None
+
+    def init_chains(self, embedding_function, vector_store=None, summary_workers=None):
         """
-        Initializes the chatbot by creating and configuring the required chains
+        Creates and configures the chains, which hold no conversation state and can be shared by all the chatbots of the process
+        (an already loaded vector store can be given to skip loading it again, and a number of summary workers to summarize
+        the chat histories in the background); with a query cache, the retrievals and standalone answers are cached, and
+        those of the most frequent questions are precomputed in the background (again when the chains are created on a new vector store)
         """
-        retriever_chain = RetrieverChain(retriever=self.retriever,
+        document_retriever = DocumentRetriever(embedding_function=embedding_function,
+                                               vector_store_dir_path=self.vector_store_dir_path,
+                                               n_docs=self.n_docs,
+                                               vector_store=vector_store)
+        retriever = document_retriever.set_retriever()
+        if self.query_cache is not None:
+            from src.query_cache import cache_retriever
+            self.query_cache.clear('retrievals', 'answers')
+            retriever = cache_retriever(retriever, self.query_cache)
+
+        retriever_chain = RetrieverChain(retriever=retriever,
                                         llm=self.llm,
-                                        question_contextualizer_prompt_path=self.question_contextualizer_prompt_path)
-        
+                                        question_contextualizer_prompt_path=self.question_contextualizer_prompt_path,
+                                        prompt_prefix_path=self.prompt_prefix_path)
+
         conversation_rag_chain = ConversationRAGChain(retriever_chain=retriever_chain.retriever_chain,
                                                     llm=self.llm,
-                                                    question_answerer_prompt_path=self.question_answerer_prompt_path)
-        
+                                                    question_answerer_prompt_path=self.question_answerer_prompt_path,
+                                                    prompt_prefix_path=self.prompt_prefix_path,
+                                                    query_cache=self.query_cache)
+
         chat_summarizer_chain = ChatSummarizerChain(llm=self.llm,
                                                     chat_summarizer_prompt_path=self.chat_summarizer_prompt_path)
-        
-        return Chatbot(conversation_rag_chain=conversation_rag_chain, chat_summarizer_chain=chat_summarizer_chain)
\ No newline at end of file
+
+        self.retriever_chain = retriever_chain
+        self.conversation_rag_chain = conversation_rag_chain
+        self.chat_summarizer_chain = chat_summarizer_chain
+        if summary_workers:
+            self.summary_executor = ThreadPoolExecutor(max_workers=summary_workers, thread_name_prefix="ChatSummarizer")
+        if self.query_cache is not None and self.prewarm_top_n:
+            self.prewarm_caches()
+        return self
+
+    def prewarm_caches(self):
+        """
+        Precomputes in the background the embeddings, retrievals and standalone answers of the most frequent questions of the
+        query log (completed with the template questions)
+        """
+        from src.query_cache import CachePrewarmer
+        self.cache_prewarmer = CachePrewarmer(conversation_rag_chain=self.conversation_rag_chain, query_cache=self.query_cache,
+                                              query_log=self.query_log, top_n=self.prewarm_top_n, seed_queries=Chatbot.TEMPLATE_QUESTIONS)
+        return self.cache_prewarmer.start()
+
+    def new_chatbot(self):
+        """
+        Creates a chatbot with its own chat history on top of the shared chains
+        """
+        return Chatbot(conversation_rag_chain=self.conversation_rag_chain, chat_summarizer_chain=self.chat_summarizer_chain,
+                       summary_executor=self.summary_executor, max_history_chars=self.max_history_chars, query_log=self.query_log)
+
+    def init_chatbot(self, embedding_function, vector_store=None):
+        """
+        Initializes the chatbot by creating and configuring the required chains (an already loaded vector store can be given to skip loading it again)
+        """
+        return self.init_chains(embedding_function=embedding_function, vector_store=vector_store).new_chatbot()
@@ -1,8 +1,14 @@
 
-from src.fetchers import BiorxivDataFetcher, GithubDataFetcher, HuggingFaceDataFetcher
-from src.handlers import PDFDataHandler, XMLDataHandler, ParquetDataHandler, DocumentCreator
-from src.summarizer import TextSummarizer
+from src.fetchers import BiorxivDataFetcher, GithubDataFetcher, GitMirrorDataFetcher, HuggingFaceDataFetcher
+from src.handlers import PDFDataHandler, XMLDataHandler, ParquetBatchDataHandler, DocumentCreator
+from src.summarizer import TextSummarizer, ExtractiveCondenser
 from src.vector_store import VectorStoreBuilder, VectorStoreGdown
+from src.snapshot import VectorStoreSnapshot, SnapshotSource
+from src.deduplicator import DocumentDeduplicator
+from src.journal import IngestionJournal
+from src.model_registry import ModelRegistry
+from src.profiler import profiler
+from src.utils import DataUtils
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
@@ -11,7 +17,14 @@ class DataPipeline:
     """
     A class to handle the end-to-end data processing pipeline, including data fetching, processing, and building or downloading a vector store
     """
-    def __init__(self, n_files, embedding_function, hf_data_path, hf_summarizer_model_path, vector_store_dir_path, google_drive_chroma_url, build_vector_store=False):
+    def __init__(self, n_files, embedding_function, hf_data_path, hf_summarizer_model_path, vector_store_dir_path, google_drive_chroma_url, build_vector_store=False, vector_store_snapshot=None,
+                 hf_n_samples=None, hf_shard_index=0, hf_n_shards=1,
+                 deduplicate=True, dedup_report_path=None,
+                 pdf_extractive_budget=None, xml_extractive_budget=None,
+                 summarizer_backend='fp32', summarizer_threads=None, summarizer_interop_threads=None,
+                 journal_path=None, restart_ingestion=False, n_shards=1, shard_by='hash', sharded_store_dir_path=None,
+                 model_registry=None, xml_source='github_api', elife_xml_mirror_dir_path=None, elife_xml_remote_url=None,
+                 profile_stages=None, profiles_dir_path=None, quantized_store_dir_path=None, fast_embedding_function=None, cascade_store_dir_path=None):
         self.n_files = n_files
         self.embedding_function = embedding_function
         self.build_vector_store = build_vector_store
@@ -19,59 +32,213 @@ class DataPipeline:
         self.vector_store_dir_path = vector_store_dir_path
         self.hf_summarizer_model_path = hf_summarizer_model_path
         self.google_drive_chroma_url = google_drive_chroma_url
+        self.vector_store_snapshot = vector_store_snapshot
+        self.hf_n_samples = hf_n_samples
+        self.hf_shard_index = hf_shard_index
+        self.hf_n_shards = hf_n_shards
+        self.deduplicate = deduplicate
+        self.dedup_report_path = dedup_report_path
+        self.pdf_extractive_budget = pdf_extractive_budget
+        self.xml_extractive_budget = xml_extractive_budget
+        self.summarizer_backend = summarizer_backend
+        self.summarizer_threads = summarizer_threads
+        self.summarizer_interop_threads = summarizer_interop_threads
+        self.journal_path = journal_path
+        self.restart_ingestion = restart_ingestion
+        self.journal = None
+        self.n_shards = n_shards
+        self.shard_by = shard_by
+        self.sharded_store_dir_path = sharded_store_dir_path
+        self.xml_source = xml_source
+        self.elife_xml_mirror_dir_path = elife_xml_mirror_dir_path
+        self.elife_xml_remote_url = elife_xml_remote_url
+        self.xml_data_fetcher = None
+        # stages sampled by the profiler during the run (also from the RAG_PROFILE_STAGES environment variable)
+        self.profile_stages = profile_stages or profiler.get_environment_stages()
+        self.profiles_dir_path = profiles_dir_path
+        # quantized store of the selected storage mode, which is used without the Chroma vector store once exported
+        self.quantized_store_dir_path = quantized_store_dir_path
+        # fast embedding index of the cascade storage, built from the Chroma vector store once it is ready
+        self.fast_embedding_function = fast_embedding_function
+        self.cascade_store_dir_path = cascade_store_dir_path
+        # the summarizer is only needed by the data handlers, so it is loaded through the registry and freed right after them
+        self.model_registry = model_registry if model_registry is not None else ModelRegistry()
+        self.model_registry.register('summarizer', loader=self.load_summarizer, idle_timeout=0)
         
         
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.info(f"DataPipeline initialized with n_files: {self.n_files}, build_vector_store: {self.build_vector_store}")
+
+    def get_run_parameters(self):
+        """
+        Returns the parameters identifying an ingestion run: a run restarted with the same parameters resumes from the journal
+        """
+        return {'n_files': self.n_files, 'hf_data_path': self.hf_data_path, 'hf_summarizer_model_path': self.hf_summarizer_model_path,
+                'vector_store_dir_path': str(self.vector_store_dir_path), 'hf_n_samples': self.hf_n_samples, 'hf_shard_index': self.hf_shard_index,
+                'hf_n_shards': self.hf_n_shards, 'deduplicate': self.deduplicate, 'pdf_extractive_budget': self.pdf_extractive_budget,
+                'xml_extractive_budget': self.xml_extractive_budget, 'summarizer_backend': self.summarizer_backend,
+                'n_shards': self.n_shards, 'shard_by': self.shard_by, 'xml_source': self.xml_source}
     
     def run_data_fetchers(self):
         """
-        Runs data fetchers to retrieve data from various sources
+        Runs data fetchers to retrieve data from various sources (the files already processed by a resumed run are not downloaded)
         """
-        biorxiv_data_fetcher = BiorxivDataFetcher(categories=['pathology', 'neuroscience', 'paleontology'], start_date='2020-01-01', end_date='2024-01-01', n_files=self.n_files)
+        processed_urls = self.journal.get_done_keys('processed') if self.journal is not None else set()
+
+        biorxiv_data_fetcher = BiorxivDataFetcher(categories=['pathology', 'neuroscience', 'paleontology'], start_date='2020-01-01', end_date='2024-01-01', n_files=self.n_files,
+                                                  skip_urls=processed_urls)
         fetched_pdf_data = biorxiv_data_fetcher.fetch_data()
         
-        github_data_fetcher = GithubDataFetcher(owner='elifesciences', repo='elife-article-xml', path='articles', n_files=self.n_files)
-        fetched_xml_data = github_data_fetcher.fetch_data()
+        # the eLife XMLs are listed and downloaded through the GitHub API, or read from a local git mirror (only the articles changed
+        # since the last ingested revision, unless the ingestion is restarted)
+        if self.xml_source == 'git_mirror':
+            self.xml_data_fetcher = GitMirrorDataFetcher(mirror_dir_path=self.elife_xml_mirror_dir_path, remote_url=self.elife_xml_remote_url, n_files=self.n_files,
+                                                         skip_urls=processed_urls, incremental=not self.restart_ingestion)
+        else:
+            self.xml_data_fetcher = GithubDataFetcher(owner='elifesciences', repo='elife-article-xml', path='articles', n_files=self.n_files, skip_urls=processed_urls)
+        fetched_xml_data = self.xml_data_fetcher.fetch_data()
         
         huggingface_data_fetcher = HuggingFaceDataFetcher(data_path=self.hf_data_path)
-        fetched_huggingface_data = huggingface_data_fetcher.fetch_data()
+        fetched_huggingface_data = huggingface_data_fetcher.fetch_record_batches(columns=('summary', 'year', 'title'), n_samples=self.hf_n_samples,
+                                                                                 shard_index=self.hf_shard_index, n_shards=self.hf_n_shards)
         
         return fetched_pdf_data, fetched_xml_data, fetched_huggingface_data
     
 
+    def load_summarizer(self):
+        return TextSummarizer(force_cache=False, hf_summarizer_model_path=self.hf_summarizer_model_path, backend=self.summarizer_backend,
+                              intra_op_threads=self.summarizer_threads, inter_op_threads=self.summarizer_interop_threads)
+
     def run_data_handlers(self, fetched_pdf_data, fetched_xml_data, fetched_huggingface_data):
         """
-        Processes fetched data using appropriate handlers and summarizers
+        Processes fetched data using appropriate handlers and summarizers (the HuggingFace record batches are streamed into lazily created documents)
         """
-        summarizer = TextSummarizer(force_cache=False, hf_summarizer_model_path=self.hf_summarizer_model_path)
-        
-        pdf_data_handler = PDFDataHandler(summarizer=summarizer, fetched_data=fetched_pdf_data)
-        processed_pdf_data = pdf_data_handler.process_fetched_data()
+        with self.model_registry.use('summarizer') as summarizer, profiler.stage('parse'):
+            # optional extractive pre-stage (token budget per source) shrinking the text given to the summarizer
+            pdf_condenser = ExtractiveCondenser(token_budget=self.pdf_extractive_budget, count_tokens=summarizer.count_tokens) if self.pdf_extractive_budget else None
+            xml_condenser = ExtractiveCondenser(token_budget=self.xml_extractive_budget, count_tokens=summarizer.count_tokens) if self.xml_extractive_budget else None
+
+            pdf_data_handler = PDFDataHandler(summarizer=summarizer, fetched_data=fetched_pdf_data, condenser=pdf_condenser, journal=self.journal)
+            processed_pdf_data = pdf_data_handler.process_fetched_data()
 
-        xml_data_handler = XMLDataHandler(summarizer=summarizer, fetched_data=fetched_xml_data)
-        processed_xml_data = xml_data_handler.process_fetched_data()
+            xml_data_handler = XMLDataHandler(summarizer=summarizer, fetched_data=fetched_xml_data, condenser=xml_condenser, journal=self.journal)
+            processed_xml_data = xml_data_handler.process_fetched_data()
+            # no reference to the summarizer may outlive the block, so that it is actually freed when released
+            del summarizer, pdf_condenser, xml_condenser, pdf_data_handler, xml_data_handler
 
-        huggingface_data_handler = ParquetDataHandler(fetched_data=fetched_huggingface_data)
+        huggingface_data_handler = ParquetBatchDataHandler(record_batches=fetched_huggingface_data)
         processed_huggingface_data = huggingface_data_handler.process_fetched_data()
 
-        document_creator = DocumentCreator(processed_pdf_data, processed_xml_data, processed_huggingface_data)
-        documents = document_creator.create_documents_from_data()
+        # the records go through deduplication and embedding as they are, the vector store writer taking their texts and metadata directly
+        document_creator = DocumentCreator.from_streams(processed_pdf_data, processed_xml_data, processed_huggingface_data)
+        documents = document_creator.iter_records()
         
         return documents
     
+    def get_store_dir_path(self):
+        """
+        Returns the folder of the store built by the ingestion: the sharded store with several shards, the Chroma vector store otherwise
+        """
+        return self.vector_store_dir_path if self.n_shards == 1 else self.sharded_store_dir_path
+
+    def has_quantized_store(self):
+        return self.quantized_store_dir_path is not None and DataUtils.read_fingerprint(self.quantized_store_dir_path) is not None
+
+    def has_sharded_store(self):
+        """
+        Checks for a complete sharded store (its manifest is written last), which is used without the Chroma vector store
+        """
+        from src.sharded_store import ShardedVectorStore
+        return self.n_shards > 1 and ShardedVectorStore.check_manifest(self.sharded_store_dir_path, self.n_shards, self.shard_by) is not None
+
     def run_pipeline(self):
         """
-        Runs the complete data pipeline, either building a new vector store or downloading it from the drive
+        Runs the complete data pipeline, either building a new vector store or getting it from a snapshot (if given) or from the drive,
+        profiling the given stages (unless the profiler is already running) into flame graph stacks
         """
+        profiling = bool(self.profile_stages) and profiler.configure(output_dir_path=self.profiles_dir_path).start(stages=self.profile_stages)
+        try:
+            with profiler.stage('ingestion'):
+                self.run_pipeline_stages()
+        finally:
+            if profiling:
+                profiler.stop()
+
+    def build_cascade_store(self):
+        """
+        Embeds the documents of the Chroma vector store with the fast model into the cascade index, when it is missing or out of date
+        """
+        from src.cascade_store import CascadeVectorStore
+        from src.vector_store import DocumentRetriever, import_chroma
+        fingerprint = DataUtils.read_fingerprint(self.vector_store_dir_path)
+        if fingerprint is not None and fingerprint == DataUtils.read_fingerprint(self.cascade_store_dir_path):
+            return
+        vector_store = import_chroma()(persist_directory=self.vector_store_dir_path, embedding_function=self.embedding_function)
+        fingerprint = fingerprint or DocumentRetriever.fingerprint_vector_store(vector_store, self.vector_store_dir_path)
+        if fingerprint != DataUtils.read_fingerprint(self.cascade_store_dir_path):
+            with profiler.stage('embed'):
+                CascadeVectorStore.build_from_chroma(vector_store, self.fast_embedding_function, self.cascade_store_dir_path, fingerprint=fingerprint)
+
+    def run_pipeline_stages(self):
         if self.build_vector_store:
-            
-            fetched_pdf_data, fetched_xml_data, fetched_huggingface_data = self.run_data_fetchers()
+            # durable journal of the per-document progress, so that an interrupted run resumes where it stopped
+            if self.journal_path is not None:
+                self.journal = IngestionJournal(journal_path=self.journal_path, run_parameters=self.get_run_parameters())
+                if self.restart_ingestion:
+                    self.journal.reset_run()
+            # the signatures of the stored documents are kept with the store they describe, and discarded with the progress on restart
+            dedup_index_path = DocumentDeduplicator.get_index_path(self.get_store_dir_path())
+            if self.restart_ingestion:
+                dedup_index_path.unlink(missing_ok=True)
+
+            with profiler.stage('fetch'):
+                fetched_pdf_data, fetched_xml_data, fetched_huggingface_data = self.run_data_fetchers()
             documents = self.run_data_handlers(fetched_pdf_data, fetched_xml_data, fetched_huggingface_data)
-            
-            vectorstore_builder = VectorStoreBuilder(documents=documents, embeddings=self.embedding_function, vector_store_dir_path=self.vector_store_dir_path)
+
+            # drop near-duplicates (same article from several sources or already stored) before embedding
+            if self.deduplicate:
+                # the modified files of the git mirror are new versions of stored articles, which replace them instead of being dropped
+                get_article_key = self.xml_data_fetcher.get_article_key if self.xml_source == 'git_mirror' else None
+                # the index is ignored if the store changed since it was saved (deleted, downloaded or built by another run)
+                document_deduplicator = DocumentDeduplicator(index_path=dedup_index_path, report_path=self.dedup_report_path, get_article_key=get_article_key,
+                                                             fingerprint=DataUtils.read_fingerprint(self.get_store_dir_path()))
+                documents = document_deduplicator.filter_documents(documents)
+
+            # with several shards, the documents are partitioned into the sharded store instead of the single Chroma vector store; the previous
+            # versions of the files modified in the git mirror are deleted once their new versions are stored
+            vectorstore_builder = VectorStoreBuilder(documents=documents, embedding_function=self.embedding_function,
+                                                     vector_store_dir_path=self.get_store_dir_path(),
+                                                     journal=self.journal, n_shards=self.n_shards, shard_by=self.shard_by,
+                                                     get_replaced_sources=self.xml_data_fetcher.get_replaced_sources if self.xml_source == 'git_mirror' else None)
             vectorstore_builder.build_vector_store()
 
+            if self.deduplicate:
+                document_deduplicator.save_index(fingerprint=DataUtils.read_fingerprint(self.get_store_dir_path()))
+                document_deduplicator.write_report()
+
+            if self.journal is not None:
+                self.journal.complete_run()
+                self.journal.close()
+
+            if self.xml_source == 'git_mirror':
+                self.xml_data_fetcher.mark_ingested()
+
+        elif self.vector_store_snapshot:
+            # a fingerprint of the previous content is restored from the snapshot if it carries one, and recomputed on load otherwise
+            DataUtils.clear_fingerprint(self.vector_store_dir_path)
+            vector_store_snapshot = VectorStoreSnapshot(vector_store_dir_path=self.vector_store_dir_path)
+            vector_store_snapshot.import_snapshot(SnapshotSource(self.vector_store_snapshot))
+
+        elif self.has_quantized_store():
+            self.logger.info(f"Quantized store found in {self.quantized_store_dir_path}, the Chroma vector store is not downloaded")
+
+        elif self.has_sharded_store():
+            self.logger.info(f"Sharded store found in {self.sharded_store_dir_path}, the Chroma vector store is not downloaded")
+
         else:
             vector_store_gdown = VectorStoreGdown(vector_store_dir_path=self.vector_store_dir_path, google_drive_chroma_url=self.google_drive_chroma_url)
-            vector_store_gdown.download_vector_store()
\ No newline at end of file
+            vector_store_gdown.download_vector_store()
+
+        # the fast embedding index of the cascade is built here rather than at load time, once the vector store is ready
+        if self.cascade_store_dir_path is not None:
+            self.build_cascade_store()
\ No newline at end of file
@@ -0,0 +1,230 @@
+from collections import defaultdict
+from pathlib import Path
+import json
+import re
+import zlib
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+MERSENNE_PRIME = (1 << 61) - 1
+
+
+class MinHasher:
+    """
+    A class to compute MinHash signatures of texts from their word or character shingles
+    """
+    def __init__(self, num_perm=128, seed=42):
+        import numpy as np
+        self.num_perm = num_perm
+        generator = np.random.RandomState(seed)
+        # a * h + b stays below 2**64 since shingle hashes are 32 bits wide
+        self.a = generator.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    @staticmethod
+    def normalize(text):
+        return re.sub(r'[^a-z0-9 ]+', ' ', text.lower()).split()
+
+    def get_shingles(self, text, ngram_size, by_char=False):
+        """
+        Returns the 32 bit hashes of the word (or character) n-grams of a normalized text
+        """
+        tokens = self.normalize(text)
+        if by_char:
+            tokens = ' '.join(tokens)
+        if len(tokens) < ngram_size:
+            return set()
+        separator = '' if by_char else ' '
+        return {zlib.crc32(separator.join(tokens[i:i + ngram_size]).encode()) for i in range(len(tokens) - ngram_size + 1)}
+
+    def get_signature(self, shingles):
+        """
+        Computes the MinHash signature of a set of shingle hashes (vectorized over shingles and permutations)
+        """
+        import numpy as np
+        hashes = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self.a) + self.b) % np.uint64(MERSENNE_PRIME)).min(axis=0)
+
+
+class LSHIndex:
+    """
+    A class to index MinHash signatures into LSH bands and to query near-duplicate candidates
+    """
+    def __init__(self, num_perm=128, n_bands=16):
+        self.n_bands = n_bands
+        self.rows_per_band = num_perm // n_bands
+        self.buckets = [defaultdict(list) for _ in range(n_bands)]
+        self.signatures = []
+
+    def get_band_keys(self, signature):
+        return [signature[i * self.rows_per_band:(i + 1) * self.rows_per_band].tobytes() for i in range(self.n_bands)]
+
+    def query(self, signature, threshold):
+        """
+        Returns the (id, estimated Jaccard similarity) of the most similar indexed signature above the threshold, if any
+        """
+        candidates = set()
+        for band, key in enumerate(self.get_band_keys(signature)):
+            candidates.update(self.buckets[band].get(key, ()))
+        best = None
+        for candidate in candidates:
+            similarity = float((self.signatures[candidate] == signature).mean())
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+        return best
+
+    def insert(self, signature):
+        """
+        Indexes a signature and returns its id
+        """
+        doc_id = len(self.signatures)
+        self.signatures.append(signature)
+        for band, key in enumerate(self.get_band_keys(signature)):
+            self.buckets[band][key].append(doc_id)
+        return doc_id
+
+
+class DocumentDeduplicator:
+    """
+    A class to drop near-duplicate documents (same article from several sources) before they are embedded and stored
+
+    A document is a duplicate of an already seen one when their titles or their summaries are similar enough
+    (MinHash estimate of the Jaccard similarity of their shingles). The signatures of the kept documents are persisted,
+    so that incremental runs are checked against everything already stored; they are tagged with the fingerprint of the
+    store they were saved with, and ignored if it changed since (`fingerprint`). With `get_article_key` (mapping a source
+    to the article it holds), a document matching another version of the same article is kept as an update of it
+    """
+    INDEX_FILE_NAME = 'dedup_signatures.npz'
+
+    def __init__(self, index_path, report_path, title_threshold=0.9, summary_threshold=0.8, num_perm=128, n_bands=16, get_article_key=None,
+                 fingerprint=None):
+        self.index_path = Path(index_path)
+        self.fingerprint = fingerprint
+        self.report_path = Path(report_path)
+        self.thresholds = {'title': title_threshold, 'summary': summary_threshold}
+        self.num_perm = num_perm
+        self.n_bands = n_bands
+        self.min_hasher = MinHasher(num_perm=num_perm)
+        self.indexes = {'title': LSHIndex(num_perm=num_perm, n_bands=n_bands), 'summary': LSHIndex(num_perm=num_perm, n_bands=n_bands)}
+        self.ids = {'title': [], 'summary': []}
+        self.kept_documents = []
+        self.removed_documents = []
+        self.updated_documents = []
+        self.get_article_key = get_article_key
+        self.n_persisted = 0
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.load_index()
+
+    @classmethod
+    def get_index_path(cls, store_dir_path):
+        return Path(store_dir_path) / cls.INDEX_FILE_NAME
+
+    def get_signatures(self, title, summary):
+        """
+        Computes the title (character 5-grams) and summary (word 3-grams) signatures, skipping fields too short to compare
+        """
+        shingles = {'title': self.min_hasher.get_shingles(title or "", ngram_size=5, by_char=True),
+                    'summary': self.min_hasher.get_shingles(summary or "", ngram_size=3)}
+        return {field: self.min_hasher.get_signature(field_shingles)
+                for field, field_shingles in shingles.items() if len(field_shingles) >= 3}
+
+    def add(self, key, signatures):
+        doc_number = len(self.kept_documents)
+        self.kept_documents.append(key)
+        for field, signature in signatures.items():
+            self.indexes[field].insert(signature)
+            self.ids[field].append(doc_number)
+
+    def find_duplicate(self, signatures):
+        """
+        Returns (field, key of the duplicated document, similarity) if the signatures match an indexed document
+        """
+        for field, signature in signatures.items():
+            match = self.indexes[field].query(signature, self.thresholds[field])
+            if match is not None:
+                return field, self.kept_documents[self.ids[field][match[0]]], match[1]
+        return None
+
+    def is_update(self, key, duplicate_of):
+        """
+        Whether a document is a new version of the matched one (same article from another source, e.g. a modified file)
+        """
+        if self.get_article_key is None or key['source'] == duplicate_of['source']:
+            return False
+        article_key = self.get_article_key(key['source'])
+        return article_key is not None and article_key == self.get_article_key(duplicate_of['source'])
+
+    def filter_documents(self, documents):
+        """
+        Lazily yields the documents that are not near-duplicates of a previously seen (or stored) document
+        """
+        for document in documents:
+            title = document.metadata.get('article_title', "")
+            key = {'title': title, 'source': document.metadata.get('article_source', "")}
+            signatures = self.get_signatures(title, document.page_content)
+            duplicate = self.find_duplicate(signatures)
+            if duplicate is not None and self.is_update(key, duplicate[1]):
+                self.updated_documents.append({**key, 'replaces': duplicate[1]['source']})
+                self.logger.debug(f"Updated document kept: '{title}' ({key['source']}) replaces {duplicate[1]['source']}")
+                duplicate = None
+            if duplicate is not None:
+                field, duplicate_of, similarity = duplicate
+                self.removed_documents.append({**key, 'duplicate_of': duplicate_of, 'matched_field': field, 'similarity': round(similarity, 3)})
+                self.logger.debug(f"Near-duplicate removed: '{title}' ({key['source']}) matches '{duplicate_of['title']}' ({duplicate_of['source']}) on {field}, similarity {similarity:.2f}")
+                continue
+            self.add(key, signatures)
+            yield document
+
+    def load_index(self):
+        """
+        Loads the signatures of the documents kept by previous runs
+        """
+        if not self.index_path.is_file():
+            return
+        import numpy as np
+        with np.load(self.index_path, allow_pickle=False) as index:
+            if int(index['num_perm']) != self.num_perm:
+                self.logger.warning(f"Signature index {self.index_path} was built with another number of permutations, it is ignored")
+                return
+            saved_fingerprint = str(index['fingerprint']) if 'fingerprint' in index else None
+            if saved_fingerprint != (self.fingerprint or ""):
+                self.logger.warning(f"Signature index {self.index_path} was saved for another content of the store, it is ignored")
+                return
+            keys = json.loads(str(index['keys']))
+            signatures = {field: dict(zip(index[f'{field}_ids'].tolist(), index[f'{field}_signatures'])) for field in self.indexes}
+        for doc_number, key in enumerate(keys):
+            self.add(key, {field: signatures[field][doc_number] for field in self.indexes if doc_number in signatures[field]})
+        self.n_persisted = len(keys)
+        self.logger.info(f"Loaded signature index of {self.n_persisted} documents from {self.index_path}")
+
+    def save_index(self, fingerprint=None):
+        """
+        Persists the signatures of every kept document (to be called once they are stored), with the fingerprint of the store holding them
+        """
+        import numpy as np
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        arrays = {'num_perm': np.array(self.num_perm), 'keys': np.array(json.dumps(self.kept_documents)), 'fingerprint': np.array(fingerprint or "")}
+        for field, index in self.indexes.items():
+            arrays[f'{field}_ids'] = np.array(self.ids[field], dtype=np.int64)
+            arrays[f'{field}_signatures'] = np.array(index.signatures, dtype=np.uint64).reshape(-1, self.num_perm)
+        with open(self.index_path, 'wb') as file:
+            np.savez(file, **arrays)
+        self.logger.info(f"Signature index of {len(self.kept_documents)} documents saved to {self.index_path}")
+
+    def write_report(self):
+        """
+        Writes the report of the removed documents and logs a summary
+        """
+        n_new = len(self.kept_documents) - self.n_persisted
+        report = {'kept': n_new, 'removed': len(self.removed_documents), 'updated': len(self.updated_documents),
+                  'removed_documents': self.removed_documents, 'updated_documents': self.updated_documents}
+        self.report_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.report_path, 'w') as file:
+            json.dump(report, file, indent=2)
+        self.logger.info(f"Deduplication: {n_new} documents kept ({len(self.updated_documents)} updates), {len(self.removed_documents)} near-duplicates removed (report saved to {self.report_path})")
+        return report
+
+
+if __name__ == "__main__":
+    pass
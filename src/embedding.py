@@ -1,4 +1,3 @@
-from langchain_huggingface import HuggingFaceEmbeddings
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
@@ -16,6 +15,7 @@ class Embedder:
         """
         Initializes and return the HuggingFaceEmbeddings corresponding to an embedding function object with specified model name, device, and configuration parameters
         """
+        from langchain_huggingface import HuggingFaceEmbeddings
         model_kwargs = {'device': self.embedding_device, 'trust_remote_code': True}
         encode_kwargs = {'normalize_embeddings': True}
         embeddings = HuggingFaceEmbeddings(model_name=self.hf_embedding_model_path, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
@@ -1,7 +1,7 @@
+from pathlib import Path
+import subprocess
 import requests
 import logging
-from langchain_community.document_loaders import PyMuPDFLoader
-from datasets import load_dataset, concatenate_datasets
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
 
@@ -10,12 +10,13 @@ class BiorxivDataFetcher:
     A class to fetch data from the BioRxiv server, including metadata and PDF content,
     for specified categories and date range
     """
-    def __init__(self, categories, start_date, end_date, n_files, server='biorxiv'):
+    def __init__(self, categories, start_date, end_date, n_files, server='biorxiv', skip_urls=None):
         self.categories = categories
         self.start_date = start_date
         self.end_date = end_date
         self.n_files = n_files
         self.server = server
+        self.skip_urls = skip_urls or set()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.info(f"BiorxivFetcher initialized with categories {self.categories}, start_date: {self.start_date}, end_date: {self.end_date}, n_files: {self.n_files}")
 
@@ -40,15 +41,17 @@ class BiorxivDataFetcher:
     
     def fetch_pdf_content(self, pdf_url):
         """
-        Fetches the content (page by page) from a PDF file
+        Fetches the content of a PDF file as a lazy iterator of pages (the file is downloaded, pages are parsed on demand)
         """
+        from langchain_community.document_loaders import PyMuPDFLoader
         loader = PyMuPDFLoader(pdf_url)
-        data = loader.load()
+        data = loader.lazy_load()
         return data
 
     def fetch_data(self):
         """
         Fetches metadata, PDF URLs, and text content from PDFs for the specified categories and date range, stopping when the specified number of files is reached
+        (the PDFs listed in `skip_urls`, already processed by a previous run, are not downloaded and get None as content)
         """
         data = []
         fetched_files = 0
@@ -63,8 +66,12 @@ class BiorxivDataFetcher:
             for paper in metadata['collection']:
                 if paper['category'] in self.categories:
                     pdf_url = self.set_pdf_url(paper['doi'], paper['version'])
-                    content = self.fetch_pdf_content(pdf_url)
-                    self.logger.info(f"Fetched content from {pdf_url} (length: {len(content)} pages)")
+                    if pdf_url in self.skip_urls:
+                        content = None
+                        self.logger.info(f"Skipped {pdf_url} (already processed)")
+                    else:
+                        content = self.fetch_pdf_content(pdf_url)
+                        self.logger.info(f"Fetched content from {pdf_url}")
                     data.append({'url': pdf_url, 'content': content})
                     fetched_files += 1
                     if fetched_files >= self.n_files:
@@ -79,11 +86,12 @@ class GithubDataFetcher:
     """
     A class to fetch XML data from a specified GitHub repository.
     """
-    def __init__(self, owner, repo, path, n_files):
+    def __init__(self, owner, repo, path, n_files, skip_urls=None):
         self.owner = owner
         self.repo = repo
         self.path = path
         self.n_files = n_files
+        self.skip_urls = skip_urls or set()
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.info(f"GithubFetcher initialized with owner: {self.owner}, repo: {self.repo}, path: {self.path}")
         
@@ -119,7 +127,7 @@ class GithubDataFetcher:
     
     def fetch_data(self):
         """
-        Fetches the content of the first `n_files` files from the repository.
+        Fetches the content of the first `n_files` files from the repository (the files listed in `skip_urls` get None as content)
         """
         files = self.get_filenames()
         selected_files = files[:self.n_files]
@@ -129,23 +137,205 @@ class GithubDataFetcher:
 
         for file in selected_files:
             xml_url = file['download_url']
-            content = self.fetch_xml_content(xml_url)
+            content = self.fetch_xml_content(xml_url) if xml_url not in self.skip_urls else None
             data.append({'url': xml_url, 'content': content})
 
         self.logger.info(f"Fetched content for {len(data)} files")
         return data
  
+class GitMirrorDataFetcher:
+    """
+    A class to fetch XML data from a local shallow, sparse and blobless git clone of a repository (by default the eLife article
+    XML repository): the files are listed from the git tree, read in bulk from the object store, and once a revision has been
+    ingested only the files changed since then are fetched
+    """
+    def __init__(self, mirror_dir_path, n_files, remote_url="https://github.com/elifesciences/elife-article-xml.git", path='articles',
+                 branch='master', skip_urls=None, incremental=True, url_template="https://raw.githubusercontent.com/elifesciences/elife-article-xml/{revision}/{path}"):
+        self.mirror_dir_path = Path(mirror_dir_path)
+        self.n_files = n_files
+        self.remote_url = remote_url
+        self.path = path
+        self.branch = branch
+        self.skip_urls = skip_urls or set()
+        self.incremental = incremental
+        self.url_template = url_template
+        self.revision = None
+        self.pending_paths = []
+        self.modified_paths = []
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"GitMirrorDataFetcher initialized with mirror: {self.mirror_dir_path}, remote: {self.remote_url}, path: {self.path}, incremental: {self.incremental}")
+
+    def run_git(self, *args):
+        """
+        Runs a git command in the mirror and returns its standard output
+        """
+        result = subprocess.run(["git", "-C", str(self.mirror_dir_path), *args], capture_output=True, check=True)
+        return result.stdout.decode('utf-8')
+
+    @property
+    def state_path(self):
+        return self.mirror_dir_path / '.git' / 'ingested_revision'
+
+    @property
+    def pending_paths_path(self):
+        return self.mirror_dir_path / '.git' / 'pending_paths'
+
+    @property
+    def fetched_revisions_path(self):
+        return self.mirror_dir_path / '.git' / 'fetched_revisions'
+
+    def update_mirror(self):
+        """
+        Clones the repository (last commit only, without blobs, and with only `path` checked out) or fetches its last commit,
+        then checks it out, which downloads the missing blobs of `path` in one batch; returns the revision
+        """
+        if not (self.mirror_dir_path / '.git').is_dir():
+            self.mirror_dir_path.parent.mkdir(parents=True, exist_ok=True)
+            subprocess.run(["git", "clone", "--depth", "1", "--filter=blob:none", "--sparse", "--no-checkout", "--branch", self.branch,
+                            self.remote_url, str(self.mirror_dir_path)], capture_output=True, check=True)
+            self.run_git("sparse-checkout", "set", self.path)
+            self.logger.info(f"{self.remote_url} cloned into {self.mirror_dir_path}")
+        else:
+            self.run_git("fetch", "--depth", "1", "origin", self.branch)
+        revision = self.run_git("rev-parse", f"refs/remotes/origin/{self.branch}").strip()
+        self.run_git("-c", "advice.detachedHead=false", "checkout", "--quiet", "--detach", revision)
+        self.logger.info(f"Mirror at revision {revision}")
+        return revision
+
+    def get_ingested_revision(self):
+        return self.state_path.read_text().strip() if self.state_path.is_file() else None
+
+    def get_pending_paths(self):
+        return self.pending_paths_path.read_text().splitlines() if self.pending_paths_path.is_file() else []
+
+    def get_fetched_revisions(self):
+        return self.fetched_revisions_path.read_text().splitlines() if self.fetched_revisions_path.is_file() else []
+
+    def record_fetched_revision(self):
+        """
+        Appends the revision to the ones files were fetched at, which are the revisions the stored versions of the files can come from
+        """
+        if self.revision not in self.get_fetched_revisions():
+            with open(self.fetched_revisions_path, 'a') as file:
+                file.write(f"{self.revision}\n")
+
+    def mark_ingested(self):
+        """
+        Records the fetched revision as ingested, with the files listed but left out by `n_files`: the next fetch picks up
+        the files changed since then and the pending ones
+        """
+        if self.revision is not None:
+            self.pending_paths_path.write_text(''.join(f"{path}\n" for path in self.pending_paths))
+            self.state_path.write_text(self.revision)
+            self.logger.info(f"Revision {self.revision} recorded as ingested ({len(self.pending_paths)} files pending)")
+
+    def get_article_key(self, url):
+        """
+        Identifies the article of a file URL regardless of its revision, e.g. to recognize the new version of a modified file
+        (None for the URLs of other sources)
+        """
+        prefix = self.url_template.partition('{revision}')[0]
+        if not url.startswith(prefix):
+            return None
+        return url[len(prefix):].partition('/')[2] or None
+
+    def get_replaced_sources(self):
+        """
+        Returns the sources the previous versions of the fetched files modified since the ingested revision may be stored under
+        (their URLs at every revision files were fetched at before), to be deleted from the vector store
+        """
+        return [self.url_template.format(revision=revision, path=path)
+                for path in self.modified_paths for revision in self.get_fetched_revisions() if revision != self.revision]
+
+    def list_paths(self, revision):
+        """
+        Lists the XML files under `path` from the git tree of the revision
+        """
+        paths = self.run_git("ls-tree", "-r", "--name-only", "-z", revision, "--", self.path).split('\0')
+        return sorted(path for path in paths if path.endswith(".xml"))
+
+    def get_changed_paths(self, old_revision, new_revision):
+        """
+        Lists the XML files under `path` added or modified, and those deleted, between two revisions (renames are an
+        addition and a deletion)
+        """
+        changes = self.run_git("diff", "--name-status", "--no-renames", "-z", old_revision, new_revision, "--", self.path).split('\0')
+        statuses = {path: status for path, status in zip(changes[1::2], changes[0::2]) if path.endswith(".xml")}
+        deleted_paths = {path for path, status in statuses.items() if status == 'D'}
+        if deleted_paths:
+            self.logger.warning(f"{len(deleted_paths)} files deleted since revision {old_revision} (kept in the vector store)")
+        modified_paths = {path for path, status in statuses.items() if status == 'M'}
+        return sorted(path for path, status in statuses.items() if status in ('A', 'M')), modified_paths, deleted_paths
+
+    def read_blobs(self, revision, paths):
+        """
+        Lazily yields the content of the files at a revision, read through a single `git cat-file --batch` process
+        """
+        process = subprocess.Popen(["git", "-C", str(self.mirror_dir_path), "cat-file", "--batch"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            for path in paths:
+                process.stdin.write(f"{revision}:{path}\n".encode('utf-8'))
+                process.stdin.flush()
+                header = process.stdout.readline().decode('utf-8').split()
+                if header[-1] == 'missing':
+                    raise FileNotFoundError(f"{path} not found at revision {revision}")
+                content = process.stdout.read(int(header[2]))
+                process.stdout.read(1)
+                yield content.decode('utf-8')
+        finally:
+            process.stdin.close()
+            process.wait()
+
+    def fetch_data(self):
+        """
+        Lists the first `n_files` files of the last revision, or of those changed since the last ingested revision and those
+        left pending by the previous fetches, and returns a generator of their content read from the object store one file
+        at a time (the files listed in `skip_urls` get None as content)
+        """
+        self.revision = self.update_mirror()
+        ingested_revision = self.get_ingested_revision()
+        changed_paths, modified_paths, deleted_paths = ([], set(), set()) if ingested_revision in (None, self.revision) else self.get_changed_paths(ingested_revision, self.revision)
+        if self.incremental and ingested_revision is not None:
+            pending_paths = [path for path in self.get_pending_paths() if path not in deleted_paths]
+            paths = sorted(set(changed_paths).union(pending_paths))
+            self.logger.info(f"{len(changed_paths)} XML files changed since the ingested revision {ingested_revision}, {len(pending_paths)} pending")
+        else:
+            paths = self.list_paths(self.revision)
+            self.logger.info(f"Found {len(paths)} XML files in the mirror")
+        selected_paths = paths[:self.n_files] if self.n_files is not None else paths
+        self.pending_paths = paths[len(selected_paths):]
+        # the previous versions of the modified files are replaced by the new ones, whether or not near-duplicates are removed
+        self.modified_paths = [path for path in selected_paths if path in modified_paths]
+        self.record_fetched_revision()
+        return self.iter_data(selected_paths)
+
+    def iter_data(self, paths):
+        """
+        Lazily yields the {'url', 'content'} items of the files, so that only one file content is held at a time
+        """
+        # files are identified by their URL at the revision, so that a changed file is not mistaken for its journaled previous version
+        urls = [self.url_template.format(revision=self.revision, path=path) for path in paths]
+        paths_to_read = [path for path, url in zip(paths, urls) if url not in self.skip_urls]
+        contents = self.read_blobs(self.revision, paths_to_read)
+        for path, url in zip(paths, urls):
+            yield {'url': url, 'content': next(contents) if url not in self.skip_urls else None}
+        contents.close()
+        self.logger.info(f"Fetched content for {len(paths)} files ({len(paths_to_read)} read from the object store)")
+
 class HuggingFaceDataFetcher:
     """
     A class to fetch and concatenate datasets from HuggingFace datasets
     """
-    def __init__(self, data_path):
+    def __init__(self, data_path, splits=('train', 'test', 'validation')):
         self.huggingface_data_path = data_path
-        
+        self.splits = splits
+        self.logger = logging.getLogger(self.__class__.__name__)
+
     def concatenate_data(self, dataset):
         """
         Concatenate the train, test, and validation data into one dataset
         """
+        from datasets import concatenate_datasets
         concatenated_dataset = concatenate_datasets([dataset['train'], dataset['test'], dataset['validation']])
         return concatenated_dataset
     
@@ -153,9 +343,47 @@ class HuggingFaceDataFetcher:
         """
         Load train, test, and validation data from .parquet files using HuggingFace datasets
         """
+        from datasets import load_dataset
         dataset = load_dataset(path=self.huggingface_data_path, data_files={'train': 'train.parquet', 'test': 'test.parquet', 'validation': 'validation.parquet'})
         concatenated_dataset = self.concatenate_data(dataset)
         return concatenated_dataset
 
+    def get_parquet_file(self, split):
+        """
+        Downloads (or reads from the local HuggingFace cache) the .parquet file of a split and opens it without loading it
+        """
+        import pyarrow.parquet as pq
+        from huggingface_hub import hf_hub_download
+        path = hf_hub_download(repo_id=self.huggingface_data_path, filename=f"{split}.parquet", repo_type='dataset')
+        return pq.ParquetFile(path)
+
+    def fetch_record_batches(self, columns=('summary', 'year', 'title'), batch_size=1024, n_samples=None, shard_index=0, n_shards=1):
+        """
+        Streams Arrow record batches of the train, test, and validation .parquet files, reading only the given columns
+
+        The row groups of each file are split round-robin between `n_shards` shards (or the batches when a file has
+        fewer row groups than shards) and reading stops once `n_samples` rows have been yielded
+        """
+        n_rows = 0
+        for split in self.splits:
+            parquet_file = self.get_parquet_file(split)
+            n_row_groups = parquet_file.num_row_groups
+            if n_row_groups >= n_shards:
+                row_groups = list(range(shard_index, n_row_groups, n_shards))
+                batches = parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=list(columns))
+            else:
+                batches = (batch for i, batch in enumerate(parquet_file.iter_batches(batch_size=batch_size, columns=list(columns)))
+                           if i % n_shards == shard_index)
+
+            for batch in batches:
+                if n_samples is not None and n_rows + batch.num_rows >= n_samples:
+                    yield batch.slice(0, n_samples - n_rows)
+                    self.logger.info(f"Streamed {n_samples} rows (columns: {list(columns)}, shard {shard_index}/{n_shards})")
+                    return
+                n_rows += batch.num_rows
+                yield batch
+            self.logger.info(f"Streamed split '{split}' ({n_rows} rows so far)")
+        self.logger.info(f"Streamed {n_rows} rows (columns: {list(columns)}, shard {shard_index}/{n_shards})")
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
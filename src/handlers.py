@@ -1,6 +1,9 @@
 import xml.etree.ElementTree as ET
+from collections import Counter
 from src.utils import DataUtils
-from langchain.docstore.document import Document
+from src.records import ArticleRecord
+from src.profiler import profiler
+import re
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
@@ -9,11 +12,13 @@ class XMLDataHandler:
     """
     A class to handle and process fetched XML data by parsing and summarizing content
     """
-    def __init__(self, summarizer, fetched_data):
+    def __init__(self, summarizer, fetched_data, condenser=None, journal=None):
         self.fetched_data = fetched_data
         self.summarizer = summarizer
+        self.condenser = condenser
+        self.journal = journal
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.info(f"XMLDataHandler initialized with fetched_data (length: {len(fetched_data)})")
+        self.logger.info(f"XMLDataHandler initialized with fetched_data (length: {len(fetched_data) if isinstance(fetched_data, list) else 'streamed'}), extractive pre-stage: {condenser is not None}")
         
     def get_paragraphs_from_xml(self, xml_content):
         """
@@ -59,29 +64,126 @@ class XMLDataHandler:
 
     def process_fetched_data(self):
         """
-        Processes the fetched data by extracting paragraphs from sections
+        Processes the fetched data by extracting paragraphs from sections into ArticleRecord objects (the summaries journaled by a previous run are reused)
         """
         processed_data = []
 
         for item in self.fetched_data:
             source = item['url']
+            processed_item = self.journal.get_record(source, 'processed') if self.journal is not None else None
+            if processed_item is not None:
+                processed_data.append(ArticleRecord.from_dict(processed_item))
+                self.logger.info(f"{source} already processed, summary taken from the ingestion journal")
+                continue
             xml_content = item['content']
             content = self.get_paragraphs_from_xml(xml_content)
             title = self.get_title_from_xml(xml_content)
             year = self.get_year_from_xml(xml_content)
-            processed_data.append({'summary': self.summarizer.summarize_by_batch(content), 'year': year, 'title': title, 'source' : source})
+            if self.condenser is not None:
+                content = self.condenser.condense(content)
+            with profiler.stage('summarize'):
+                summary = self.summarizer.summarize_by_batch(content)
+            processed_data.append(ArticleRecord(summary=summary, year=year, title=title, source=source))
+            if self.journal is not None:
+                self.journal.mark_done([source], 'processed', [processed_data[-1].to_dict()])
             self.logger.info(f"{source} added as data source to the processed data")
         return processed_data
     
+class PDFTextExtractor:
+    """
+    A class to extract the main text of a PDF page by page, dropping back matter (references, acknowledgements, supplementary
+    material...), repeated headers and footers and line numbers
+    """
+    BACK_MATTER_HEADING = re.compile(r'^\s*(\d+\.?\s*)?(references|bibliography|literature cited|acknowledge?ments?|supplementary (material|materials|information|figures?|tables?|data)|'
+                                     r'supporting information|author contributions?|competing interests?|conflicts? of interests?|declaration of interests?|'
+                                     r'funding|data (and code )?availability)\s*:?\s*$', re.IGNORECASE)
+    MAIN_TEXT_HEADING = re.compile(r'^\s*(\d+\.?\s*)?(introduction|results|discussion|methods|materials and methods|methods and materials|conclusions?)\s*$', re.IGNORECASE)
+    LINE_NUMBER = re.compile(r'^\s*\d{1,4}\s*$')
+    LEADING_LINE_NUMBER = re.compile(r'^\s*\d{1,4}\s+(?=\S)')
+
+    def __init__(self, count_tokens=None, n_edge_lines=3, n_sample_pages=6, repeated_line_ratio=0.5):
+        self.count_tokens = count_tokens if count_tokens is not None else (lambda text: len(text.split()))
+        self.n_edge_lines = n_edge_lines
+        self.n_sample_pages = n_sample_pages
+        self.repeated_line_ratio = repeated_line_ratio
+
+    @staticmethod
+    def normalize_edge_line(line):
+        """
+        Normalizes a header/footer line so that page numbers do not make it unique
+        """
+        return re.sub(r'\d+', '#', line.strip().lower())
+
+    def find_repeated_lines(self, pages_lines):
+        """
+        Finds the (normalized) lines that appear at the top or bottom of most of the sampled pages
+        """
+        counter = Counter()
+        for lines in pages_lines:
+            edge_lines = lines[:self.n_edge_lines] + lines[-self.n_edge_lines:]
+            counter.update({self.normalize_edge_line(line) for line in edge_lines if line.strip()})
+        min_count = max(2, int(len(pages_lines) * self.repeated_line_ratio))
+        return {line for line, count in counter.items() if count >= min_count}
+
+    def clean_page_lines(self, lines, repeated_lines):
+        """
+        Removes headers/footers, standalone line numbers and leading line numbers from the lines of a page
+        """
+        lines = [line for line in lines if line.strip() and not self.LINE_NUMBER.match(line)
+                 and self.normalize_edge_line(line) not in repeated_lines]
+        if lines and sum(bool(self.LEADING_LINE_NUMBER.match(line)) for line in lines) >= len(lines) / 2:
+            lines = [self.LEADING_LINE_NUMBER.sub('', line) for line in lines]
+        return lines
+
+    def extract(self, pages):
+        """
+        Streams the pages (an iterable of Document objects) and returns the pruned text, the first page and extraction statistics
+        """
+        pages = iter(pages)
+        sampled_pages = []
+        for page in pages:
+            sampled_pages.append(page)
+            if len(sampled_pages) >= self.n_sample_pages:
+                break
+        if not sampled_pages:
+            return "", None, {'n_pages': 0, 'tokens_before': 0, 'tokens_after': 0, 'tokens_saved': 0}
+        repeated_lines = self.find_repeated_lines([page.page_content.splitlines() for page in sampled_pages])
+
+        kept_lines = []
+        in_back_matter = False
+        n_pages = 0
+        tokens_before = 0
+        for page in DataUtils.chain_data(sampled_pages, pages):
+            n_pages += 1
+            tokens_before += self.count_tokens(page.page_content)
+            for line in self.clean_page_lines(page.page_content.splitlines(), repeated_lines):
+                if self.BACK_MATTER_HEADING.match(line):
+                    in_back_matter = True
+                elif self.MAIN_TEXT_HEADING.match(line):
+                    in_back_matter = False
+                if not in_back_matter:
+                    kept_lines.append(line)
+
+        text = ' '.join(kept_lines)
+        tokens_after = self.count_tokens(text)
+        stats = {'n_pages': n_pages, 'tokens_before': tokens_before, 'tokens_after': tokens_after, 'tokens_saved': tokens_before - tokens_after}
+        return text, sampled_pages[0], stats
+
+
 class PDFDataHandler:
     """
     A class to handle and process fetched PDF data by parsing and summarizing content
     """
-    def __init__(self, summarizer, fetched_data):
+    def __init__(self, summarizer, fetched_data, prune_sections=True, condenser=None, journal=None):
         self.fetched_data = fetched_data
         self.summarizer = summarizer
+        self.prune_sections = prune_sections
+        self.condenser = condenser
+        self.journal = journal
+        self.pdf_text_extractor = PDFTextExtractor(count_tokens=summarizer.count_tokens)
+        self.extraction_stats = []
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.info(f"PDFDataHandler initialized with fetched_data (length {len(fetched_data)})")
+        self.logger.info(f"PDFDataHandler initialized with fetched_data (length {len(fetched_data)}), prune_sections: {self.prune_sections}, extractive pre-stage: {condenser is not None}")
     
     def get_title_from_pdf(self, pdf_content):
         """
@@ -107,19 +209,48 @@ class PDFDataHandler:
     
     def get_paragraphs_from_pdf(self, pdf_content):
         return ''.join([page.page_content for page in pdf_content])
-        
+
+    def get_pruned_text_from_pdf(self, source, pdf_content):
+        """
+        Extracts the main text of a PDF page by page and logs the number of summarizer tokens saved
+        """
+        content, first_page, stats = self.pdf_text_extractor.extract(pdf_content)
+        self.extraction_stats.append({'source': source, **stats})
+        saved_ratio = stats['tokens_saved'] / stats['tokens_before'] if stats['tokens_before'] else 0.0
+        self.logger.info(f"Main text extracted from {stats['n_pages']} pages of {source}: {stats['tokens_after']}/{stats['tokens_before']} tokens kept ({stats['tokens_saved']} tokens saved, {saved_ratio:.0%})")
+        return content, first_page
+
     def process_fetched_data(self):
         """
-        Processes the fetched data and returns a list of dictionaries where each dictionary contains keys 'summary', 'year', 'title' and 'source'
+        Processes the fetched data and returns a list of ArticleRecord objects with a 'summary', 'year', 'title' and 'source'
+        (the summaries journaled by a previous run are reused)
         """
         processed_data = []
-        
+
         for item in self.fetched_data:
             source = item['url']
-            content = self.get_paragraphs_from_pdf(item['content'])
-            title = self.get_title_from_pdf(item['content'][0])
-            year = self.get_year_from_pdf(item['content'][0])
-            processed_data.append({'summary': self.summarizer.summarize_by_batch(content), 'year': year, 'title': title, 'source' : source})
+            processed_item = self.journal.get_record(source, 'processed') if self.journal is not None else None
+            if processed_item is not None:
+                processed_data.append(ArticleRecord.from_dict(processed_item))
+                self.logger.info(f"{source} already processed, summary taken from the ingestion journal")
+                continue
+            if self.prune_sections:
+                content, first_page = self.get_pruned_text_from_pdf(source, item['content'])
+            else:
+                pages = list(item['content'])
+                content, first_page = self.get_paragraphs_from_pdf(pages), pages[0] if pages else None
+            if first_page is None:
+                self.logger.warning(f"No page found in {source}")
+                continue
+            title = self.get_title_from_pdf(first_page)
+            year = self.get_year_from_pdf(first_page)
+            if self.condenser is not None:
+                content = self.condenser.condense(content)
+            with profiler.stage('summarize'):
+                summary = self.summarizer.summarize_by_batch(content)
+            processed_data.append(ArticleRecord(summary=summary, year=year, title=title, source=source))
+            if self.journal is not None:
+                self.journal.mark_done([source], 'processed', [processed_data[-1].to_dict()])
             self.logger.info(f"{source} added as data source to the processed data")
         return processed_data
     
@@ -132,39 +263,52 @@ class ParquetDataHandler:
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.info(f"HuggingFaceDataHandler initialized with fetched_data (length {len(fetched_data)})")
         
-    def filter_huggingface_data(self, keys_to_keep):
-        """
-        Filters fetched data to keep specified keys
-        """
-        self.logger.info(f"Data filtered by keeping keys: {keys_to_keep}")
-        return [{k: d[k] for k in keys_to_keep} for d in self.fetched_data]
-    
     def process_fetched_data(self):
         """
-        Processes fetched data by filtering and adding data source information
+        Processes fetched data by keeping the 'summary', 'year' and 'title' keys and adding data source information, as ArticleRecord objects
         """
         source = "https://huggingface.co/datasets/pszemraj/scientific_lay_summarisation-elife-norm" 
-        filtered_data = self.filter_huggingface_data(keys_to_keep = ['summary', 'year', 'title'])
-        for item in filtered_data:
-            item['source'] = source
+        processed_data = [ArticleRecord(summary=item['summary'], year=item['year'], title=item['title'], source=source) for item in self.fetched_data]
         self.logger.info(f"{source} added as data source to the processed data")
-        return filtered_data
+        return processed_data
+
+class ParquetBatchDataHandler:
+    """
+    A class to handle Arrow record batches streamed from Parquet files, one batch at a time
+    """
+    def __init__(self, record_batches, source="https://huggingface.co/datasets/pszemraj/scientific_lay_summarisation-elife-norm"):
+        self.record_batches = record_batches
+        self.source = source
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"ParquetBatchDataHandler initialized with source: {self.source}")
+
+    def process_fetched_data(self):
+        """
+        Lazily yields one ArticleRecord per row of the record batches (converted column by column, all sharing the source string)
+        """
+        for batch in self.record_batches:
+            with profiler.stage('parse'):
+                summaries, years, titles = [batch.column(name).to_pylist() for name in ('summary', 'year', 'title')]
+            for summary, year, title in zip(summaries, years, titles):
+                yield ArticleRecord(summary=summary, year=year, title=title, source=self.source)
 
 class DocumentCreator:
     """
-    A class to create transform processed data items into documents 
+    A class to create transform processed data items (ArticleRecord objects or dictionaries) into documents 
     """
     def __init__(self, *args):
         self.processed_data = DataUtils.merge_data(*args)
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    @staticmethod
+    def to_record(item):
+        return item if isinstance(item, ArticleRecord) else ArticleRecord.from_dict(item)
+
     def create_document_from_dict(self, item):
         """
-        Creates a Document object from a dictionary item
+        Creates a Document object from a processed data item
         """
-        page_content = item['summary']
-        metadata = {'publication_year': item['year'], 'article_source': item['source'], 'article_title': item['title']}
-        return Document(page_content=page_content, metadata=metadata)
+        return self.to_record(item).to_document()
 
     def create_documents_from_data(self):
         """
@@ -173,6 +317,30 @@ class DocumentCreator:
         self.logger.info(f"Creating documents for {len(self.processed_data)} items with 'summary' as page content and 'article_title', 'publication_year', 'article_source' as metadata")
         return list(map(self.create_document_from_dict, self.processed_data))
 
+    @classmethod
+    def from_streams(cls, *args):
+        """
+        Creates a DocumentCreator that chains the processed data lazily instead of merging it into one list
+        """
+        document_creator = cls()
+        document_creator.processed_data = DataUtils.chain_data(*args)
+        return document_creator
+
+    def iter_documents(self):
+        """
+        Lazily yields Document objects from processed data
+        """
+        self.logger.info("Streaming documents with 'summary' as page content and 'article_title', 'publication_year', 'article_source' as metadata")
+        return map(self.create_document_from_dict, self.processed_data)
+
+    def iter_records(self):
+        """
+        Lazily yields the processed data as ArticleRecord objects, which the deduplicator and the vector store writer take in place
+        of Document objects (exposing the same `page_content` and `metadata`)
+        """
+        self.logger.info("Streaming records with 'summary' as page content and 'article_title', 'publication_year', 'article_source' as metadata")
+        return map(self.to_record, self.processed_data)
+
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -0,0 +1,101 @@
+from pathlib import Path
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+
+class IngestionJournal:
+    """
+    A class to durably record, per document, the ingestion stages completed by a run ('processed' with its summarized
+    record, then 'stored'), so that a run restarted with the same parameters skips the finished work
+    """
+    def __init__(self, journal_path, run_parameters):
+        self.journal_path = Path(journal_path)
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        self.run_parameters = run_parameters
+        self.run_id = hashlib.sha1(json.dumps(run_parameters, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.journal_path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, parameters TEXT, status TEXT, started REAL, updated REAL);
+            CREATE TABLE IF NOT EXISTS documents (run_id TEXT, doc_key TEXT, stage TEXT, record TEXT, updated REAL,
+                                                  PRIMARY KEY (run_id, doc_key, stage));
+        """)
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.start_run()
+
+    def start_run(self):
+        """
+        Registers the run, or resumes it if a run with the same parameters already exists
+        """
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT status FROM runs WHERE run_id = ?", (self.run_id,)).fetchone()
+            if row is None:
+                self.connection.execute("INSERT INTO runs VALUES (?, ?, 'running', ?, ?)",
+                                        (self.run_id, json.dumps(self.run_parameters, sort_keys=True, default=str), time.time(), time.time()))
+                self.logger.info(f"Ingestion run {self.run_id} started (journal: {self.journal_path})")
+                return
+            self.connection.execute("UPDATE runs SET status = 'running', updated = ? WHERE run_id = ?", (time.time(), self.run_id))
+        counts = dict(self.connection.execute("SELECT stage, COUNT(*) FROM documents WHERE run_id = ? GROUP BY stage", (self.run_id,)).fetchall())
+        self.logger.info(f"Resuming ingestion run {self.run_id} (previous status: {row[0]}, documents per completed stage: {counts})")
+
+    def reset_run(self):
+        """
+        Forgets the progress of the run so that it starts from scratch
+        """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM documents WHERE run_id = ?", (self.run_id,))
+        self.logger.info(f"Progress of ingestion run {self.run_id} discarded")
+
+    def get_record(self, doc_key, stage='processed'):
+        """
+        Returns the record saved for a document at a stage, or None if the stage was not completed
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT record FROM documents WHERE run_id = ? AND doc_key = ? AND stage = ?",
+                                          (self.run_id, doc_key, stage)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def is_done(self, doc_key, stage):
+        return self.get_record(doc_key, stage) is not None
+
+    def get_done_keys(self, stage):
+        with self.lock:
+            rows = self.connection.execute("SELECT doc_key FROM documents WHERE run_id = ? AND stage = ?", (self.run_id, stage)).fetchall()
+        return {row[0] for row in rows}
+
+    def mark_done(self, doc_keys, stage, records=None):
+        """
+        Records (in one transaction) that a stage is completed for the given documents, with their optional records
+        """
+        records = records if records is not None else [None] * len(doc_keys)
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                                        [(self.run_id, doc_key, stage, json.dumps(record if record is not None else {}), now)
+                                         for doc_key, record in zip(doc_keys, records)])
+            self.connection.execute("UPDATE runs SET updated = ? WHERE run_id = ?", (now, self.run_id))
+
+    def complete_run(self):
+        """
+        Marks the run as completed and forgets its progress: it is only kept to resume an interrupted run, and a completed run
+        restarted with the same parameters (e.g. after the vector store was deleted) must fetch and store everything again
+        """
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE runs SET status = 'completed', updated = ? WHERE run_id = ?", (time.time(), self.run_id))
+            self.connection.execute("DELETE FROM documents WHERE run_id = ?", (self.run_id,))
+        self.logger.info(f"Ingestion run {self.run_id} completed")
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    pass
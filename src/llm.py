@@ -1,7 +1,9 @@
-from langchain_community.chat_models import ChatOllama
 import subprocess
+import shutil
+import json
+import time
+import requests
 import logging
-from langchain_huggingface import HuggingFaceEndpoint
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
 
@@ -9,9 +11,15 @@ class LLMClient:
     """
     A class to initialize the LLM as a client
     """
-    def __init__(self, llm_path, temperature, use_ollama, huggingface_api_token):
+    def __init__(self, llm_path, temperature, use_ollama, huggingface_api_token, ollama_base_url="http://localhost:11434", ollama_keep_alive="30m",
+                 prefix_cache=False, num_ctx=8192):
         self.huggingface_api_token = huggingface_api_token
         self.use_ollama = use_ollama
+        self.ollama_base_url = ollama_base_url
+        self.ollama_keep_alive = ollama_keep_alive
+        self.prefix_cache = prefix_cache
+        self.num_ctx = num_ctx
+        self.prompt_cache_monitor = None
         self.llm_path = llm_path
         self.temperature = temperature
         self.logger = logging.getLogger(self.__class__.__name__)
@@ -20,15 +28,31 @@ class LLMClient:
         """
         Sets an LLM from Ollama for interacting with the LLM
         """
-        llm = ChatOllama(model=self.llm_path,
-                         temperature=self.temperature)
-        self.logger.info(f"Using ChatOllama with model: {self.llm_path}, temperature: {self.temperature}")
+        from langchain_community.chat_models import ChatOllama
+        if not self.prefix_cache:
+            llm = ChatOllama(model=self.llm_path,
+                             temperature=self.temperature,
+                             base_url=self.ollama_base_url,
+                             keep_alive=self.ollama_keep_alive)
+        else:
+            # Ollama reuses the cached prefix shared with the previous prompt: the context window is enlarged so that
+            # the growing prompts are not truncated from the front, and the reuse is measured on each call
+            from src.prompt_cache import PromptCacheMonitor
+            self.prompt_cache_monitor = PromptCacheMonitor()
+            llm = ChatOllama(model=self.llm_path,
+                             temperature=self.temperature,
+                             base_url=self.ollama_base_url,
+                             keep_alive=self.ollama_keep_alive,
+                             num_ctx=self.num_ctx,
+                             callbacks=[self.prompt_cache_monitor])
+        self.logger.info(f"Using ChatOllama with model: {self.llm_path}, temperature: {self.temperature}, keep_alive: {self.ollama_keep_alive}, prefix cache: {self.prefix_cache}")
         return llm
 
     def set_llm_from_huggingface_hub(self):
         """
         Sets HauggingFace Endpoint for interacting with the LLM
         """
+        from langchain_huggingface import HuggingFaceEndpoint
         llm = HuggingFaceEndpoint(repo_id=self.llm_path,
                                   temperature=self.temperature,
                                   task="text-generation",
@@ -44,90 +68,142 @@ class LLMClient:
         Sets a client for interacting with the LLM
         """
         if self.use_ollama:
-            ollama_down = OllamaDown(llm_path=self.llm_path)
-            ollama_down.manage_ollama()
+            ollama_manager = OllamaManager(llm_path=self.llm_path, base_url=self.ollama_base_url, keep_alive=self.ollama_keep_alive)
+            ollama_manager.manage_ollama()
             return self.set_llm_from_ollama()
         else:
             return self.set_llm_from_huggingface_hub()
 
-class OllamaDown:
+class OllamaManager:
     """
-    Manages the installation and setup of Ollama and the required used LLM
+    Manages the Ollama server and the used LLM through the Ollama HTTP API: health check (starting `ollama serve` if needed),
+    model pull with progress, preloading with a keep-alive and warm-up with a dummy prompt
     """
-    def __init__(self, llm_path, url="https://ollama.com/install.sh"):
-        self.url = url
+    def __init__(self, llm_path, base_url="http://localhost:11434", keep_alive="30m", timeout=10,
+                 start_timeout=30, install_url="https://ollama.com/install.sh"):
         self.llm_path = llm_path
+        self.base_url = base_url.rstrip('/')
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.install_url = install_url
+        self.server_process = None
         self.logger = logging.getLogger(self.__class__.__name__)
 
-
-    def is_ollama_installed(self):
+    def is_server_running(self):
         """
-        Checks if Ollama is installed by running a version command
+        Checks that the Ollama server answers on its version endpoint
         """
-        result = subprocess.run("ollama --version",
-                                shell=True,
-                                text=True,
-                                capture_output=True)
-        if result.returncode == 0:
-            self.logger.info(f"Ollama: {result.stdout.strip()}")
-            return True
-        else:
-            self.logger.warning("Ollama is not installed")
+        try:
+            response = requests.get(f"{self.base_url}/api/version", timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
             return False
-
-    def download_ollama(self):
-        """
-        Downloads and installs Ollama from the Ollama download URL
-        """
-        result = subprocess.run(f"curl -fsSL {self.url} | sh",
-                                shell=True,
-                                text=True,
-                                capture_output=True)
-        if result.returncode == 0:
-            self.logger.info("Ollama has been installed successfully")
-        else:
-            self.logger.warning(f"Failed to install Ollama")
-
-    def is_model_installed(self):
-        """
-        Checks if the specified LLM is already installed in Ollama
-        """
-        result = subprocess.run("ollama list",
-                                shell=True,
-                                text=True,
-                                capture_output=True)
-        models = result.stdout.strip().split('\n')
-        if self.llm_path in models:
-            self.logger.info(f"Model '{self.llm_path}' is already installed")
-            return True
-        else:
-            return False
-
-    def pull_ollama_model(self):
-        """
-        Pulls the specified LLM from Ollama if it is not already installed
-        """
-        result = subprocess.run(f"ollama pull {self.llm_path}",
-                                shell=True,
-                                text=True,
-                                capture_output=True)
-        if result.returncode == 0:
-            self.logger.info(f"Model '{self.llm_path}' has been pulled successfully")
-        else:
-            self.logger.warning(f"Failed to pull model '{self.llm_path}' from Ollama models")
+        self.logger.info(f"Ollama server {response.json().get('version', '')} running at {self.base_url}")
+        return True
+
+    def install_ollama(self):
+        """
+        Downloads and installs Ollama from the Ollama install script
+        """
+        result = subprocess.run(["sh", "-c", f"curl -fsSL {self.install_url} | sh"], text=True, capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Failed to install Ollama: {result.stderr.strip()}")
+        self.logger.info("Ollama has been installed successfully")
+
+    def start_server(self):
+        """
+        Starts `ollama serve` in the background (installing Ollama first if missing) and waits until it answers
+        """
+        if shutil.which("ollama") is None:
+            self.install_ollama()
+        self.logger.info("Starting the Ollama server")
+        self.server_process = subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + self.start_timeout
+        while time.monotonic() < deadline:
+            if self.is_server_running():
+                return
+            time.sleep(0.5)
+        raise RuntimeError(f"The Ollama server did not answer at {self.base_url} within {self.start_timeout} seconds")
+
+    def is_model_available(self):
+        """
+        Checks if the LLM is already pulled (an untagged name matches its 'latest' tag)
+        """
+        response = requests.get(f"{self.base_url}/api/tags", timeout=self.timeout)
+        response.raise_for_status()
+        names = {model['name'] for model in response.json().get('models', [])}
+        available = self.llm_path in names or f"{self.llm_path}:latest" in names
+        if available:
+            self.logger.info(f"Model '{self.llm_path}' is already available")
+        return available
+
+    def pull_model(self):
+        """
+        Pulls the LLM, logging the download progress streamed by the server (every 10% of each layer)
+        """
+        self.logger.info(f"Pulling model '{self.llm_path}'")
+        # no read timeout: the server can stay silent for minutes between progress lines (e.g. while verifying a multi-GB layer)
+        with requests.post(f"{self.base_url}/api/pull", json={'model': self.llm_path, 'stream': True}, stream=True, timeout=(self.timeout, None)) as response:
+            response.raise_for_status()
+            last_logged = {}
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                progress = json.loads(line)
+                if 'error' in progress:
+                    raise RuntimeError(f"Failed to pull model '{self.llm_path}': {progress['error']}")
+                status, total, completed = progress.get('status', ''), progress.get('total'), progress.get('completed')
+                if total and completed is not None:
+                    percent = int(100 * completed / total)
+                    if percent // 10 > last_logged.get(status, -1):
+                        last_logged[status] = percent // 10
+                        self.logger.info(f"{status}: {percent}% of {total / 2**20:.0f} MiB")
+                elif status:
+                    self.logger.info(status)
+        self.logger.info(f"Model '{self.llm_path}' has been pulled successfully")
+
+    def generate(self, prompt=None, num_predict=None):
+        """
+        Sends a non-streamed generate request that (pre)loads the model and keeps it loaded for `keep_alive`
+        """
+        payload = {'model': self.llm_path, 'keep_alive': self.keep_alive, 'stream': False}
+        if prompt is not None:
+            payload['prompt'] = prompt
+        if num_predict is not None:
+            payload['options'] = {'num_predict': num_predict}
+        response = requests.post(f"{self.base_url}/api/generate", json=payload, timeout=None)
+        response.raise_for_status()
+        return response.json()
+
+    def preload_model(self):
+        """
+        Loads the model into memory without generating anything (a request without prompt)
+        """
+        start = time.perf_counter()
+        result = self.generate()
+        self.logger.info(f"Model '{self.llm_path}' loaded in {time.perf_counter() - start:.2f}s (load_duration: "
+                         f"{result.get('load_duration', 0) / 1e9:.2f}s), kept alive for {self.keep_alive}")
+
+    def warm_up(self, prompt="Hello"):
+        """
+        Runs a dummy prompt generating a single token, so that the first question does not pay the first evaluation
+        """
+        start = time.perf_counter()
+        result = self.generate(prompt=prompt, num_predict=1)
+        self.logger.info(f"Model '{self.llm_path}' warmed up in {time.perf_counter() - start:.2f}s (prompt_eval_duration: "
+                         f"{result.get('prompt_eval_duration', 0) / 1e9:.2f}s)")
 
     def manage_ollama(self):
         """
-        Manages the installation process of Ollama and the specified LLM
+        Makes sure the server is running and the LLM is pulled, loaded and warmed up before serving
         """
-        ollama_down = OllamaDown(model=self.llm_path)
-        # check if Ollama is installed, if not, download it
-        if not ollama_down.is_ollama_installed():
-            ollama_down.download_ollama()
-
-        # check if the model is installed, if not, pull it
-        if not ollama_down.is_model_installed():
-            ollama_down.pull_ollama_model()
+        if not self.is_server_running():
+            self.start_server()
+        if not self.is_model_available():
+            self.pull_model()
+        self.preload_model()
+        self.warm_up()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+from contextlib import contextmanager
+import ctypes
+import gc
+import os
+import sys
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+class ModelRegistry:
+    """
+    A central registry of the heavy resources of the process (embedding models, summarizer, vector stores): each one is loaded
+    on its first use, reference counted, and unloaded once idle for its idle timeout, within a resident memory (RSS) budget
+    """
+    def __init__(self, rss_budget_mib=None, reaper_interval=30):
+        self.rss_budget_mib = rss_budget_mib
+        self.reaper_interval = reaper_interval
+        self.entries = {}
+        self.lock = threading.RLock()
+        self.reaper_thread = None
+        self.stop_event = threading.Event()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def get_rss_mib():
+        """
+        Current resident set size of the process (from /proc on Linux, the peak RSS elsewhere)
+        """
+        try:
+            with open('/proc/self/statm') as file:
+                return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+        except OSError:
+            import resource
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak_rss / 2**20 if sys.platform == 'darwin' else peak_rss / 2**10
+
+    @staticmethod
+    def release_memory():
+        """
+        Collects the garbage and returns the freed memory to the system (CUDA cache and glibc heap)
+        """
+        gc.collect()
+        if 'torch' in sys.modules and sys.modules['torch'].cuda.is_available():
+            sys.modules['torch'].cuda.empty_cache()
+        if sys.platform.startswith('linux'):
+            try:
+                ctypes.CDLL('libc.so.6').malloc_trim(0)
+            except (OSError, AttributeError):
+                pass
+
+    def register(self, name, loader, unloader=None, idle_timeout=None):
+        """
+        Registers a resource by the function loading it (and optionally the one releasing it): an idle resource is unloaded
+        after `idle_timeout` seconds (0: as soon as it is released, None: only when the budget requires it)
+        """
+        with self.lock:
+            if name in self.entries and self.entries[name]['resource'] is not None:
+                raise ValueError(f"Resource '{name}' is already registered and loaded")
+            self.entries[name] = {'loader': loader, 'unloader': unloader, 'idle_timeout': idle_timeout, 'resource': None,
+                                  'refcount': 0, 'last_used': None, 'footprint_mib': None, 'load_seconds': None, 'entry_lock': threading.Lock()}
+        return self
+
+    def acquire(self, name):
+        """
+        Returns the resource (loaded on the first call) and increments its reference count
+        """
+        entry = self.entries[name]
+        # loading can take minutes, so only the resource being loaded is locked
+        with entry['entry_lock']:
+            if entry['resource'] is None:
+                first_load = entry['footprint_mib'] is None
+                self.make_room(entry['footprint_mib'] or 0, exclude=name)
+                rss_before = self.get_rss_mib()
+                start = time.perf_counter()
+                resource = entry['loader']()
+                entry.update({'load_seconds': time.perf_counter() - start, 'footprint_mib': max(0.0, self.get_rss_mib() - rss_before)})
+                with self.lock:
+                    entry['resource'] = resource
+                del resource
+                self.logger.info(f"Loaded '{name}' in {entry['load_seconds']:.2f}s (+{entry['footprint_mib']:.0f} MiB, RSS {self.get_rss_mib():.0f} MiB)")
+                # the footprint of a first load is only known once loaded, so the budget is checked afterwards: a resource
+                # that does not fit even with every idle one unloaded is unloaded again
+                try:
+                    self.make_room(0, exclude=name, strict=first_load)
+                except MemoryError:
+                    self.unload(name)
+                    raise
+            with self.lock:
+                entry['refcount'] += 1
+                entry['last_used'] = time.monotonic()
+                return entry['resource']
+
+    def release(self, name):
+        """
+        Decrements the reference count of the resource (unloaded right away if its idle timeout is 0)
+        """
+        with self.lock:
+            entry = self.entries[name]
+            if entry['refcount'] == 0:
+                raise RuntimeError(f"Resource '{name}' released more times than acquired")
+            entry['refcount'] -= 1
+            entry['last_used'] = time.monotonic()
+            if entry['refcount'] == 0 and entry['idle_timeout'] == 0:
+                self.unload(name)
+
+    @contextmanager
+    def use(self, name):
+        """
+        Acquires the resource for the duration of the wrapped block
+        """
+        resource = self.acquire(name)
+        try:
+            yield resource
+        finally:
+            # the generator frame must not keep the resource alive while it is unloaded
+            del resource
+            self.release(name)
+
+    def unload(self, name):
+        """
+        Unloads an idle resource and returns the memory freed (MiB)
+        """
+        with self.lock:
+            entry = self.entries[name]
+            if entry['resource'] is None:
+                return 0.0
+            if entry['refcount'] > 0:
+                raise RuntimeError(f"Resource '{name}' is still in use ({entry['refcount']} references)")
+            rss_before = self.get_rss_mib()
+            resource, entry['resource'] = entry['resource'], None
+            if entry['unloader'] is not None:
+                entry['unloader'](resource)
+            del resource
+            self.release_memory()
+            freed_mib = max(0.0, rss_before - self.get_rss_mib())
+            self.logger.info(f"Unloaded '{name}' (-{freed_mib:.0f} MiB, RSS {self.get_rss_mib():.0f} MiB)")
+            return freed_mib
+
+    def get_idle_names(self, exclude=None):
+        """
+        Names of the loaded resources without references, least recently used first
+        """
+        with self.lock:
+            idle_entries = [(entry['last_used'] or 0, name) for name, entry in self.entries.items()
+                            if entry['resource'] is not None and entry['refcount'] == 0 and name != exclude]
+        return [name for _, name in sorted(idle_entries)]
+
+    def make_room(self, needed_mib, exclude=None, strict=False):
+        """
+        Unloads idle resources (least recently used first) until `needed_mib` more fit in the RSS budget, and raises a
+        MemoryError if they still do not fit (if the RSS is already over budget, only with `strict`)
+        """
+        if self.rss_budget_mib is None:
+            return
+        for name in self.get_idle_names(exclude=exclude):
+            if self.get_rss_mib() + needed_mib <= self.rss_budget_mib:
+                return
+            self.unload(name)
+        rss_mib = self.get_rss_mib()
+        if rss_mib + needed_mib > self.rss_budget_mib:
+            message = f"RSS {rss_mib:.0f} MiB + {needed_mib:.0f} MiB exceeds the budget of {self.rss_budget_mib} MiB with every idle resource unloaded"
+            if needed_mib or strict:
+                raise MemoryError(message)
+            # the resource is already loaded and in use, so the overshoot can only be reported
+            self.logger.warning(message)
+
+    def unload_expired(self):
+        """
+        Unloads the resources idle for longer than their idle timeout
+        """
+        now = time.monotonic()
+        with self.lock:
+            expired_names = [name for name in self.get_idle_names() if self.entries[name]['idle_timeout'] is not None
+                             and now - self.entries[name]['last_used'] >= self.entries[name]['idle_timeout']]
+            for name in expired_names:
+                self.unload(name)
+        return expired_names
+
+    def start(self):
+        """
+        Starts the background thread unloading the expired resources
+        """
+        def reap():
+            while not self.stop_event.wait(self.reaper_interval):
+                self.unload_expired()
+        self.reaper_thread = threading.Thread(target=reap, name="ModelRegistryReaper", daemon=True)
+        self.reaper_thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def memory_report(self):
+        """
+        Logs and returns the footprint (RSS growth when loaded), load time and state of each resource, and the RSS of the process
+        """
+        with self.lock:
+            resources = [{'name': name, 'loaded': entry['resource'] is not None, 'refcount': entry['refcount'],
+                          'footprint_mib': entry['footprint_mib'], 'load_seconds': entry['load_seconds']} for name, entry in self.entries.items()]
+            # the stores measuring their own memory (e.g. the quantized ones) report it as well
+            for resource, entry in zip(resources, self.entries.values()):
+                if entry['resource'] is not None and hasattr(entry['resource'], 'memory_report'):
+                    resource['details'] = entry['resource'].memory_report()
+        report = {'rss_mib': self.get_rss_mib(), 'rss_budget_mib': self.rss_budget_mib, 'resources': resources}
+        self.logger.info(f"Memory report (RSS {report['rss_mib']:.0f} MiB, budget {self.rss_budget_mib or 'none'} MiB):")
+        for resource in resources:
+            footprint = f"{resource['footprint_mib']:7.0f} MiB" if resource['footprint_mib'] is not None else "      - MiB"
+            self.logger.info(f"  {footprint}  {'loaded' if resource['loaded'] else 'unloaded':<8} refs {resource['refcount']}  {resource['name']}")
+        return report
+
+
+if __name__ == "__main__":
+    pass
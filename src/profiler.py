@@ -0,0 +1,297 @@
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+import contextvars
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+STAGES = ('turn', 'contextualize', 'retrieve', 'generate', 'summarize', 'ingestion', 'fetch', 'parse', 'embed')
+
+
+class SamplingProfiler:
+    """
+    A class to sample, from a background thread, the Python stacks of the threads running a profiled stage (marked with `stage`),
+    and to write them in the collapsed stack format of flame graphs (flamegraph.pl, speedscope), each stack rooted at its innermost
+    stage name; the stages are context variables, so the worker threads started by LangChain inherit the stage of their caller
+    """
+    def __init__(self, output_dir_path='profiles', interval=0.005):
+        self.output_dir_path = Path(output_dir_path)
+        self.interval = interval
+        self.context_stages = contextvars.ContextVar('profiler_stages', default=())
+        self.thread_stages = {}
+        self.thread_depths = Counter()
+        self.samples = Counter()
+        self.captured_stages = None
+        self.max_captures = None
+        self.n_captures = 0
+        self.started = None
+        self.running = False
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.sampler_thread = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def configure(self, output_dir_path=None, interval=None):
+        if output_dir_path is not None:
+            self.output_dir_path = Path(output_dir_path)
+        if interval is not None:
+            self.interval = interval
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Marks the code run in the block as a stage (stages nest)
+        """
+        self.enter_stage(name)
+        try:
+            yield
+        finally:
+            self.exit_stage(name)
+
+    def enter_stage(self, name):
+        stages = self.context_stages.get() + (name,)
+        self.context_stages.set(stages)
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.thread_stages[thread_id] = stages
+            self.thread_depths[thread_id] += 1
+
+    def exit_stage(self, name):
+        """
+        Leaves a stage; the completion of a profiled stage (not nested in another profiled one) counts as a capture, and the profiler
+        stops after `max_captures` captures
+        """
+        stages = self.context_stages.get()
+        if not stages or stages[-1] != name:
+            return
+        self.context_stages.set(stages[:-1])
+        thread_id = threading.get_ident()
+        with self.lock:
+            self.thread_depths[thread_id] -= 1
+            # a worker thread leaving the stages it entered is not sampled anymore, even if it inherited outer stages
+            if self.thread_depths[thread_id] > 0:
+                self.thread_stages[thread_id] = stages[:-1]
+            else:
+                self.thread_stages.pop(thread_id, None)
+                self.thread_depths.pop(thread_id, None)
+            if not (self.running and self.max_captures is not None and self.is_captured((name,)) and not self.is_captured(stages[:-1])):
+                return
+            self.n_captures += 1
+            last_capture = self.n_captures == self.max_captures
+        if last_capture:
+            threading.Thread(target=self.stop, name="ProfilerStop", daemon=True).start()
+
+    def is_captured(self, stages):
+        """
+        Whether code running in the given (nested) stages is profiled
+        """
+        return bool(stages) and (self.captured_stages is None or any(stage in self.captured_stages for stage in stages))
+
+    def start(self, stages=None, max_captures=None):
+        """
+        Starts sampling the given stages (all by default), until stopped or until `max_captures` of them are completed
+        """
+        with self.lock:
+            if self.running:
+                return False
+            self.captured_stages = set(stages) if stages and 'all' not in stages else None
+            self.max_captures = max_captures
+            self.n_captures = 0
+            self.samples = Counter()
+            self.started = time.time()
+            self.running = True
+            self.stop_event.clear()
+            self.sampler_thread = threading.Thread(target=self.sample, name="SamplingProfiler", daemon=True)
+            self.sampler_thread.start()
+        self.logger.info(f"Profiling stages {sorted(self.captured_stages) if self.captured_stages else 'all'} every {self.interval * 1000:.0f} ms"
+                         + (f" for {max_captures} captures" if max_captures else ""))
+        return True
+
+    @staticmethod
+    def format_frame(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def sample(self):
+        """
+        Records the stacks of the threads in a profiled stage at every interval (the stacks are walked outside the lock, which
+        the threads entering and leaving stages share)
+        """
+        own_thread_id = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            frames = sys._current_frames()
+            with self.lock:
+                thread_stages = list(self.thread_stages.items())
+            stacks = []
+            for thread_id, stages in thread_stages:
+                if thread_id == own_thread_id or thread_id not in frames or not self.is_captured(stages):
+                    continue
+                stack = []
+                frame = frames[thread_id]
+                while frame is not None:
+                    stack.append(self.format_frame(frame))
+                    frame = frame.f_back
+                stacks.append(';'.join([stages[-1], *reversed(stack)]))
+            with self.lock:
+                self.samples.update(stacks)
+
+    def stop(self):
+        """
+        Stops sampling and writes the collapsed stacks (one `stage;frame;...;frame count` line per stack), returning the file path
+        """
+        with self.lock:
+            if not self.running:
+                return None
+            self.running = False
+            self.stop_event.set()
+        self.sampler_thread.join()
+        self.output_dir_path.mkdir(parents=True, exist_ok=True)
+        name = f"profile_{time.strftime('%Y%m%d_%H%M%S', time.localtime(self.started))}"
+        output_path = self.output_dir_path / f"{name}.folded"
+        index = 1
+        while output_path.exists():
+            output_path = self.output_dir_path / f"{name}_{index}.folded"
+            index += 1
+        with open(output_path, 'w') as file:
+            for stack, count in sorted(self.samples.items()):
+                file.write(f"{stack} {count}\n")
+        n_samples = sum(self.samples.values())
+        per_stage = Counter()
+        for stack, count in self.samples.items():
+            per_stage[stack.split(';', 1)[0]] += count
+        self.logger.info(f"Profile of {n_samples} samples ({', '.join(f'{stage}: {count}' for stage, count in per_stage.most_common())}) written to {output_path}")
+        return output_path
+
+    def status(self):
+        with self.lock:
+            return {'running': self.running, 'stages': sorted(self.captured_stages) if self.captured_stages else 'all', 'n_samples': sum(self.samples.values()),
+                    'n_captures': self.n_captures, 'max_captures': self.max_captures}
+
+    def install_signal_handler(self, signum=getattr(signal, 'SIGUSR1', None)):
+        """
+        Toggles the profiling of all the stages on the signal, e.g. `kill -USR1 <pid>` (only possible from the main thread)
+        """
+        if signum is None or threading.current_thread() is not threading.main_thread():
+            self.logger.warning("Profiler signal handler not installed (not on the main thread or no SIGUSR1)")
+            return False
+        signal.signal(signum, lambda *_: threading.Thread(target=self.toggle, name="ProfilerToggle", daemon=True).start())
+        self.logger.info(f"Send signal {signum} to process {os.getpid()} to start or stop profiling")
+        return True
+
+    def toggle(self):
+        if not self.stop():
+            self.start()
+
+    def serve(self, port, host='127.0.0.1'):
+        """
+        Serves the admin endpoint in a background thread: GET /profiler/start?stages=retrieve,generate&captures=1, /profiler/stop
+        (returns the profile path) and /profiler/status
+        """
+        profiler = self
+
+        class ProfilerRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path == '/profiler/start':
+                    stages = query['stages'][0].split(',') if 'stages' in query else None
+                    max_captures = int(query['captures'][0]) if 'captures' in query else None
+                    result = {'started': profiler.start(stages=stages, max_captures=max_captures), **profiler.status()}
+                elif url.path == '/profiler/stop':
+                    output_path = profiler.stop()
+                    result = {'profile_path': str(output_path) if output_path else None}
+                elif url.path == '/profiler/status':
+                    result = profiler.status()
+                else:
+                    self.send_error(404)
+                    return
+                body = json.dumps(result).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), ProfilerRequestHandler)
+        threading.Thread(target=server.serve_forever, name="ProfilerServer", daemon=True).start()
+        self.logger.info(f"Profiler admin endpoint on http://{host}:{port}/profiler/(start|stop|status)")
+        return server
+
+    @staticmethod
+    def get_environment_stages():
+        return [stage for stage in os.environ.get('RAG_PROFILE_STAGES', '').split(',') if stage]
+
+    def enable(self, stages=None, port=None, output_dir_path=None):
+        """
+        Sets up profiling from the CLI arguments, or else from the RAG_PROFILE_STAGES (comma-separated stages or 'all') and
+        RAG_PROFILER_PORT environment variables: the given stages are profiled until the process exits, and the admin endpoint is served on the port
+        """
+        import atexit
+        self.configure(output_dir_path=output_dir_path)
+        stages = stages or self.get_environment_stages()
+        port = port or int(os.environ.get('RAG_PROFILER_PORT', 0))
+        if port:
+            self.serve(port)
+        if stages and self.start(stages=stages):
+            atexit.register(self.stop)
+        return self
+
+
+def create_stage_callback_handler(profiler):
+    """
+    Creates a LangChain callback handler marking the stages of a chat turn on the thread running each step: the retriever
+    runs the 'retrieve' stage, and the LLM calls the 'contextualize' (before retrieval) or 'generate' (after) stages
+    """
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class StageCallbackHandler(BaseCallbackHandler):
+        def __init__(self):
+            self.retrieved = False
+
+        def on_retriever_start(self, serialized, query, **kwargs):
+            profiler.enter_stage('retrieve')
+
+        def on_retriever_end(self, documents, **kwargs):
+            self.retrieved = True
+            profiler.exit_stage('retrieve')
+
+        def on_retriever_error(self, error, **kwargs):
+            profiler.exit_stage('retrieve')
+
+        def get_llm_stage(self):
+            return 'generate' if self.retrieved else 'contextualize'
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            profiler.enter_stage(self.get_llm_stage())
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            profiler.enter_stage(self.get_llm_stage())
+
+        def on_llm_end(self, response, **kwargs):
+            profiler.exit_stage(self.get_llm_stage())
+
+        def on_llm_error(self, error, **kwargs):
+            profiler.exit_stage(self.get_llm_stage())
+
+    return StageCallbackHandler()
+
+
+# process-wide profiler, inactive until started (marking stages only costs a dictionary update)
+profiler = SamplingProfiler()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,76 @@
+from langchain_core.callbacks import BaseCallbackHandler
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+
+class PromptCacheMonitor(BaseCallbackHandler):
+    """
+    A callback handler reading the prompt evaluation statistics returned by Ollama after each call, to measure how much of the
+    prompt was reused from the cached prefix of the previous calls and how much prompt evaluation time it saved
+    (the prompt token counts are estimated from the prompt lengths, using the characters per token of the calls evaluated in full)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prompt_chars = {}
+        self.calls = []
+        self.chars_per_token = None
+        self.seconds_per_token = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.prompt_chars[run_id] = sum(len(str(message.content)) for batch in messages for message in batch)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.prompt_chars[run_id] = sum(len(prompt) for prompt in prompts)
+
+    @staticmethod
+    def get_generation_info(response):
+        """
+        Returns the Ollama statistics of a response (generation info of the final chunk, or response metadata of the message)
+        """
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        if generation is None:
+            return {}
+        generation_info = generation.generation_info or {}
+        if 'prompt_eval_count' not in generation_info and hasattr(generation, 'message'):
+            generation_info = getattr(generation.message, 'response_metadata', None) or generation_info
+        return generation_info
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        generation_info = self.get_generation_info(response)
+        prompt_chars = self.prompt_chars.pop(run_id, 0)
+        evaluated_tokens = generation_info.get('prompt_eval_count')
+        prompt_eval_seconds = generation_info.get('prompt_eval_duration', 0) / 1e9
+        if not evaluated_tokens or not prompt_chars:
+            return
+        with self.lock:
+            # the densest call (fewest characters per evaluated token) is the closest to a full evaluation of its prompt
+            self.chars_per_token = min(self.chars_per_token or float('inf'), prompt_chars / evaluated_tokens)
+            total_evaluated = sum(call['evaluated_tokens'] for call in self.calls) + evaluated_tokens
+            total_seconds = sum(call['prompt_eval_seconds'] for call in self.calls) + prompt_eval_seconds
+            self.seconds_per_token = total_seconds / total_evaluated
+            prompt_tokens = max(evaluated_tokens, round(prompt_chars / self.chars_per_token))
+            reused_tokens = prompt_tokens - evaluated_tokens
+            call = {'prompt_tokens': prompt_tokens, 'evaluated_tokens': evaluated_tokens, 'reused_tokens': reused_tokens,
+                    'prompt_eval_seconds': prompt_eval_seconds, 'saved_seconds': reused_tokens * self.seconds_per_token}
+            self.calls.append(call)
+        self.logger.info(f"Prompt of ~{prompt_tokens} tokens: {evaluated_tokens} evaluated in {prompt_eval_seconds:.2f}s, "
+                         f"~{reused_tokens} reused from the cached prefix (~{call['saved_seconds']:.2f}s saved)")
+
+    def report(self):
+        """
+        Returns the totals over all the calls
+        """
+        with self.lock:
+            prompt_tokens = sum(call['prompt_tokens'] for call in self.calls)
+            reused_tokens = sum(call['reused_tokens'] for call in self.calls)
+            return {'n_calls': len(self.calls), 'prompt_tokens': prompt_tokens, 'reused_tokens': reused_tokens,
+                    'reused_ratio': reused_tokens / prompt_tokens if prompt_tokens else 0.0,
+                    'prompt_eval_seconds': sum(call['prompt_eval_seconds'] for call in self.calls),
+                    'saved_seconds': sum(call['saved_seconds'] for call in self.calls)}
+
+
+if __name__ == "__main__":
+    pass
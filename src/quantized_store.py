@@ -0,0 +1,219 @@
+from pathlib import Path
+import argparse
+import json
+import logging
+from src.utils import DataUtils
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+
+class VectorQuantizer:
+    """
+    A class to compress float32 vectors to float16 or to int8 codes with per-dimension scales and offsets
+    """
+    MODES = ('float16', 'int8')
+
+    def __init__(self, mode, scale=None, offset=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown quantization mode '{mode}', expected one of {self.MODES}")
+        self.mode = mode
+        self.scale = scale
+        self.offset = offset
+
+    def fit(self, vectors):
+        """
+        Computes the per-dimension scale and offset mapping [min, max] of each dimension onto the 256 int8 levels
+        """
+        import numpy as np
+        if self.mode == 'int8':
+            minimum, maximum = vectors.min(axis=0), vectors.max(axis=0)
+            self.scale = np.maximum(maximum - minimum, 1e-12).astype(np.float32) / 255.0
+            self.offset = (minimum + 128.0 * self.scale).astype(np.float32)
+        return self
+
+    def encode(self, vectors):
+        import numpy as np
+        if self.mode == 'float16':
+            return vectors.astype(np.float16)
+        return np.clip(np.rint((vectors - self.offset) / self.scale), -128, 127).astype(np.int8)
+
+    def score(self, codes, query, batch_size=65536):
+        """
+        Approximate inner products between the query and the compressed vectors, decoded batch by batch
+        (for int8, q.x ~ (q * scale).codes + q.offset)
+        """
+        import numpy as np
+        if self.mode == 'float16':
+            weights, bias = query.astype(np.float32), 0.0
+        else:
+            weights, bias = (query * self.scale).astype(np.float32), float(query @ self.offset)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), batch_size):
+            scores[start:start + batch_size] = codes[start:start + batch_size].astype(np.float32) @ weights + bias
+        return scores
+
+
+class QuantizedVectorStore(VectorStore):
+    """
+    A read-only vector store keeping float16 or int8 codes in memory: candidates are scored on the compressed vectors
+    and a small shortlist is rescored exactly on the float32 vectors, which stay on disk (memory-mapped, only the
+    shortlisted rows are read). Once exported, the store is used without the Chroma vector store
+
+    When it is opened from a packed snapshot of its folder (`snapshot_path`), the codes and rescoring vectors are
+    memory-mapped straight from the pack, so that every process serving the same snapshot shares their pages
+    """
+    def __init__(self, store_dir_path, embedding_function, rescore_factor=4, snapshot_path=None):
+        import io
+        import numpy as np
+        self.store_dir_path = Path(store_dir_path)
+        self.snapshot_path = snapshot_path
+        self.embedding_function = embedding_function
+        self.rescore_factor = rescore_factor
+        if snapshot_path is not None:
+            from src.snapshot import VectorStoreSnapshot
+            read_bytes = lambda name: bytes(VectorStoreSnapshot.open_segment(snapshot_path, name))
+            load_array = lambda name, mmap_mode=None: VectorStoreSnapshot.open_array(snapshot_path, name)
+        else:
+            read_bytes = lambda name: (self.store_dir_path / name).read_bytes()
+            load_array = lambda name, mmap_mode=None: np.load(self.store_dir_path / name, mmap_mode=mmap_mode)
+        with np.load(io.BytesIO(read_bytes('quantization.npz'))) as quantization:
+            mode = str(quantization['mode'])
+            self.quantizer = VectorQuantizer(mode, scale=quantization.get('scale'), offset=quantization.get('offset'))
+        self.codes = load_array('codes.npy')
+        self.rescoring_vectors = load_array('rescoring_vectors.npy', mmap_mode='r')
+        self.documents = [json.loads(line) for line in read_bytes('documents.jsonl').decode('utf-8').splitlines()]
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"QuantizedVectorStore loaded from {snapshot_path or self.store_dir_path} ({len(self.documents)} vectors, mode: {mode})")
+
+    @staticmethod
+    def read_snapshot_fingerprint(snapshot_path):
+        """
+        Reads the fingerprint of the collection the store packed in a snapshot was exported from (None if it has none)
+        """
+        from src.snapshot import VectorStoreSnapshot
+        try:
+            return bytes(VectorStoreSnapshot.open_segment(snapshot_path, 'source_fingerprint')).decode('utf-8').strip()
+        except KeyError:
+            return None
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @classmethod
+    def build(cls, vectors, documents, store_dir_path, mode):
+        """
+        Quantizes the vectors and writes the codes, the quantization parameters, the float32 rescoring vectors and the documents
+        """
+        import numpy as np
+        store_dir_path = Path(store_dir_path)
+        store_dir_path.mkdir(parents=True, exist_ok=True)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        quantizer = VectorQuantizer(mode).fit(vectors)
+        np.save(store_dir_path / 'codes.npy', quantizer.encode(vectors))
+        np.save(store_dir_path / 'rescoring_vectors.npy', vectors)
+        parameters = {'mode': np.array(mode)}
+        if mode == 'int8':
+            parameters.update({'scale': quantizer.scale, 'offset': quantizer.offset})
+        np.savez(store_dir_path / 'quantization.npz', **parameters)
+        with open(store_dir_path / 'documents.jsonl', 'w') as file:
+            for document in documents:
+                file.write(json.dumps({'page_content': document['page_content'], 'metadata': document['metadata']}) + '\n')
+        logging.getLogger(cls.__name__).info(f"QuantizedVectorStore ({mode}) of {len(vectors)} vectors built in {store_dir_path}")
+
+    @classmethod
+    def build_from_chroma(cls, chroma_vector_store, store_dir_path, mode, batch_size=5000, fingerprint=None):
+        """
+        Exports the embeddings and documents of a Chroma vector store into a quantized store, recording the fingerprint of
+        the collection last (so that an interrupted export is out of date)
+        """
+        import numpy as np
+        collection = chroma_vector_store._collection
+        fingerprint = fingerprint or DataUtils.get_collection_fingerprint(collection)
+        DataUtils.clear_fingerprint(store_dir_path)
+        vectors, documents = [], []
+        for start in range(0, collection.count(), batch_size):
+            batch = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=batch_size, offset=start)
+            vectors.append(np.asarray(batch['embeddings'], dtype=np.float32))
+            documents.extend({'page_content': text, 'metadata': metadata or {}} for text, metadata in zip(batch['documents'], batch['metadatas']))
+        cls.build(np.concatenate(vectors), documents, store_dir_path, mode)
+        DataUtils.write_fingerprint(store_dir_path, fingerprint)
+
+    def memory_report(self):
+        """
+        Returns the resident size of the compressed codes against the size of the float32 vectors (kept on disk for the
+        exact rescoring of the shortlist), and the size of both on disk
+        """
+        codes_bytes = self.codes.nbytes + sum(getattr(p, 'nbytes', 0) for p in (self.quantizer.scale, self.quantizer.offset))
+        float32_bytes = self.rescoring_vectors.nbytes
+        return {'n_vectors': len(self.codes), 'mode': self.quantizer.mode, 'codes_bytes': codes_bytes, 'disk_bytes': codes_bytes + float32_bytes,
+                'float32_bytes': float32_bytes, 'compression_ratio': float32_bytes / codes_bytes if codes_bytes else None}
+
+    def get_vectors(self, doc_ids):
+        import numpy as np
+        return np.asarray(self.rescoring_vectors[doc_ids], dtype=np.float32)
+
+    def get_shortlist(self, query_vector, n_candidates):
+        """
+        Returns the ids of the best candidates on the compressed vectors, reranked with their exact scores on the float32 vectors
+        """
+        import numpy as np
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        approximate_scores = self.quantizer.score(self.codes, query_vector)
+        n_candidates = min(n_candidates, len(approximate_scores))
+        candidate_ids = np.argpartition(-approximate_scores, n_candidates - 1)[:n_candidates]
+        candidate_ids.sort()
+        exact_scores = self.get_vectors(candidate_ids) @ query_vector
+        order = np.argsort(-exact_scores, kind='stable')
+        return candidate_ids[order], exact_scores[order]
+
+    def to_document(self, doc_id):
+        return Document(page_content=self.documents[doc_id]['page_content'], metadata=self.documents[doc_id]['metadata'])
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4):
+        candidate_ids, exact_scores = self.get_shortlist(embedding, k * self.rescore_factor)
+        return [(self.to_document(doc_id), float(score)) for doc_id, score in zip(candidate_ids[:k], exact_scores[:k])]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k=k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        """
+        MMR over the fetch_k best candidates, using their float32 vectors
+        """
+        import numpy as np
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+        candidate_ids, _ = self.get_shortlist(embedding, max(fetch_k, k) * self.rescore_factor)
+        candidate_ids = candidate_ids[:fetch_k]
+        selected = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32), self.get_vectors(candidate_ids),
+                                              k=k, lambda_mult=lambda_mult)
+        return [self.to_document(candidate_ids[i]) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(self.embedding_function.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult)
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("QuantizedVectorStore is read-only, rebuild it from the Chroma vector store")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("QuantizedVectorStore is built with QuantizedVectorStore.build or build_from_chroma")
+
+
+if __name__ == "__main__":
+    from src.utils import Settings
+    from src.vector_store import DocumentRetriever
+
+    parser = argparse.ArgumentParser(description="Builds a quantized copy of the Chroma vector store")
+    parser.add_argument('--mode', type=str, default='int8', choices=list(VectorQuantizer.MODES))
+    args = parser.parse_args()
+
+    settings = Settings()
+    chroma_vector_store = DocumentRetriever.load_vector_store(embedding_function=None, vector_store_dir_path=str(settings.VECTOR_STORE_DIR_PATH))
+    QuantizedVectorStore.build_from_chroma(chroma_vector_store, settings.QUANTIZED_STORE_DIR_PATH / args.mode, args.mode,
+                                           fingerprint=DataUtils.read_fingerprint(settings.VECTOR_STORE_DIR_PATH))
@@ -0,0 +1,209 @@
+from collections import OrderedDict
+from datetime import date
+from pathlib import Path
+import re
+import sqlite3
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+
+def normalize_query(query):
+    """
+    Normalizes a query so that the same question asked with another case, spacing or final punctuation has the same key
+    """
+    return ' '.join(query.lower().split()).rstrip('?!. ')
+
+
+class QueryLog:
+    """
+    A class to persist how often each question is asked, anonymized: personal data (emails, URLs, phone and id numbers) is masked, queries
+    are normalized and only counted, with no session, user or time of day recorded
+    """
+    PATTERNS = ((re.compile(r'\S+@\S+\.\w+'), '<email>'), (re.compile(r'https?://\S+|www\.\S+'), '<url>'), (re.compile(r'\+?\d[\d\s().-]{4,}\d'), '<number>'))
+
+    def __init__(self, log_path, max_query_chars=300):
+        self.log_path = Path(log_path)
+        self.log_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_query_chars = max_query_chars
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.log_path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS queries (query TEXT PRIMARY KEY, count INTEGER, first_seen TEXT, last_seen TEXT)")
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def anonymize(self, query):
+        """
+        Masks the personal data of a query and normalizes it (None for queries too long to be recurring questions)
+        """
+        if len(query) > self.max_query_chars:
+            return None
+        for pattern, placeholder in self.PATTERNS:
+            query = pattern.sub(placeholder, query)
+        return normalize_query(query) or None
+
+    def record(self, query):
+        """
+        Counts one more occurrence of the (anonymized) query
+        """
+        query = self.anonymize(query)
+        if query is None:
+            return
+        today = date.today().isoformat()
+        with self.lock, self.connection:
+            self.connection.execute("INSERT INTO queries VALUES (?, 1, ?, ?) ON CONFLICT(query) DO UPDATE SET count = count + 1, last_seen = excluded.last_seen",
+                                    (query, today, today))
+
+    def get_top_queries(self, n, min_count=2):
+        """
+        Returns the `n` most frequent queries asked at least `min_count` times (those with masked personal data excluded)
+        """
+        with self.lock:
+            rows = self.connection.execute("SELECT query, count FROM queries WHERE count >= ? AND query NOT LIKE '%<%>%' ORDER BY count DESC, last_seen DESC LIMIT ?",
+                                           (min_count, n)).fetchall()
+        return rows
+
+    def close(self):
+        self.connection.close()
+
+
+class QueryCache:
+    """
+    A class to keep the query embeddings, the retrieval results and the standalone answers (asked without chat history)
+    of the recent questions, in one LRU cache per kind
+    """
+    KINDS = ('embeddings', 'retrievals', 'answers')
+
+    def __init__(self, max_entries=None):
+        self.max_entries = {'embeddings': 4096, 'retrievals': 1024, 'answers': 256, **(max_entries or {})}
+        self.entries = {kind: OrderedDict() for kind in self.KINDS}
+        self.stats = {kind: {'hits': 0, 'misses': 0} for kind in self.KINDS}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def get_key(kind, query):
+        # the embeddings depend on the exact text, the retrievals and answers only on the question
+        return query if kind == 'embeddings' else normalize_query(query)
+
+    def get(self, kind, query):
+        key = self.get_key(kind, query)
+        with self.lock:
+            value = self.entries[kind].get(key)
+            if value is None:
+                self.stats[kind]['misses'] += 1
+                return None
+            self.entries[kind].move_to_end(key)
+            self.stats[kind]['hits'] += 1
+            return value
+
+    def put(self, kind, query, value):
+        with self.lock:
+            entries = self.entries[kind]
+            entries[self.get_key(kind, query)] = value
+            entries.move_to_end(self.get_key(kind, query))
+            while len(entries) > self.max_entries[kind]:
+                entries.popitem(last=False)
+
+    def clear(self, *kinds):
+        """
+        Empties the given kinds of entries (all by default), e.g. the retrievals and answers once the vector store is refreshed
+        """
+        with self.lock:
+            for kind in kinds or self.KINDS:
+                self.entries[kind].clear()
+
+    def report(self):
+        """
+        Logs and returns the number of entries, hits and misses per kind
+        """
+        with self.lock:
+            report = {kind: {'entries': len(self.entries[kind]), **self.stats[kind]} for kind in self.KINDS}
+        self.logger.info("Query cache: " + ", ".join(f"{kind} {stats['entries']} entries ({stats['hits']} hits / {stats['misses']} misses)"
+                                                      for kind, stats in report.items()))
+        return report
+
+
+class CachedEmbeddings:
+    """
+    An embedding function caching the embeddings of the queries (the documents are embedded as usual)
+    """
+    def __init__(self, embedding_function, query_cache):
+        self.embedding_function = embedding_function
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts):
+        return self.embedding_function.embed_documents(texts)
+
+    def embed_query(self, text):
+        embedding = self.query_cache.get('embeddings', text)
+        if embedding is None:
+            embedding = self.embedding_function.embed_query(text)
+            self.query_cache.put('embeddings', text, embedding)
+        return embedding
+
+
+def cache_retriever(retriever, query_cache):
+    """
+    Wraps a retriever into a runnable caching the documents retrieved for each question
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    def retrieve(query, config):
+        documents = query_cache.get('retrievals', query)
+        if documents is None:
+            documents = retriever.invoke(query, config=config)
+            query_cache.put('retrievals', query, documents)
+        return list(documents)
+    return RunnableLambda(retrieve, name="CachedRetriever")
+
+
+class CachePrewarmer:
+    """
+    A class to answer the most frequent questions of the query log (completed with seed questions) in a background thread,
+    which fills the query cache with their embeddings, retrieval results and standalone answers
+    """
+    def __init__(self, conversation_rag_chain, query_cache, query_log=None, top_n=10, seed_queries=()):
+        self.conversation_rag_chain = conversation_rag_chain
+        self.query_cache = query_cache
+        self.query_log = query_log
+        self.top_n = top_n
+        self.seed_queries = seed_queries
+        self.thread = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def get_queries(self):
+        """
+        Returns the top-N queries of the log, completed with the seed questions not already among them
+        """
+        queries = [query for query, _ in self.query_log.get_top_queries(self.top_n)] if self.query_log is not None else []
+        keys = {normalize_query(query) for query in queries}
+        for query in self.seed_queries:
+            if len(queries) >= self.top_n:
+                break
+            if normalize_query(query) not in keys:
+                queries.append(query)
+                keys.add(normalize_query(query))
+        return queries
+
+    def run(self):
+        queries = self.get_queries()
+        self.logger.info(f"Prewarming the query cache with {len(queries)} questions")
+        for query in queries:
+            try:
+                # answering the question without chat history goes through the cached retriever and embeddings and caches the answer
+                for _ in self.conversation_rag_chain.get_response(chat_history="", user_query=query):
+                    pass
+            except Exception as e:
+                self.logger.warning(f"Prewarming failed for '{query}': {e}")
+        self.query_cache.report()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="CachePrewarmer", daemon=True)
+        self.thread.start()
+        return self
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,45 @@
+import sys
+
+
+class ArticleRecord:
+    """
+    A compact record of a processed article (summary, year, title and source) passed from the data handlers to the vector
+    store writer: slotted (no per-instance dict) and with interned sources, since all the records of a source share it.
+    It exposes `page_content` and `metadata` like a LangChain Document, which is only created at the LangChain boundary
+    """
+    __slots__ = ('summary', 'year', 'title', 'source')
+
+    def __init__(self, summary, year, title, source):
+        self.summary = summary
+        self.year = year
+        self.title = title
+        self.source = sys.intern(source) if isinstance(source, str) else source
+
+    @classmethod
+    def from_dict(cls, item):
+        return cls(summary=item['summary'], year=item['year'], title=item['title'], source=item['source'])
+
+    def to_dict(self):
+        return {'summary': self.summary, 'year': self.year, 'title': self.title, 'source': self.source}
+
+    @property
+    def page_content(self):
+        return self.summary
+
+    @property
+    def metadata(self):
+        return {'publication_year': self.year, 'article_source': self.source, 'article_title': self.title}
+
+    def to_document(self):
+        """
+        Creates the LangChain Document of the record, with 'summary' as page content and 'article_title', 'publication_year', 'article_source' as metadata
+        """
+        from langchain.docstore.document import Document
+        return Document(page_content=self.summary, metadata=self.metadata)
+
+    def __repr__(self):
+        return f"ArticleRecord(title={self.title!r}, year={self.year!r}, source={self.source!r})"
+
+
+if __name__ == "__main__":
+    pass
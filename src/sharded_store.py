@@ -0,0 +1,207 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import argparse
+import hashlib
+import heapq
+import json
+import logging
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from src.vector_store import import_chroma
+from src.utils import DataUtils
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+# Chroma collection of the shard opened by a worker process
+shard_collection = None
+
+
+def open_shard_worker(shard_dir_path):
+    """
+    Opens the Chroma collection of a shard once per worker process (the query embeddings are computed by the parent)
+    """
+    global shard_collection
+    Chroma = import_chroma()
+    shard_collection = Chroma(persist_directory=shard_dir_path)._collection
+
+
+def count_shard_worker():
+    return shard_collection.count()
+
+
+def query_shard_worker(query_vector, n_results, include_embeddings=False):
+    """
+    Returns the (page content, metadata, distance, embedding) of the nearest documents of the shard
+    """
+    import numpy as np
+    n_results = min(n_results, shard_collection.count())
+    if n_results == 0:
+        return []
+    include = ['documents', 'metadatas', 'distances'] + (['embeddings'] if include_embeddings else [])
+    result = shard_collection.query(query_embeddings=[query_vector], n_results=n_results, include=include)
+    embeddings = result['embeddings'][0] if include_embeddings else [None] * len(result['ids'][0])
+    return [(text, metadata or {}, float(distance), np.asarray(embedding, dtype=np.float32) if embedding is not None else None)
+            for text, metadata, distance, embedding in zip(result['documents'][0], result['metadatas'][0], result['distances'][0], embeddings)]
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    A read-only vector store partitioned into Chroma shards, each searched by its own worker process: the query is embedded
+    once, sent to all the shards in parallel and the per-shard results are merged into the global top-k (or MMR candidates)
+    """
+    SHARD_BY = ('hash', 'source')
+
+    def __init__(self, store_dir_path, embedding_function, n_shards=None, shard_by=None):
+        self.store_dir_path = Path(store_dir_path)
+        self.embedding_function = embedding_function
+        self.manifest = self.check_manifest(self.store_dir_path, n_shards, shard_by)
+        if self.manifest is None:
+            raise FileNotFoundError(f"No sharded store in {self.store_dir_path} (no shard manifest)")
+        # one single-process pool per shard, so that each worker keeps its shard open
+        context = multiprocessing.get_context('spawn')
+        self.executors = [ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=open_shard_worker,
+                                              initargs=(str(self.get_shard_dir_path(self.store_dir_path, shard_index)),))
+                          for shard_index in range(self.manifest['n_shards'])]
+        counts = [future.result() for future in [executor.submit(count_shard_worker) for executor in self.executors]]
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.logger.info(f"ShardedVectorStore loaded from {self.store_dir_path} ({sum(counts)} documents in {len(counts)} shards "
+                         f"partitioned by {self.manifest['shard_by']}: {counts})")
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @staticmethod
+    def get_shard_dir_path(store_dir_path, shard_index):
+        return Path(store_dir_path) / f'shard_{shard_index:03d}'
+
+    @staticmethod
+    def get_shard_index(document, doc_id, n_shards, shard_by='hash'):
+        """
+        Assigns a document to a shard by the hash of its id, or by the hash of its source (all the documents of a source together)
+        """
+        if shard_by not in ShardedVectorStore.SHARD_BY:
+            raise ValueError(f"Unknown sharding key '{shard_by}', expected one of {ShardedVectorStore.SHARD_BY}")
+        key = doc_id if shard_by == 'hash' else str(document.metadata.get('article_source', ''))
+        return int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % n_shards
+
+    @staticmethod
+    def write_manifest(store_dir_path, n_shards, shard_by):
+        store_dir_path = Path(store_dir_path)
+        store_dir_path.mkdir(parents=True, exist_ok=True)
+        with open(store_dir_path / 'shards.json', 'w') as file:
+            json.dump({'n_shards': n_shards, 'shard_by': shard_by}, file)
+
+    @staticmethod
+    def read_manifest(store_dir_path):
+        """
+        Returns the number of shards and the sharding key of a sharded store (None if there is no store)
+        """
+        manifest_path = Path(store_dir_path) / 'shards.json'
+        if not manifest_path.is_file():
+            return None
+        with open(manifest_path) as file:
+            return json.load(file)
+
+    @classmethod
+    def check_manifest(cls, store_dir_path, n_shards=None, shard_by=None):
+        """
+        Returns the manifest of a sharded store (None if there is no store), raising a ValueError if it was partitioned
+        with another number of shards or sharding key than the expected ones
+        """
+        manifest = cls.read_manifest(store_dir_path)
+        if manifest is not None and (n_shards is not None and manifest['n_shards'] != n_shards or shard_by is not None and manifest['shard_by'] != shard_by):
+            raise ValueError(f"The sharded store in {store_dir_path} has {manifest['n_shards']} shards partitioned by {manifest['shard_by']}, "
+                             f"not {n_shards} shards partitioned by {shard_by}: delete it to partition it again")
+        return manifest
+
+    @classmethod
+    def build_from_chroma(cls, chroma_vector_store, store_dir_path, n_shards, shard_by='hash', batch_size=1000):
+        """
+        Partitions the documents and embeddings of a Chroma vector store into shards (without embedding them again), writing
+        the shard manifest once all the shards are written
+        """
+        cls.check_manifest(store_dir_path, n_shards, shard_by)
+        Chroma = import_chroma()
+        shard_collections = [Chroma(persist_directory=str(cls.get_shard_dir_path(store_dir_path, shard_index)))._collection
+                             for shard_index in range(n_shards)]
+        collection = chroma_vector_store._collection
+        for start in range(0, collection.count(), batch_size):
+            batch = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=batch_size, offset=start)
+            shards = {}
+            for doc_id, embedding, text, metadata in zip(batch['ids'], batch['embeddings'], batch['documents'], batch['metadatas']):
+                document = Document(page_content=text, metadata=metadata or {})
+                document_id = DataUtils.get_document_id(document)
+                shard = shards.setdefault(cls.get_shard_index(document, document_id, n_shards, shard_by), {'ids': [], 'embeddings': [], 'documents': [], 'metadatas': []})
+                shard['ids'].append(doc_id)
+                shard['embeddings'].append(list(map(float, embedding)))
+                shard['documents'].append(text)
+                shard['metadatas'].append(metadata)
+            for shard_index, shard in shards.items():
+                shard_collections[shard_index].upsert(**shard)
+        cls.write_manifest(store_dir_path, n_shards, shard_by)
+        logging.getLogger(cls.__name__).info(f"ShardedVectorStore of {collection.count()} documents built in {store_dir_path} "
+                                             f"({[c.count() for c in shard_collections]} documents per shard)")
+
+    def scatter_gather(self, query_vector, n_results, include_embeddings=False):
+        """
+        Queries all the shards in parallel and merges their results into the global n_results nearest documents
+        """
+        query_vector = [float(x) for x in query_vector]
+        futures = [executor.submit(query_shard_worker, query_vector, n_results, include_embeddings) for executor in self.executors]
+        results = [result for future in futures for result in future.result()]
+        return heapq.nsmallest(n_results, results, key=lambda result: result[2])
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4):
+        return [(Document(page_content=text, metadata=metadata), distance) for text, metadata, distance, _ in self.scatter_gather(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k=k)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k=k)
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        """
+        MMR over the global fetch_k nearest documents, gathered with their embeddings from all the shards
+        """
+        import numpy as np
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+        candidates = self.scatter_gather(embedding, fetch_k, include_embeddings=True)
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32), np.stack([candidate[3] for candidate in candidates]),
+                                              k=k, lambda_mult=lambda_mult)
+        return [Document(page_content=candidates[i][0], metadata=candidates[i][1]) for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(self.embedding_function.embed_query(query), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult)
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("ShardedVectorStore is read-only, build it with VectorStoreBuilder (n_shards) or from the Chroma vector store")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("ShardedVectorStore is built with VectorStoreBuilder (n_shards) or ShardedVectorStore.build_from_chroma")
+
+
+if __name__ == "__main__":
+    from src.utils import Settings
+    from src.vector_store import DocumentRetriever
+
+    parser = argparse.ArgumentParser(description="Partitions the Chroma vector store into shards searched in parallel")
+    parser.add_argument('--n_shards', type=int, default=4)
+    parser.add_argument('--shard_by', type=str, default='hash', choices=list(ShardedVectorStore.SHARD_BY))
+    args = parser.parse_args()
+
+    settings = Settings()
+    chroma_vector_store = DocumentRetriever.load_vector_store(embedding_function=None, vector_store_dir_path=str(settings.VECTOR_STORE_DIR_PATH))
+    ShardedVectorStore.build_from_chroma(chroma_vector_store, settings.SHARDED_STORE_DIR_PATH, args.n_shards, args.shard_by)
@@ -0,0 +1,288 @@
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+SNAPSHOT_MAGIC = b"RAGSNAP1"
+SNAPSHOT_TRAILER = struct.Struct("<8sQQ")  # magic, manifest offset, manifest size
+SEGMENT_ALIGNMENT = 65536  # multiple of mmap.ALLOCATIONGRANULARITY on every platform
+CHUNK_SIZE = 4 * 1024 * 1024
+STATE_FILE_NAME = ".snapshot_state.json"
+
+
+class SnapshotSource:
+    """
+    A class to read byte ranges of a packed snapshot from a local file/directory or from an HTTP mirror
+    """
+    def __init__(self, source, pack_name="chroma.snapshot"):
+        self.source = str(source)
+        self.is_http = self.source.startswith(("http://", "https://"))
+        if self.is_http:
+            self.location = self.source if self.source.endswith(pack_name) else self.source.rstrip('/') + '/' + pack_name
+        else:
+            path = Path(self.source)
+            self.location = path / pack_name if path.is_dir() else path
+        self.session = None
+        self.full_content = None
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def read_range(self, offset, size):
+        """
+        Reads `size` bytes starting at `offset` (negative offset reads from the end)
+        """
+        if self.full_content is not None:
+            start = len(self.full_content) + offset if offset < 0 else offset
+            return self.full_content[start:start + size]
+        if self.is_http:
+            import requests
+            if self.session is None:
+                self.session = requests.Session()
+            byte_range = f"bytes={offset}" if offset < 0 else f"bytes={offset}-{offset + size - 1}"
+            response = self.session.get(self.location, headers={'Range': byte_range})
+            response.raise_for_status()
+            if response.status_code != 206:
+                self.logger.warning(f"The mirror {self.location} does not support range requests, the whole snapshot is kept in memory")
+                self.full_content = response.content
+                return self.read_range(offset, size)
+            return response.content
+        with open(self.location, 'rb') as file:
+            file.seek(offset, os.SEEK_END if offset < 0 else os.SEEK_SET)
+            return file.read(size)
+
+    def copy_range(self, offset, size, destination_file, destination_offset):
+        """
+        Copies a byte range into an open destination file, in kernel space when both ends are local files
+        """
+        if not self.is_http and hasattr(os, 'copy_file_range'):
+            with open(self.location, 'rb') as file:
+                copied = 0
+                while copied < size:
+                    n = os.copy_file_range(file.fileno(), destination_file.fileno(), size - copied,
+                                           offset + copied, destination_offset + copied)
+                    if n == 0:
+                        raise IOError(f"Unexpected end of snapshot {self.location}")
+                    copied += n
+            return
+        destination_file.seek(destination_offset)
+        destination_file.write(self.read_range(offset, size))
+
+
+class VectorStoreSnapshot:
+    """
+    A class to export a vector store folder into a single packed snapshot and to verify/import it incrementally
+
+    Layout of the snapshot: a header, every file of the vector store at a 64 KiB aligned offset (so that each segment
+    can be memory-mapped straight from the pack) and a JSON manifest with the size, offset and chunk hashes of every file,
+    followed by a fixed size trailer pointing to the manifest. Chroma copies and loads its own files, so a Chroma snapshot
+    is imported; a quantized store is read in place from its snapshot (see QuantizedVectorStore)
+    """
+    def __init__(self, vector_store_dir_path):
+        self.vector_store_dir_path = Path(vector_store_dir_path)
+        self.state_path = self.vector_store_dir_path / STATE_FILE_NAME
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @staticmethod
+    def hash_chunks(file, size, chunk_size=CHUNK_SIZE):
+        """
+        Hashes an open file chunk by chunk and returns the list of chunk digests
+        """
+        digests = []
+        remaining = size
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            digests.append(hashlib.sha256(chunk).hexdigest())
+            remaining -= len(chunk)
+        return digests
+
+    @staticmethod
+    def align(offset):
+        return (offset + SEGMENT_ALIGNMENT - 1) // SEGMENT_ALIGNMENT * SEGMENT_ALIGNMENT
+
+    def export_snapshot(self, snapshot_path):
+        """
+        Packs every file of the vector store folder into a single snapshot file with its manifest
+        """
+        snapshot_path = Path(snapshot_path)
+        files = sorted(p for p in self.vector_store_dir_path.rglob('*') if p.is_file() and p.name != STATE_FILE_NAME)
+        manifest = {'format': SNAPSHOT_MAGIC.decode(), 'created': int(time.time()), 'chunk_size': CHUNK_SIZE,
+                    'alignment': SEGMENT_ALIGNMENT, 'files': []}
+
+        tmp_path = snapshot_path.with_suffix(snapshot_path.suffix + '.tmp')
+        with open(tmp_path, 'wb') as pack:
+            pack.write(SNAPSHOT_MAGIC)
+            for path in files:
+                offset = self.align(pack.tell())
+                pack.seek(offset)
+                size = path.stat().st_size
+                with open(path, 'rb') as file:
+                    chunks = self.hash_chunks(file, size)
+                    file.seek(0)
+                    while True:
+                        block = file.read(CHUNK_SIZE)
+                        if not block:
+                            break
+                        pack.write(block)
+                manifest['files'].append({'path': path.relative_to(self.vector_store_dir_path).as_posix(),
+                                          'offset': offset, 'size': size, 'chunks': chunks})
+            manifest_bytes = json.dumps(manifest, sort_keys=True).encode()
+            manifest_offset = pack.tell()
+            pack.write(manifest_bytes)
+            pack.write(SNAPSHOT_TRAILER.pack(SNAPSHOT_MAGIC, manifest_offset, len(manifest_bytes)))
+        os.replace(tmp_path, snapshot_path)
+        self.logger.info(f"Snapshot of {len(files)} files exported to {snapshot_path} ({snapshot_path.stat().st_size} bytes)")
+        return manifest
+
+    @staticmethod
+    def read_manifest(snapshot_source):
+        """
+        Reads the manifest of a snapshot through its trailer
+        """
+        trailer = snapshot_source.read_range(-SNAPSHOT_TRAILER.size, SNAPSHOT_TRAILER.size)
+        magic, manifest_offset, manifest_size = SNAPSHOT_TRAILER.unpack(trailer)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{snapshot_source.location} is not a vector store snapshot")
+        return json.loads(snapshot_source.read_range(manifest_offset, manifest_size))
+
+    def load_state(self):
+        """
+        Loads the state recorded after the last import (size and mtime of every verified file)
+        """
+        if not self.state_path.is_file():
+            return {}
+        with open(self.state_path) as file:
+            return json.load(file)
+
+    def save_state(self, manifest):
+        """
+        Records the size and mtime of every verified file, so that the next check does not rehash them
+        """
+        files = {}
+        for entry in manifest['files']:
+            stat = (self.vector_store_dir_path / entry['path']).stat()
+            files[entry['path']] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'chunks': entry['chunks']}
+        with open(self.state_path, 'w') as file:
+            json.dump({'files': files}, file)
+
+    def find_stale_chunks(self, manifest, full_check=False):
+        """
+        Compares the local vector store folder to the manifest and returns the stale chunks of each file as {path: [chunk indices]}
+
+        Files whose size and mtime match the recorded state are trusted without being rehashed, unless `full_check` is set
+        """
+        state = self.load_state().get('files', {})
+        chunk_size = manifest['chunk_size']
+        stale = {}
+        for entry in manifest['files']:
+            path = self.vector_store_dir_path / entry['path']
+            n_chunks = len(entry['chunks'])
+            if not path.is_file():
+                stale[entry['path']] = list(range(n_chunks))
+                continue
+            stat = path.stat()
+            recorded = state.get(entry['path'])
+            if (not full_check and recorded and recorded['chunks'] == entry['chunks']
+                    and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns):
+                continue
+            with open(path, 'rb') as file:
+                local_chunks = self.hash_chunks(file, min(stat.st_size, entry['size']), chunk_size)
+            bad_chunks = [i for i, digest in enumerate(entry['chunks'])
+                          if i >= len(local_chunks) or local_chunks[i] != digest]
+            if bad_chunks or stat.st_size != entry['size']:
+                stale[entry['path']] = bad_chunks
+        return stale
+
+    def verify_vector_store(self, snapshot_source, full_check=False):
+        """
+        Checks the local vector store against the manifest of the snapshot
+        """
+        manifest = self.read_manifest(snapshot_source)
+        stale = self.find_stale_chunks(manifest, full_check=full_check)
+        if stale:
+            self.logger.warning(f"{len(stale)} vector store files differ from the snapshot: {', '.join(stale)}")
+            return False
+        self.logger.info("The vector store matches the snapshot manifest")
+        return True
+
+    def import_snapshot(self, snapshot_source, full_check=False):
+        """
+        Brings the local vector store in line with the snapshot, fetching only the stale chunks of each file
+        """
+        manifest = self.read_manifest(snapshot_source)
+        stale = self.find_stale_chunks(manifest, full_check=full_check)
+        chunk_size = manifest['chunk_size']
+        fetched_bytes = 0
+
+        for entry in manifest['files']:
+            if entry['path'] not in stale:
+                continue
+            path = self.vector_store_dir_path / entry['path']
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'r+b' if path.is_file() else 'wb') as file:
+                for i in stale[entry['path']]:
+                    start = i * chunk_size
+                    size = min(chunk_size, entry['size'] - start)
+                    snapshot_source.copy_range(entry['offset'] + start, size, file, start)
+                    fetched_bytes += size
+                file.truncate(entry['size'])
+            with open(path, 'rb') as file:
+                if self.hash_chunks(file, entry['size'], chunk_size) != entry['chunks']:
+                    raise ValueError(f"Checksum mismatch for {path} after import from {snapshot_source.location}")
+
+        self.save_state(manifest)
+        self.logger.info(f"Snapshot imported from {snapshot_source.location}: {len(stale)}/{len(manifest['files'])} files updated, {fetched_bytes} bytes fetched")
+        return manifest
+
+    @staticmethod
+    def open_segment(snapshot_path, relative_path):
+        """
+        Memory-maps one file of a local snapshot read-only, straight from the pack (pages are shared between processes)
+        """
+        snapshot_source = SnapshotSource(snapshot_path)
+        manifest = VectorStoreSnapshot.read_manifest(snapshot_source)
+        entry = next((entry for entry in manifest['files'] if entry['path'] == relative_path), None)
+        if entry is None:
+            raise KeyError(f"{relative_path} is not in the snapshot {snapshot_source.location}")
+        if entry['size'] == 0:
+            return b""
+        with open(snapshot_source.location, 'rb') as file:
+            return mmap.mmap(file.fileno(), entry['size'], offset=entry['offset'], access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def open_array(snapshot_path, relative_path):
+        """
+        Opens a .npy file of a local snapshot as a read-only numpy array backed by the memory-mapped segment (no copy)
+        """
+        import io
+        import numpy as np
+        segment = VectorStoreSnapshot.open_segment(snapshot_path, relative_path)
+        header = io.BytesIO(segment[:SEGMENT_ALIGNMENT])
+        version = np.lib.format.read_magic(header)
+        read_array_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_array_header(header)
+        return np.ndarray(shape, dtype=dtype, buffer=segment, offset=header.tell(), order='F' if fortran_order else 'C')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vector store snapshot tool")
+    parser.add_argument('action', choices=['export', 'import', 'verify'])
+    parser.add_argument('snapshot', help="Snapshot file (export) or snapshot file, directory or HTTP mirror URL (import/verify)")
+    parser.add_argument('--vector_store_dir_path', type=str, default=str(Path(__file__).resolve().parent.parent / 'data' / 'chroma'))
+    parser.add_argument('--full_check', action='store_true', help="Rehash every file instead of trusting the recorded state")
+    args = parser.parse_args()
+
+    vector_store_snapshot = VectorStoreSnapshot(args.vector_store_dir_path)
+    if args.action == 'export':
+        vector_store_snapshot.export_snapshot(args.snapshot)
+    elif args.action == 'import':
+        vector_store_snapshot.import_snapshot(SnapshotSource(args.snapshot), full_check=args.full_check)
+    else:
+        vector_store_snapshot.verify_vector_store(SnapshotSource(args.snapshot), full_check=args.full_check)
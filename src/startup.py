@@ -0,0 +1,150 @@
+from concurrent.futures import Future
+from contextlib import contextmanager
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+
+class StartupTimer:
+    """
+    A class to time the startup phases of the CLI or the Streamlit app and report them
+    """
+    def __init__(self, start_time=None):
+        self.start_time = start_time if start_time is not None else time.perf_counter()
+        self.phases = []
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    @contextmanager
+    def measure(self, phase_name):
+        """
+        Measures the duration of the wrapped block and records it under the given phase name
+        """
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase_name, phase_start, time.perf_counter())
+
+    def record(self, phase_name, phase_start, phase_end):
+        """
+        Records a phase from its perf_counter start and end times
+        """
+        with self.lock:
+            self.phases.append({'phase': phase_name, 'thread': threading.current_thread().name,
+                                'start': phase_start - self.start_time, 'duration': phase_end - phase_start})
+
+    def report(self):
+        """
+        Logs the recorded phases (offset from startup, duration and thread) and the total startup time
+        """
+        total = time.perf_counter() - self.start_time
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase['start'])
+        self.logger.info("Startup report (offset / duration / thread / phase):")
+        for phase in phases:
+            self.logger.info(f"  +{phase['start']:7.2f}s  {phase['duration']:7.2f}s  {phase['thread']:<16} {phase['phase']}")
+        self.logger.info(f"Startup completed in {total:.2f}s")
+        return {'total': total, 'phases': phases}
+
+
+class ResourceWarmup:
+    """
+    A class to load and warm up the embedding model and the vector store in a background thread,
+    so that the LLM client and the UI can be set up in the meantime
+    """
+    def __init__(self, embedder, vector_store_dir_path, prepare_vector_store, startup_timer, warmup_query="warm up",
+                 vector_storage='chroma', quantized_store_dir_path=None, fast_embedder=None, cascade_store_dir_path=None, cascade_n_candidates=50,
+                 sharded_store_dir_path=None, n_shards=4, shard_by='hash', model_registry=None,
+                 query_cache=None):
+        self.embedder = embedder
+        self.fast_embedder = fast_embedder
+        self.cascade_store_dir_path = cascade_store_dir_path
+        self.cascade_n_candidates = cascade_n_candidates
+        self.sharded_store_dir_path = sharded_store_dir_path
+        self.n_shards = n_shards
+        self.shard_by = shard_by
+        self.model_registry = model_registry
+        self.query_cache = query_cache
+        self.vector_store_dir_path = vector_store_dir_path
+        self.vector_storage = vector_storage
+        self.quantized_store_dir_path = quantized_store_dir_path
+        self.prepare_vector_store = prepare_vector_store
+        self.startup_timer = startup_timer
+        self.warmup_query = warmup_query
+        self.embedding_function_future = Future()
+        self.vector_store_future = Future()
+        self.thread = threading.Thread(target=self.run, name="ResourceWarmup", daemon=True)
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def start(self):
+        """
+        Starts loading the resources in the background
+        """
+        self.logger.info("Loading embedding model and vector store in the background")
+        self.thread.start()
+        return self
+
+    def run(self):
+        """
+        Loads the embedding model, prepares the vector store (build or download) and opens it, running a dummy query on each
+        """
+        from src.model_registry import ModelRegistry
+        from src.vector_store import DocumentRetriever
+        # the models and the vector store are held by the chatbot for the lifetime of the process (never unloaded when idle)
+        model_registry = self.model_registry if self.model_registry is not None else ModelRegistry()
+        try:
+            with self.startup_timer.measure("load embedding model"):
+                embedding_function = model_registry.register('embedding_model', loader=self.embedder.set_embedding_function).acquire('embedding_model')
+            if self.query_cache is not None:
+                from src.query_cache import CachedEmbeddings
+                embedding_function = CachedEmbeddings(embedding_function, self.query_cache)
+            with self.startup_timer.measure("warm up embedding model"):
+                embedding_function.embed_query(self.warmup_query)
+            self.embedding_function_future.set_result(embedding_function)
+
+            fast_embedding_function = None
+            if self.fast_embedder is not None:
+                with self.startup_timer.measure("load fast embedding model"):
+                    fast_embedding_function = model_registry.register('fast_embedding_model', loader=self.fast_embedder.set_embedding_function).acquire('fast_embedding_model')
+                    fast_embedding_function.embed_query(self.warmup_query)
+
+            with self.startup_timer.measure("prepare vector store"):
+                self.prepare_vector_store(embedding_function, fast_embedding_function)
+            with self.startup_timer.measure("load vector store"):
+                load_vector_store = lambda: DocumentRetriever.load_vector_store(embedding_function=embedding_function,
+                                                                                vector_store_dir_path=self.vector_store_dir_path,
+                                                                                vector_storage=self.vector_storage,
+                                                                                quantized_store_dir_path=self.quantized_store_dir_path,
+                                                                                fast_embedding_function=fast_embedding_function,
+                                                                                cascade_store_dir_path=self.cascade_store_dir_path,
+                                                                                cascade_n_candidates=self.cascade_n_candidates,
+                                                                                sharded_store_dir_path=self.sharded_store_dir_path,
+                                                                                n_shards=self.n_shards, shard_by=self.shard_by)
+                close_vector_store = lambda vector_store: vector_store.close() if hasattr(vector_store, 'close') else None
+                vector_store = model_registry.register('vector_store', loader=load_vector_store, unloader=close_vector_store).acquire('vector_store')
+            with self.startup_timer.measure("warm up vector store"):
+                vector_store.similarity_search(self.warmup_query, k=1)
+            self.vector_store_future.set_result(vector_store)
+        except Exception as e:
+            self.logger.error(f"Background warm-up failed: {e}")
+            for future in (self.embedding_function_future, self.vector_store_future):
+                if not future.done():
+                    future.set_exception(e)
+
+    def get_embedding_function(self):
+        """
+        Waits for the embedding model to be loaded and returns the embedding function
+        """
+        return self.embedding_function_future.result()
+
+    def get_vector_store(self):
+        """
+        Waits for the vector store to be loaded and returns it
+        """
+        return self.vector_store_future.result()
+
+
+if __name__ == "__main__":
+    pass
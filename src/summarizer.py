@@ -1,16 +1,75 @@
-from textsum.summarize import Summarizer
+import re
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
 
 class TextSummarizer:
-    def __init__(self, force_cache, token_batch_length, hf_summarizer_model_path):
+    BACKENDS = ('fp32', 'int8', 'onnx')
+
+    def __init__(self, force_cache, hf_summarizer_model_path, token_batch_length=2048, backend='fp32', intra_op_threads=None, inter_op_threads=None):
         """
-        A class used to summarize text using a pre-trained transformer model
+        A class used to summarize text using a pre-trained transformer model, in fp32, with dynamic int8 quantization of its linear
+        layers on CPU, or exported to ONNX Runtime through optimum (decoder reusing its cached key/values)
         """
-        self.summarizer = Summarizer(model_name_or_path=hf_summarizer_model_path, token_batch_length=token_batch_length, force_cache=force_cache)
+        from textsum.summarize import Summarizer
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.info(f"TextSummarizer initialized with model_name_or_path: {hf_summarizer_model_path}, force_cache: {force_cache}, token_batch_length: {token_batch_length}")
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown summarizer backend '{backend}', expected one of {self.BACKENDS}")
+        self.backend = backend
+        if backend != 'onnx':
+            self.set_threads(intra_op_threads, inter_op_threads)
+        self.summarizer = Summarizer(model_name_or_path=hf_summarizer_model_path, token_batch_length=token_batch_length, force_cache=force_cache,
+                                     use_cuda=backend == 'fp32', optimum_onnx=backend == 'onnx')
+        if backend == 'int8':
+            self.quantize_model()
+        elif backend == 'onnx' and (intra_op_threads or inter_op_threads):
+            self.set_onnx_threads(intra_op_threads, inter_op_threads)
+        self.logger.info(f"TextSummarizer initialized with model_name_or_path: {hf_summarizer_model_path}, force_cache: {force_cache}, token_batch_length: {token_batch_length}, backend: {backend}")
+
+    def set_threads(self, intra_op_threads, inter_op_threads):
+        """
+        Sets the number of threads used inside an operator (intra-op) and between independent operators (inter-op) by torch
+        """
+        import torch
+        if intra_op_threads:
+            torch.set_num_threads(intra_op_threads)
+        if inter_op_threads:
+            try:
+                torch.set_num_interop_threads(inter_op_threads)
+            except RuntimeError:
+                # can only be set once, before any inter-op parallel work has started
+                self.logger.warning(f"Inter-op threads already fixed to {torch.get_num_interop_threads()}, {inter_op_threads} ignored")
+        self.logger.info(f"Summarizer running with {torch.get_num_threads()} intra-op threads and {torch.get_num_interop_threads()} inter-op threads")
+
+    def set_onnx_threads(self, intra_op_threads, inter_op_threads):
+        """
+        Reloads the ONNX Runtime sessions of the exported model with the given thread counts, which ONNX Runtime takes from its
+        session options only (the torch settings do not apply to it, and textsum creates the sessions with the default ones)
+        """
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        session_options = onnxruntime.SessionOptions()
+        if intra_op_threads:
+            session_options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            # the inter-op thread pool is only used by the parallel execution mode
+            session_options.inter_op_num_threads = inter_op_threads
+            session_options.execution_mode = onnxruntime.ExecutionMode.ORT_PARALLEL
+        model = self.summarizer.model
+        self.summarizer.model = ORTModelForSeq2SeqLM.from_pretrained(model.model_save_dir, provider=model.providers[0], use_cache=model.use_cache,
+                                                                     session_options=session_options)
+        del model
+        self.logger.info(f"Summarizer running in ONNX Runtime with {intra_op_threads or 'default'} intra-op threads and "
+                         f"{inter_op_threads or 'default'} inter-op threads")
+
+    def quantize_model(self):
+        """
+        Replaces the linear layers of the model by dynamically quantized int8 ones (weights stored in int8, activations quantized on the fly)
+        """
+        import torch
+        model = self.summarizer.model.to('cpu').eval()
+        self.summarizer.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.logger.info("Summarizer linear layers quantized to int8 (dynamic quantization)")
         
     def summarize_by_batch(self, input_text, batch_length=2048):
         """
@@ -19,4 +78,107 @@ class TextSummarizer:
         summaries_by_batches = self.summarizer.summarize_via_tokenbatches(input_text=input_text.replace('\n', ' '), batch_length=batch_length)
         summary = ' '.join([summary_by_batch['summary'][0].replace('\n', ' ') for summary_by_batch in summaries_by_batches])
         self.logger.info(f"Content summarized (from article of {len(input_text.split(' '))} words to summary of {len(summary.split(' '))} words)")
-        return summary
\ No newline at end of file
+        return summary
+
+    def count_tokens(self, text):
+        """
+        Counts the tokens of a text with the summarizer tokenizer
+        """
+        return len(self.summarizer.tokenizer(text, add_special_tokens=False)['input_ids'])
+
+
+class ExtractiveCondenser:
+    """
+    A class to condense a text to its most central sentences within a token budget (TextRank over TF-IDF sentence vectors),
+    used as a fast pre-stage so that only the condensed text goes through the abstractive summarizer
+    """
+    SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9(\[])')
+    WORD = re.compile(r'[a-z][a-z0-9-]+')
+    STOP_WORDS = frozenset("the of and to in a is that for are with as was were by on be this it from at or an we our these which not have has can also their than been may into between both its such using used".split())
+
+    def __init__(self, token_budget, count_tokens=None, damping=0.85, n_iterations=50, tolerance=1e-6):
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens if count_tokens is not None else (lambda text: len(text.split()))
+        self.damping = damping
+        self.n_iterations = n_iterations
+        self.tolerance = tolerance
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def split_sentences(self, text):
+        return [sentence.strip() for sentence in self.SENTENCE_SPLIT.split(' '.join(text.split())) if sentence.strip()]
+
+    def get_tfidf_matrix(self, sentences):
+        """
+        Builds the L2-normalized TF-IDF matrix (sentences x vocabulary) of the sentences
+        """
+        import numpy as np
+        vocabulary = {}
+        rows, cols = [], []
+        for i, sentence in enumerate(sentences):
+            for word in self.WORD.findall(sentence.lower()):
+                if word not in self.STOP_WORDS:
+                    rows.append(i)
+                    cols.append(vocabulary.setdefault(word, len(vocabulary)))
+        tf = np.zeros((len(sentences), max(len(vocabulary), 1)), dtype=np.float32)
+        np.add.at(tf, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), 1.0)
+        idf = np.log((1 + len(sentences)) / (1 + (tf > 0).sum(axis=0))) + 1.0
+        tfidf = np.log1p(tf) * idf
+        norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+        return tfidf / np.where(norms > 0, norms, 1.0)
+
+    def score_sentences(self, sentences):
+        """
+        Scores the sentences with TextRank (power iteration over the cosine similarity graph)
+        """
+        import numpy as np
+        tfidf = self.get_tfidf_matrix(sentences)
+        similarity = tfidf @ tfidf.T
+        np.fill_diagonal(similarity, 0.0)
+        out_weights = similarity.sum(axis=1, keepdims=True)
+        transition = np.divide(similarity, out_weights, out=np.full_like(similarity, 1.0 / len(sentences)), where=out_weights > 0)
+        scores = np.full(len(sentences), 1.0 / len(sentences), dtype=np.float32)
+        for _ in range(self.n_iterations):
+            new_scores = (1 - self.damping) / len(sentences) + self.damping * (transition.T @ scores)
+            if np.abs(new_scores - scores).sum() < self.tolerance:
+                scores = new_scores
+                break
+            scores = new_scores
+        return scores
+
+    def truncate(self, text):
+        """
+        Keeps the longest prefix of whole words of the text that fits in the token budget (binary search on the number of words)
+        """
+        words = text.split()
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(' '.join(words[:middle])) <= self.token_budget:
+                low = middle
+            else:
+                high = middle - 1
+        self.logger.info(f"No sentence fits in {self.token_budget} tokens, the top-ranked one is cut to its first {low}/{len(words)} words")
+        return ' '.join(words[:low])
+
+    def condense(self, text):
+        """
+        Keeps the highest scored sentences (in their original order) that fit in the token budget
+        """
+        import numpy as np
+        n_tokens = self.count_tokens(text)
+        if n_tokens <= self.token_budget:
+            return text
+        sentences = self.split_sentences(text)
+        scores = self.score_sentences(sentences)
+        selected, used_tokens = [], 0
+        for i in np.argsort(-scores, kind='stable'):
+            sentence_tokens = self.count_tokens(sentences[i])
+            if used_tokens + sentence_tokens <= self.token_budget:
+                selected.append(i)
+                used_tokens += sentence_tokens
+        if not selected:
+            # no sentence fits (e.g. a PDF page without any sentence boundary): the top-ranked sentence is cut to the budget
+            return self.truncate(sentences[int(np.argmax(scores))]) or text
+        condensed_text = ' '.join(sentences[i] for i in sorted(selected))
+        self.logger.info(f"Text condensed from {n_tokens} to {used_tokens} tokens ({len(selected)}/{len(sentences)} sentences kept)")
+        return condensed_text
\ No newline at end of file
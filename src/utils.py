@@ -1,10 +1,12 @@
 import os
+import sys
+import hashlib
+from itertools import chain, islice
 from pathlib import Path
 from dotenv import load_dotenv
 import argparse
 from pydantic_settings import BaseSettings
 from typing import Dict
-import streamlit as st
 
 
 class DataUtils:
@@ -18,11 +20,76 @@ class DataUtils:
             merged_data.extend(dataset)
         return merged_data
 
+    @staticmethod
+    def chain_data(*args):
+        """
+        Chains datasets (lists or generators) lazily without copying them
+        """
+        return chain.from_iterable(args)
+
+    @staticmethod
+    def batch_data(data, batch_size):
+        """
+        Yields lists of at most `batch_size` items from an iterable
+        """
+        iterator = iter(data)
+        while batch := list(islice(iterator, batch_size)):
+            yield batch
+
+    @staticmethod
+    def get_document_id(document):
+        """
+        Returns a stable id for a document (hash of its source, title and content), so that writing it twice into the vector store is idempotent
+        """
+        key = '\x00'.join([str(document.metadata.get('article_source', '')), str(document.metadata.get('article_title', '')), document.page_content])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def get_collection_fingerprint(*collections, batch_size=10000):
+        """
+        Returns a fingerprint of the content of Chroma collections (hash of their sorted document ids, which derive from the
+        documents' content), to tell whether a store exported from them is out of date
+        """
+        ids = []
+        for collection in collections:
+            for start in range(0, collection.count(), batch_size):
+                ids.extend(collection.get(include=[], limit=batch_size, offset=start)['ids'])
+        return hashlib.sha1('\n'.join(sorted(ids)).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def read_fingerprint(store_dir_path):
+        """
+        Reads the fingerprint of the collection a store was exported from (None if there is no store or its export did not complete)
+        """
+        fingerprint_path = Path(store_dir_path) / 'source_fingerprint'
+        return fingerprint_path.read_text().strip() if fingerprint_path.is_file() else None
+
+    @staticmethod
+    def write_fingerprint(store_dir_path, fingerprint):
+        (Path(store_dir_path) / 'source_fingerprint').write_text(fingerprint)
+
+    @staticmethod
+    def clear_fingerprint(store_dir_path):
+        (Path(store_dir_path) / 'source_fingerprint').unlink(missing_ok=True)
+
     @staticmethod
     def get_global_var(global_var_name):
         load_dotenv()
         return os.getenv(global_var_name)
 
+    @staticmethod
+    def get_secret(secret_name):
+        """
+        Reads a secret from the Streamlit secrets when running inside Streamlit, otherwise from the environment
+        (streamlit is never imported here so that the CLI does not pay for it)
+        """
+        if 'streamlit' in sys.modules:
+            try:
+                return sys.modules['streamlit'].secrets[secret_name]
+            except Exception:
+                pass
+        return DataUtils.get_global_var(secret_name)
+
     @staticmethod
     def read_text(file_path):
         with open(file_path, 'r') as file:
@@ -40,22 +107,33 @@ class Settings(BaseSettings):
     QUESTION_ANSWERER_PROMPT_PATH: Path = PROMPTS_DIR_PATH / "question_answerer.txt"
     QUESTION_CONTEXTUALIZER_PROMPT_PATH: Path = PROMPTS_DIR_PATH / "question_contextualizer.txt"
     CHAT_SUMMARIZER_PROMPT_PATH: Path = PROMPTS_DIR_PATH / "chat_summarizer.txt"
+    CHAT_PREFIX_PROMPT_PATH: Path = PROMPTS_DIR_PATH / "chat_prefix.txt"
+    QUESTION_ANSWERER_SUFFIX_PROMPT_PATH: Path = PROMPTS_DIR_PATH / "question_answerer_suffix.txt"
+    QUESTION_CONTEXTUALIZER_SUFFIX_PROMPT_PATH: Path = PROMPTS_DIR_PATH / "question_contextualizer_suffix.txt"
 
     VECTOR_STORE_DIR_PATH: Path = DATA_DIR_PATH / 'chroma'
+    QUANTIZED_STORE_DIR_PATH: Path = DATA_DIR_PATH / 'quantized_store'
+    CASCADE_STORE_DIR_PATH: Path = DATA_DIR_PATH / 'cascade_store'
+    SHARDED_STORE_DIR_PATH: Path = DATA_DIR_PATH / 'sharded_store'
+    DEDUP_REPORT_PATH: Path = DATA_DIR_PATH / 'dedup_report.json'
+    INGESTION_JOURNAL_PATH: Path = DATA_DIR_PATH / 'ingestion_journal.sqlite3'
+    QUERY_LOG_PATH: Path = DATA_DIR_PATH / 'query_log.sqlite3'
+    ELIFE_XML_MIRROR_DIR_PATH: Path = DATA_DIR_PATH / 'elife-article-xml'
+    PROFILES_DIR_PATH: Path = DATA_DIR_PATH / 'profiles'
 
     HF_DATA_PATH: str = 'pszemraj/scientific_lay_summarisation-elife-norm'
+    ELIFE_XML_REMOTE_URL: str = 'https://github.com/elifesciences/elife-article-xml.git'
     HF_EMBEDDING_MODEL_PATH: str = 'Alibaba-NLP/gte-large-en-v1.5'
+    HF_FAST_EMBEDDING_MODEL_PATH: str = 'BAAI/bge-small-en-v1.5'
     HF_SUMMARIZER_MODEL_PATH: str = 'pszemraj/long-t5-tglobal-base-sci-simplify-elife'
     HF_LLM_PATH: str = 'microsoft/Phi-3-mini-4k-instruct'
 
     OLLAMA_LLM_PATH: str = 'phi3:mini-128k'
+    OLLAMA_BASE_URL: str = 'http://localhost:11434'
+    OLLAMA_KEEP_ALIVE: str = '30m'
 
-    try:
-        GOOGLE_DRIVE_CHROMA_URL: str = st.secrets["GOOGLE_DRIVE_CHROMA_URL"]
-        HUGGINGFACE_API_TOKEN: str = st.secrets["HUGGINGFACE_API_TOKEN"]
-    except ImportError:
-        GOOGLE_DRIVE_CHROMA_URL: str = DataUtils.get_global_var("GOOGLE_DRIVE_CHROMA_URL")
-        HUGGINGFACE_API_TOKEN: str = DataUtils.get_global_var("HUGGINGFACE_API_TOKEN")
+    GOOGLE_DRIVE_CHROMA_URL: str = DataUtils.get_secret("GOOGLE_DRIVE_CHROMA_URL")
+    HUGGINGFACE_API_TOKEN: str = DataUtils.get_secret("HUGGINGFACE_API_TOKEN")
 
     class Config:
         env_file = '.env'
@@ -90,6 +168,49 @@ class ArgsParser:
                                  help="Flag to build Chroma vector store after fetching, processing and parsing the data (default: False)")
         self.parser.add_argument('--use_ollama', action='store_true',
                                  help="Flag to use Ollama for as LLM server (default: False)")
+        self.parser.add_argument('--prompt_prefix_cache', action='store_true',
+                                 help="Flag to lay out the prompts with the system prompt and the (append-only) chat history first and the retrieved context last, so that Ollama reuses the cached prompt prefix across turns, and to log the prompt evaluation time saved (default: False)")
+        self.parser.add_argument('--prewarm_top_n', type=int, default=0,
+                                 help="Number of most frequent questions (from the anonymized query log, completed with the example questions) whose embeddings, retrieved documents and answers are precomputed in the background at startup, 0 to disable the query log and cache (default: 0)")
+        self.parser.add_argument('--skip_deduplication', action='store_true',
+                                 help="Flag to skip the near-duplicate removal (MinHash/LSH over titles and summaries) before building the vector store (default: False)")
+        self.parser.add_argument('--restart_ingestion', action='store_true',
+                                 help="Flag to discard the progress journaled by a previous run with the same parameters and rebuild from scratch (default: False, resume)")
+        self.parser.add_argument('--vector_storage', type=str, default='chroma', choices=['chroma', 'float16', 'int8', 'cascade', 'sharded'],
+                                 help="Storage of the vectors searched by the retriever: Chroma (float32), a float16/int8 quantized copy with exact rescoring, a two-stage cascade (fast embedder candidates rescored with the main embedder) or Chroma shards searched in parallel processes (default: chroma)")
+        self.parser.add_argument('--cascade_n_candidates', type=int, default=50,
+                                 help="Number of candidates fetched by the fast embedder of the cascade before rescoring (default: 50)")
+        self.parser.add_argument('--n_shards', type=int, default=4,
+                                 help="Number of shards of the sharded vector storage, each searched by its own process (default: 4)")
+        self.parser.add_argument('--shard_by', type=str, default='hash', choices=['hash', 'source'],
+                                 help="Partitioning of the documents between shards: hash of the document id or hash of its source (default: hash)")
+        self.parser.add_argument('--rss_budget_mib', type=int, default=None,
+                                 help="Resident memory budget of the process (MiB): idle models are unloaded to stay within it, and loading a model that cannot fit fails (default: None, no budget)")
+        self.parser.add_argument('--summarizer_backend', type=str, default='fp32', choices=['fp32', 'int8', 'onnx'],
+                                 help="Inference backend of the summarizer: fp32, dynamic int8 quantization on CPU or ONNX Runtime (default: fp32)")
+        self.parser.add_argument('--summarizer_threads', type=int, default=None,
+                                 help="Number of intra-op threads used by the summarizer, in torch or in the ONNX Runtime sessions (default: None, runtime default)")
+        self.parser.add_argument('--summarizer_interop_threads', type=int, default=None,
+                                 help="Number of inter-op threads used by the summarizer, in torch or in the ONNX Runtime sessions (default: None, runtime default)")
+        self.parser.add_argument('--pdf_extractive_budget', type=int, default=None,
+                                 help="Token budget of the extractive pre-stage applied to PDF texts before summarization (default: None, disabled)")
+        self.parser.add_argument('--xml_extractive_budget', type=int, default=None,
+                                 help="Token budget of the extractive pre-stage applied to XML texts before summarization (default: None, disabled)")
+        self.parser.add_argument('--xml_source', type=str, default='github_api', choices=['github_api', 'git_mirror'],
+                                 help="Source of the eLife XML articles: one GitHub API request per file, or a local shallow and sparse git clone read from its object store, fetching only the articles changed since the last ingested revision (default: github_api)")
+        self.parser.add_argument('--hf_n_samples', type=int, default=None,
+                                 help="Number of rows to stream from the HuggingFace parquet dataset (default: None, all rows)")
+        self.parser.add_argument('--hf_shard_index', type=int, default=0,
+                                 help="Index of the HuggingFace parquet dataset shard to ingest (default: 0)")
+        self.parser.add_argument('--hf_n_shards', type=int, default=1,
+                                 help="Number of shards the HuggingFace parquet dataset is split into (default: 1)")
+        self.parser.add_argument('--profile_stages', type=str, nargs='+', default=None,
+                                 choices=['all', 'turn', 'contextualize', 'retrieve', 'generate', 'summarize', 'ingestion', 'fetch', 'parse', 'embed'],
+                                 help="Stages sampled by the profiler until the process exits, written as flame graph stacks in data/profiles (default: None, from the RAG_PROFILE_STAGES environment variable)")
+        self.parser.add_argument('--profiler_port', type=int, default=None,
+                                 help="Port of the local profiler admin endpoint (/profiler/start?stages=...&captures=..., /profiler/stop, /profiler/status) (default: None, from the RAG_PROFILER_PORT environment variable)")
+        self.parser.add_argument('--vector_store_snapshot', type=str, default=None,
+                                 help="Vector store snapshot (file, directory or local HTTP mirror URL) to verify and import instead of downloading from the drive (default: None)")
     
     def parse_args(self) -> argparse.Namespace:
         """
@@ -106,4 +227,25 @@ class ParsedArgs:
         self.n_files: int = args.n_files
         self.n_docs: int = args.n_docs
         self.build_vector_store: bool = args.build_vector_store
-        self.use_ollama: bool = args.use_ollama
\ No newline at end of file
+        self.use_ollama: bool = args.use_ollama
+        self.prompt_prefix_cache: bool = args.prompt_prefix_cache
+        self.vector_store_snapshot: str = args.vector_store_snapshot
+        self.profile_stages: list = args.profile_stages
+        self.profiler_port: int = args.profiler_port
+        self.prewarm_top_n: int = args.prewarm_top_n
+        self.skip_deduplication: bool = args.skip_deduplication
+        self.restart_ingestion: bool = args.restart_ingestion
+        self.vector_storage: str = args.vector_storage
+        self.cascade_n_candidates: int = args.cascade_n_candidates
+        self.n_shards: int = args.n_shards
+        self.shard_by: str = args.shard_by
+        self.rss_budget_mib: int = args.rss_budget_mib
+        self.summarizer_backend: str = args.summarizer_backend
+        self.summarizer_threads: int = args.summarizer_threads
+        self.summarizer_interop_threads: int = args.summarizer_interop_threads
+        self.pdf_extractive_budget: int = args.pdf_extractive_budget
+        self.xml_extractive_budget: int = args.xml_extractive_budget
+        self.xml_source: str = args.xml_source
+        self.hf_n_samples: int = args.hf_n_samples
+        self.hf_shard_index: int = args.hf_shard_index
+        self.hf_n_shards: int = args.hf_n_shards
\ No newline at end of file
@@ -1,31 +1,116 @@
-# only to handle deployment conflict
-__import__('pysqlite3')
-import sys
-sys.modules['sqlite3'] = sys.modules.pop('pysqlite3')
-
-from langchain_community.vectorstores import Chroma
 from pathlib import Path
-import gdown
+from src.utils import DataUtils
+from src.profiler import profiler
+import sys
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
 
+def import_chroma():
+    """
+    Imports the Chroma vector store lazily, patching sqlite3 with pysqlite3 first (only to handle deployment conflict)
+    """
+    if 'pysqlite3' not in sys.modules:
+        __import__('pysqlite3')
+        sys.modules['sqlite3'] = sys.modules['pysqlite3']
+    from langchain_community.vectorstores import Chroma
+    return Chroma
+
 class VectorStoreBuilder:
     """
-    Class for building and a Chroma vector store from documents
+    Class for building and a Chroma vector store from documents, either as one collection or partitioned into shards
     """
-    def __init__(self, documents, embedding_function, vector_store_dir_path):
+    def __init__(self, documents, embedding_function, vector_store_dir_path, batch_size=1000, journal=None, n_shards=1, shard_by='hash',
+                 get_replaced_sources=None):
         self.documents = documents
         self.embedding_function = embedding_function
         self.vector_store_dir_path = vector_store_dir_path
+        self.batch_size = batch_size
+        self.journal = journal
+        self.n_shards = n_shards
+        self.shard_by = shard_by
+        self.get_replaced_sources = get_replaced_sources
         self.logger = logging.getLogger(self.__class__.__name__)
 
+    def open_vector_stores(self):
+        """
+        Opens the Chroma vector store, or one Chroma vector store per shard (in sub-directories listed by a shard manifest)
+        """
+        Chroma = import_chroma()
+        if self.n_shards == 1:
+            return [Chroma(persist_directory=self.vector_store_dir_path, embedding_function=self.embedding_function)]
+        from src.sharded_store import ShardedVectorStore
+        # the manifest is only written once the shards are (see build_vector_store)
+        ShardedVectorStore.check_manifest(self.vector_store_dir_path, self.n_shards, self.shard_by)
+        return [Chroma(persist_directory=str(ShardedVectorStore.get_shard_dir_path(self.vector_store_dir_path, shard_index)), embedding_function=self.embedding_function)
+                for shard_index in range(self.n_shards)]
+
+    def get_shard_index(self, document, doc_id):
+        if self.n_shards == 1:
+            return 0
+        from src.sharded_store import ShardedVectorStore
+        return ShardedVectorStore.get_shard_index(document, doc_id, self.n_shards, self.shard_by)
+
     def build_vector_store(self):
         """
-        Builds the vector store and saves it to the specified directory.
+        Builds the vector store and saves it to the specified directory, adding the documents (a list or a generator of Document or ArticleRecord objects) batch by batch
+        under stable ids (documents are upserted, so a batch written twice is not duplicated); with a journal, the documents stored
+        by a previous run are not embedded again and each stored batch is journaled
+        """
+        vector_stores = self.open_vector_stores()
+        # the fingerprint of the collection is only written back once it is complete
+        DataUtils.clear_fingerprint(self.vector_store_dir_path)
+        stored_ids = self.journal.get_done_keys('stored') if self.journal is not None else set()
+        n_documents = 0
+        n_skipped = 0
+        for batch in DataUtils.batch_data(self.documents, self.batch_size):
+            shard_documents = [{} for _ in vector_stores]
+            for document in batch:
+                doc_id = DataUtils.get_document_id(document)
+                if doc_id in stored_ids:
+                    n_skipped += 1
+                else:
+                    shard_documents[self.get_shard_index(document, doc_id)].setdefault(doc_id, document)
+            batch_ids = [doc_id for documents in shard_documents for doc_id in documents]
+            if not batch_ids:
+                continue
+            for vector_store, documents in zip(vector_stores, shard_documents):
+                if documents:
+                    # texts and metadata are written directly, so ArticleRecord objects are stored without creating Document objects
+                    with profiler.stage('embed'):
+                        vector_store.add_texts([document.page_content for document in documents.values()],
+                                               metadatas=[document.metadata for document in documents.values()], ids=list(documents))
+            if self.journal is not None:
+                self.journal.mark_done(batch_ids, 'stored')
+            n_documents += len(batch_ids)
+            self.logger.info(f"{n_documents} documents added to the vector store")
+        if n_skipped:
+            self.logger.info(f"{n_skipped} documents already stored by a previous run skipped")
+        # the previous versions of the updated articles (only known once the documents are consumed) are deleted after their new versions are stored
+        if self.get_replaced_sources is not None:
+            self.delete_sources(vector_stores, self.get_replaced_sources())
+        # fingerprint of the content, computed once here so that loading the stores exported from it does not scan the collection
+        DataUtils.write_fingerprint(self.vector_store_dir_path, DataUtils.get_collection_fingerprint(*[vector_store._collection for vector_store in vector_stores]))
+        # the shard manifest is written last, so that a store whose shards are not all written is not opened
+        if self.n_shards > 1:
+            from src.sharded_store import ShardedVectorStore
+            ShardedVectorStore.write_manifest(self.vector_store_dir_path, self.n_shards, self.shard_by)
+        self.logger.info(f"Vectorsctore created successfully and saved to {self.vector_store_dir_path}" + (f" ({self.n_shards} shards)" if self.n_shards > 1 else ""))
+
+    def delete_sources(self, vector_stores, sources):
+        """
+        Deletes the documents of the given article sources from the vector store (every shard), looking them up by batches of sources
         """
-        Chroma.from_documents(self.documents, self.embedding_function, persist_directory=self.vector_store_dir_path)      
-        self.logger.info(f"Vectorsctore created successfully and saved to {self.vector_store_dir_path}")
+        sources = sorted(set(sources))
+        n_deleted = 0
+        for batch in DataUtils.batch_data(sources, self.batch_size):
+            for vector_store in vector_stores:
+                ids = vector_store.get(where={'article_source': {'$in': batch}}, include=[])['ids']
+                if ids:
+                    vector_store.delete(ids=ids)
+                    n_deleted += len(ids)
+        if n_deleted:
+            self.logger.info(f"{n_deleted} documents of replaced articles deleted from the vector store ({len(sources)} previous sources looked up)")
 
 
 class VectorStoreGdown:
@@ -79,6 +164,8 @@ class VectorStoreGdown:
         vector_store_integrity = self.check_vector_store_integrity()
         if not vector_store_integrity:
             self.logger.info("The existing vector store is incomplete. It will be redownloaded and overwritten")
+            DataUtils.clear_fingerprint(self.vector_store_dir_path)
+            import gdown
             gdown.download_folder(url=self.google_drive_chroma_url, output=self.vector_store_dir_path)
         else:
             pass
@@ -87,10 +174,73 @@ class DocumentRetriever:
     """
     Class for setting up a document retriever
     """
-    def __init__(self, embedding_function, vector_store_dir_path, n_docs, lambda_mult= 0.5):
+    def __init__(self, embedding_function, vector_store_dir_path, n_docs, lambda_mult= 0.5, vector_store=None,
+                 vector_storage='chroma', quantized_store_dir_path=None, fast_embedding_function=None, cascade_store_dir_path=None,
+                 sharded_store_dir_path=None):
         self.search_kwargs = {'k': n_docs, 'fetch_k': n_docs+4, 'lambda_mult': lambda_mult}
-        self.vector_store = Chroma(persist_directory=vector_store_dir_path, embedding_function=embedding_function)
-        
+        self.vector_store = vector_store if vector_store is not None else self.load_vector_store(embedding_function, vector_store_dir_path,
+                                                                                                 vector_storage, quantized_store_dir_path,
+                                                                                                 fast_embedding_function, cascade_store_dir_path,
+                                                                                                 sharded_store_dir_path=sharded_store_dir_path)
+
+    @staticmethod
+    def load_vector_store(embedding_function, vector_store_dir_path, vector_storage='chroma', quantized_store_dir_path=None,
+                          fast_embedding_function=None, cascade_store_dir_path=None, cascade_n_candidates=50,
+                          sharded_store_dir_path=None, n_shards=4, shard_by='hash'):
+        """
+        Opens the persisted Chroma vector store, its float16/int8 quantized copy (exported from Chroma when missing or out of
+        date), the two-stage (cascade) store with its fast embedding index (built by the data pipeline) or the sharded store
+        (partitioned from Chroma when it was not built sharded); the quantized store is used on its own when there is no Chroma vector store, and read
+        from its packed snapshot (re-exported when out of date) when there is one next to its folder
+        """
+        if vector_storage in ('float16', 'int8'):
+            from src.quantized_store import QuantizedVectorStore
+            store_dir_path = Path(quantized_store_dir_path) / vector_storage
+            # the fingerprint written by the ingestion tells whether the export is up to date without opening Chroma
+            if (Path(vector_store_dir_path) / 'chroma.sqlite3').is_file():
+                fingerprint = DataUtils.read_fingerprint(vector_store_dir_path)
+                if fingerprint is None or fingerprint != DataUtils.read_fingerprint(store_dir_path):
+                    vector_store = import_chroma()(persist_directory=vector_store_dir_path, embedding_function=embedding_function)
+                    fingerprint = fingerprint or DocumentRetriever.fingerprint_vector_store(vector_store, vector_store_dir_path)
+                    if DataUtils.read_fingerprint(store_dir_path) != fingerprint:
+                        QuantizedVectorStore.build_from_chroma(vector_store, store_dir_path, vector_storage, fingerprint=fingerprint)
+            elif DataUtils.read_fingerprint(store_dir_path) is None:
+                raise FileNotFoundError(f"No quantized store in {store_dir_path} and no Chroma vector store in {vector_store_dir_path} to export it from")
+            snapshot_path = store_dir_path.with_suffix('.snapshot')
+            if snapshot_path.is_file():
+                if QuantizedVectorStore.read_snapshot_fingerprint(snapshot_path) != DataUtils.read_fingerprint(store_dir_path):
+                    from src.snapshot import VectorStoreSnapshot
+                    VectorStoreSnapshot(store_dir_path).export_snapshot(snapshot_path)
+                return QuantizedVectorStore(store_dir_path, embedding_function, snapshot_path=snapshot_path)
+            return QuantizedVectorStore(store_dir_path, embedding_function)
+
+        # the fast embedding index of the cascade is built by the data pipeline, so that the corpus is not embedded again at load time
+        if vector_storage == 'cascade':
+            from src.cascade_store import CascadeVectorStore
+            if DataUtils.read_fingerprint(cascade_store_dir_path) is None:
+                raise FileNotFoundError(f"No cascade store in {cascade_store_dir_path}: it is built by the data pipeline (or with python -m src.cascade_store)")
+            return CascadeVectorStore(cascade_store_dir_path, embedding_function, fast_embedding_function, n_candidates=cascade_n_candidates)
+
+        Chroma = import_chroma()
+        if vector_storage == 'sharded':
+            from src.sharded_store import ShardedVectorStore
+            if ShardedVectorStore.check_manifest(sharded_store_dir_path, n_shards, shard_by) is None:
+                ShardedVectorStore.build_from_chroma(Chroma(persist_directory=vector_store_dir_path), sharded_store_dir_path, n_shards, shard_by)
+            return ShardedVectorStore(sharded_store_dir_path, embedding_function, n_shards=n_shards, shard_by=shard_by)
+
+        if vector_storage == 'chroma':
+            return Chroma(persist_directory=vector_store_dir_path, embedding_function=embedding_function)
+        raise ValueError(f"Unknown vector storage '{vector_storage}'")
+
+    @staticmethod
+    def fingerprint_vector_store(vector_store, vector_store_dir_path):
+        """
+        Computes and records the fingerprint of a Chroma vector store that was not built here (downloaded), once
+        """
+        fingerprint = DataUtils.get_collection_fingerprint(vector_store._collection)
+        DataUtils.write_fingerprint(vector_store_dir_path, fingerprint)
+        return fingerprint
+
     def set_retriever(self):
         """
         Sets the retriever with MMR as a search metric
@@ -0,0 +1,25 @@
+from src.summarizer import ExtractiveCondenser
+
+
+def test_sentences_within_budget_are_kept_in_order():
+    text = ("Zebrafish larvae regenerate their retina. The retina of zebrafish larvae regenerates from Muller glia. "
+            "Funding was provided by the institute. Muller glia of the zebrafish retina divide after injury.")
+    condensed_text = ExtractiveCondenser(token_budget=20).condense(text)
+
+    assert condensed_text
+    assert len(condensed_text.split()) <= 20
+    sentences = ExtractiveCondenser(token_budget=20).split_sentences(text)
+    kept = [sentence for sentence in sentences if sentence in condensed_text]
+    assert ' '.join(kept) == condensed_text
+
+
+def test_text_without_sentence_boundary_is_cut_to_the_budget():
+    # a PDF page whose text has no sentence boundary is a single sentence larger than the budget
+    text = ' '.join(f"word{i}" for i in range(500))
+    condensed_text = ExtractiveCondenser(token_budget=50).condense(text)
+
+    assert condensed_text == ' '.join(f"word{i}" for i in range(50))
+
+
+def test_text_within_budget_is_unchanged():
+    assert ExtractiveCondenser(token_budget=50).condense("A short abstract.") == "A short abstract."
@@ -0,0 +1,128 @@
+import subprocess
+
+import pytest
+
+from src.deduplicator import DocumentDeduplicator
+from src.fetchers import GitMirrorDataFetcher
+from src.records import ArticleRecord
+
+
+def run_git(repo_dir_path, *args):
+    return subprocess.run(["git", "-C", str(repo_dir_path), *args], capture_output=True, check=True, text=True).stdout.strip()
+
+
+def write_article(repo_dir_path, name, title):
+    (repo_dir_path / 'articles' / name).write_text(f"<article><article-title>{title}</article-title></article>")
+
+
+def commit(repo_dir_path, message):
+    run_git(repo_dir_path, "add", "-A")
+    run_git(repo_dir_path, "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "--quiet", "-m", message)
+    return run_git(repo_dir_path, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def remote_dir_path(tmp_path):
+    """
+    A local repository with three articles and a file outside of the mirrored path
+    """
+    repo_dir_path = tmp_path / 'remote'
+    (repo_dir_path / 'articles').mkdir(parents=True)
+    run_git(repo_dir_path, "init", "--quiet", "--initial-branch", "master")
+    run_git(repo_dir_path, "config", "uploadpack.allowFilter", "true")
+    for name in ('a.xml', 'b.xml', 'c.xml'):
+        write_article(repo_dir_path, name, f"Article {name}")
+    (repo_dir_path / 'README.md').write_text("not an article")
+    commit(repo_dir_path, "initial articles")
+    return repo_dir_path
+
+
+def create_fetcher(tmp_path, remote_dir_path, n_files=None, incremental=True):
+    return GitMirrorDataFetcher(mirror_dir_path=tmp_path / 'mirror', n_files=n_files, remote_url=remote_dir_path.as_uri(), incremental=incremental)
+
+
+def get_paths(data):
+    return [item['url'].rsplit('/', 2)[-2] + '/' + item['url'].rsplit('/', 1)[-1] for item in data]
+
+
+def test_fetches_every_article_of_the_mirror(tmp_path, remote_dir_path):
+    fetcher = create_fetcher(tmp_path, remote_dir_path)
+    data = fetcher.fetch_data()
+    assert not isinstance(data, list)
+    data = list(data)
+
+    revision = run_git(remote_dir_path, "rev-parse", "HEAD")
+    assert get_paths(data) == ['articles/a.xml', 'articles/b.xml', 'articles/c.xml']
+    assert all(revision in item['url'] for item in data)
+    assert data[0]['content'] == "<article><article-title>Article a.xml</article-title></article>"
+    assert fetcher.pending_paths == []
+
+
+def test_skipped_urls_are_not_read(tmp_path, remote_dir_path):
+    fetcher = create_fetcher(tmp_path, remote_dir_path)
+    revision = run_git(remote_dir_path, "rev-parse", "HEAD")
+    fetcher.skip_urls = {fetcher.url_template.format(revision=revision, path='articles/b.xml')}
+    data = list(fetcher.fetch_data())
+
+    assert [item['content'] is None for item in data] == [False, True, False]
+
+
+def test_incremental_fetch_picks_up_changed_and_pending_articles(tmp_path, remote_dir_path):
+    fetcher = create_fetcher(tmp_path, remote_dir_path, n_files=2)
+    assert get_paths(fetcher.fetch_data()) == ['articles/a.xml', 'articles/b.xml']
+    fetcher.mark_ingested()
+
+    # c.xml was left out by n_files, a.xml is modified, b.xml deleted and d.xml added
+    write_article(remote_dir_path, 'a.xml', "Article a.xml, revised")
+    (remote_dir_path / 'articles' / 'b.xml').unlink()
+    write_article(remote_dir_path, 'd.xml', "Article d.xml")
+    commit(remote_dir_path, "update articles")
+
+    fetcher = create_fetcher(tmp_path, remote_dir_path, n_files=2)
+    data = list(fetcher.fetch_data())
+    assert get_paths(data) == ['articles/a.xml', 'articles/c.xml']
+    assert data[0]['content'] == "<article><article-title>Article a.xml, revised</article-title></article>"
+    assert fetcher.pending_paths == ['articles/d.xml']
+    fetcher.mark_ingested()
+
+    fetcher = create_fetcher(tmp_path, remote_dir_path, n_files=2)
+    assert get_paths(fetcher.fetch_data()) == ['articles/d.xml']
+    fetcher.mark_ingested()
+
+    fetcher = create_fetcher(tmp_path, remote_dir_path, n_files=2)
+    assert list(fetcher.fetch_data()) == []
+
+
+def test_restarted_fetch_lists_every_article_again(tmp_path, remote_dir_path):
+    fetcher = create_fetcher(tmp_path, remote_dir_path)
+    fetcher.fetch_data()
+    fetcher.mark_ingested()
+
+    fetcher = create_fetcher(tmp_path, remote_dir_path, incremental=False)
+    assert get_paths(fetcher.fetch_data()) == ['articles/a.xml', 'articles/b.xml', 'articles/c.xml']
+
+
+def test_modified_article_replaces_its_previous_version(tmp_path, remote_dir_path):
+    fetcher = create_fetcher(tmp_path, remote_dir_path)
+    old_url = next(fetcher.fetch_data())['url']
+    fetcher.mark_ingested()
+    write_article(remote_dir_path, 'a.xml', "Article a.xml, revised")
+    write_article(remote_dir_path, 'd.xml', "Article d.xml")
+    commit(remote_dir_path, "update article")
+    fetcher = create_fetcher(tmp_path, remote_dir_path)
+    new_url = next(fetcher.fetch_data())['url']
+    assert fetcher.get_article_key(old_url) == fetcher.get_article_key(new_url) == 'articles/a.xml'
+    # the previous version is replaced whether or not the near-duplicates are removed
+    assert fetcher.get_replaced_sources() == [old_url]
+    assert fetcher.get_article_key("https://www.biorxiv.org/content/10.1101/2021.01.01.425001v1.full.pdf") is None
+
+    summary = "The summary of an eLife article about the evolution of the vertebrate eye and its development in zebrafish larvae."
+    deduplicator = DocumentDeduplicator(index_path=tmp_path / 'dedup_index.npz', report_path=tmp_path / 'dedup_report.json',
+                                        get_article_key=fetcher.get_article_key)
+    records = [ArticleRecord(summary=summary, year=2020, title="The evolution of the vertebrate eye", source=old_url),
+               ArticleRecord(summary=summary + " Revised.", year=2020, title="The evolution of the vertebrate eye", source=new_url),
+               ArticleRecord(summary=summary, year=2020, title="The evolution of the vertebrate eye", source="https://huggingface.co/datasets/elife")]
+    kept_records = list(deduplicator.filter_documents(records))
+
+    assert [record.source for record in kept_records] == [old_url, new_url]
+    assert [document['replaces'] for document in deduplicator.updated_documents] == [old_url]
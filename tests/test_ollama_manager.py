@@ -0,0 +1,121 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+
+from src.llm import OllamaManager
+
+
+class StandInOllamaServer:
+    """
+    A local stand-in of the Ollama HTTP API serving /api/version, /api/tags, /api/pull (streamed progress) and /api/generate,
+    recording the requests it receives
+    """
+    def __init__(self, models=(), pull_lines=None):
+        self.models = list(models)
+        self.pull_lines = pull_lines if pull_lines is not None else [
+            {'status': "pulling manifest"},
+            {'status': "pulling layer", 'total': 1000, 'completed': 0},
+            {'status': "pulling layer", 'total': 1000, 'completed': 500},
+            {'status': "pulling layer", 'total': 1000, 'completed': 1000},
+            {'status': "success"}]
+        self.requests = []
+        server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                server.requests.append((self.path, None))
+                if self.path == '/api/version':
+                    self.send_json({'version': "0.0.0-test"})
+                elif self.path == '/api/tags':
+                    self.send_json({'models': [{'name': name} for name in server.models]})
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                server.requests.append((self.path, payload))
+                if self.path == '/api/pull':
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/x-ndjson')
+                    self.end_headers()
+                    for line in server.pull_lines:
+                        self.wfile.write(json.dumps(line).encode('utf-8') + b'\n')
+                        self.wfile.flush()
+                    if not any('error' in line for line in server.pull_lines):
+                        server.models.append(payload['model'])
+                elif self.path == '/api/generate':
+                    self.send_json({'model': payload['model'], 'response': "Hi" if 'prompt' in payload else "", 'done': True,
+                                    'load_duration': 1_000_000, 'prompt_eval_duration': 2_000_000})
+                else:
+                    self.send_error(404)
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.base_url = f"http://127.0.0.1:{self.http_server.server_address[1]}"
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+    def get_paths(self):
+        return [path for path, _ in self.requests]
+
+    def get_payloads(self, path):
+        return [payload for request_path, payload in self.requests if request_path == path]
+
+    def close(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+
+@pytest.fixture
+def ollama_server():
+    server = StandInOllamaServer()
+    yield server
+    server.close()
+
+
+def test_server_health_check(ollama_server):
+    assert OllamaManager(llm_path="phi3:mini", base_url=ollama_server.base_url).is_server_running()
+
+    ollama_server.close()
+    assert not OllamaManager(llm_path="phi3:mini", base_url=ollama_server.base_url, timeout=1).is_server_running()
+
+
+def test_untagged_model_matches_its_latest_tag(ollama_server):
+    ollama_server.models = ["phi3:latest"]
+    assert OllamaManager(llm_path="phi3", base_url=ollama_server.base_url).is_model_available()
+    assert not OllamaManager(llm_path="phi3:mini", base_url=ollama_server.base_url).is_model_available()
+
+
+def test_missing_model_is_pulled_preloaded_and_warmed_up(ollama_server):
+    ollama_manager = OllamaManager(llm_path="phi3:mini", base_url=ollama_server.base_url, keep_alive="5m")
+    ollama_manager.manage_ollama()
+
+    assert ollama_server.get_paths() == ['/api/version', '/api/tags', '/api/pull', '/api/generate', '/api/generate']
+    assert ollama_server.get_payloads('/api/pull') == [{'model': "phi3:mini", 'stream': True}]
+    preload_payload, warm_up_payload = ollama_server.get_payloads('/api/generate')
+    assert preload_payload == {'model': "phi3:mini", 'keep_alive': "5m", 'stream': False}
+    assert warm_up_payload == {'model': "phi3:mini", 'keep_alive': "5m", 'stream': False, 'prompt': "Hello", 'options': {'num_predict': 1}}
+
+
+def test_available_model_is_not_pulled_again(ollama_server):
+    ollama_server.models = ["phi3:mini"]
+    OllamaManager(llm_path="phi3:mini", base_url=ollama_server.base_url).manage_ollama()
+
+    assert '/api/pull' not in ollama_server.get_paths()
+
+
+def test_pull_error_is_raised(ollama_server):
+    ollama_server.pull_lines = [{'status': "pulling manifest"}, {'error': "pull model manifest: file does not exist"}]
+    with pytest.raises(RuntimeError, match="file does not exist"):
+        OllamaManager(llm_path="unknown-model", base_url=ollama_server.base_url).pull_model()
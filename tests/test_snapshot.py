@@ -0,0 +1,166 @@
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import mmap
+import threading
+
+import numpy as np
+import pytest
+
+from src.quantized_store import QuantizedVectorStore
+from src.snapshot import CHUNK_SIZE, SEGMENT_ALIGNMENT, SNAPSHOT_TRAILER, STATE_FILE_NAME, SnapshotSource, VectorStoreSnapshot
+from src.utils import DataUtils
+
+
+@pytest.fixture
+def vectors():
+    vectors = np.random.default_rng(0).standard_normal((200, 16)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('mode', ['float16', 'int8'])
+def test_quantized_store_is_read_in_place_from_its_snapshot(tmp_path, vectors, mode):
+    store_dir_path = tmp_path / mode
+    documents = [{'page_content': f"document {i}", 'metadata': {'id': i}} for i in range(len(vectors))]
+    QuantizedVectorStore.build(vectors, documents, store_dir_path, mode)
+    DataUtils.write_fingerprint(store_dir_path, "fingerprint")
+    snapshot_path = store_dir_path.with_suffix('.snapshot')
+    VectorStoreSnapshot(store_dir_path).export_snapshot(snapshot_path)
+
+    store = QuantizedVectorStore(store_dir_path, embedding_function=None)
+    snapshot_store = QuantizedVectorStore(store_dir_path, embedding_function=None, snapshot_path=snapshot_path)
+
+    assert QuantizedVectorStore.read_snapshot_fingerprint(snapshot_path) == "fingerprint"
+    assert isinstance(snapshot_store.codes.base, mmap.mmap) and not snapshot_store.codes.flags.writeable
+    np.testing.assert_array_equal(snapshot_store.codes, store.codes)
+    np.testing.assert_array_equal(snapshot_store.rescoring_vectors, store.rescoring_vectors)
+    assert snapshot_store.documents == store.documents
+    assert (snapshot_store.similarity_search_with_score_by_vector(vectors[3], k=5)
+            == store.similarity_search_with_score_by_vector(vectors[3], k=5))
+
+
+def test_snapshot_without_fingerprint(tmp_path, vectors):
+    store_dir_path = tmp_path / 'int8'
+    QuantizedVectorStore.build(vectors, [{'page_content': "", 'metadata': {}}] * len(vectors), store_dir_path, 'int8')
+    VectorStoreSnapshot(store_dir_path).export_snapshot(tmp_path / 'int8.snapshot')
+
+    assert QuantizedVectorStore.read_snapshot_fingerprint(tmp_path / 'int8.snapshot') is None
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the files of a folder, answering Range requests with 206 partial content (unless the server disables them)
+    """
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get('Range'))
+        path = self.translate_path(self.path)
+        with open(path, 'rb') as file:
+            content = file.read()
+        byte_range = self.headers.get('Range') if self.server.support_ranges else None
+        if byte_range is None:
+            self.send_response(200)
+        else:
+            start, end = byte_range.removeprefix('bytes=').split('-')
+            # "bytes=start-end", or "bytes=-n" for the last n bytes
+            start, end = (len(content) - int(end), len(content) - 1) if not start else (int(start), int(end))
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(content)}")
+            content = content[start:end + 1]
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@pytest.fixture
+def vector_store_dir_path(tmp_path):
+    """
+    A vector store folder with a large file spanning several chunks, a small file and a nested one
+    """
+    vector_store_dir_path = tmp_path / 'chroma'
+    (vector_store_dir_path / 'segment').mkdir(parents=True)
+    (vector_store_dir_path / 'chroma.sqlite3').write_bytes(np.random.default_rng(0).bytes(2 * CHUNK_SIZE + 1000))
+    (vector_store_dir_path / 'segment' / 'header.bin').write_bytes(b"header")
+    (vector_store_dir_path / 'segment' / 'length.bin').write_bytes(b"")
+    return vector_store_dir_path
+
+
+def get_files(dir_path):
+    return {path.relative_to(dir_path).as_posix(): path.read_bytes() for path in sorted(dir_path.rglob('*'))
+            if path.is_file() and path.name != STATE_FILE_NAME}
+
+
+@pytest.fixture
+def snapshot_server(tmp_path, vector_store_dir_path):
+    VectorStoreSnapshot(vector_store_dir_path).export_snapshot(tmp_path / 'chroma.snapshot')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeRequestHandler, directory=str(tmp_path)))
+    server.requests, server.support_ranges = [], True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_export_import_verify_round_trip(tmp_path, vector_store_dir_path):
+    manifest = VectorStoreSnapshot(vector_store_dir_path).export_snapshot(tmp_path / 'chroma.snapshot')
+    assert all(entry['offset'] % SEGMENT_ALIGNMENT == 0 for entry in manifest['files'])
+    assert len(next(entry for entry in manifest['files'] if entry['path'] == 'chroma.sqlite3')['chunks']) == 3
+
+    local_snapshot = VectorStoreSnapshot(tmp_path / 'imported')
+    source = SnapshotSource(tmp_path)
+    assert not local_snapshot.verify_vector_store(source)
+    local_snapshot.import_snapshot(source)
+
+    assert get_files(tmp_path / 'imported') == get_files(vector_store_dir_path)
+    assert local_snapshot.verify_vector_store(source, full_check=True)
+    assert local_snapshot.find_stale_chunks(VectorStoreSnapshot.read_manifest(source)) == {}
+
+
+def test_corrupted_chunk_is_detected_and_fetched_again(tmp_path, vector_store_dir_path):
+    VectorStoreSnapshot(vector_store_dir_path).export_snapshot(tmp_path / 'chroma.snapshot')
+    local_snapshot = VectorStoreSnapshot(tmp_path / 'imported')
+    source = SnapshotSource(tmp_path / 'chroma.snapshot')
+    local_snapshot.import_snapshot(source)
+
+    # same size, one byte changed in the second chunk: the recorded state (size and mtime) is only bypassed by a full check
+    imported_path = tmp_path / 'imported' / 'chroma.sqlite3'
+    content = bytearray(imported_path.read_bytes())
+    content[CHUNK_SIZE + 10] ^= 0xFF
+    imported_path.write_bytes(bytes(content))
+
+    manifest = VectorStoreSnapshot.read_manifest(source)
+    assert local_snapshot.find_stale_chunks(manifest, full_check=True) == {'chroma.sqlite3': [1]}
+    assert not local_snapshot.verify_vector_store(source, full_check=True)
+    local_snapshot.import_snapshot(source, full_check=True)
+    assert imported_path.read_bytes() == (vector_store_dir_path / 'chroma.sqlite3').read_bytes()
+
+
+def test_corrupted_snapshot_is_rejected(tmp_path, vector_store_dir_path):
+    manifest = VectorStoreSnapshot(vector_store_dir_path).export_snapshot(tmp_path / 'chroma.snapshot')
+    entry = next(entry for entry in manifest['files'] if entry['path'] == 'chroma.sqlite3')
+    with open(tmp_path / 'chroma.snapshot', 'r+b') as file:
+        file.seek(entry['offset'] + 5)
+        file.write(b"corrupted")
+
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        VectorStoreSnapshot(tmp_path / 'imported').import_snapshot(SnapshotSource(tmp_path / 'chroma.snapshot'))
+
+
+def test_import_through_range_requests(tmp_path, vector_store_dir_path, snapshot_server):
+    url = f"http://127.0.0.1:{snapshot_server.server_address[1]}"
+    VectorStoreSnapshot(tmp_path / 'imported').import_snapshot(SnapshotSource(url))
+
+    assert get_files(tmp_path / 'imported') == get_files(vector_store_dir_path)
+    assert snapshot_server.requests[0] == f"bytes=-{SNAPSHOT_TRAILER.size}"
+    assert all(byte_range is not None for byte_range in snapshot_server.requests)
+
+
+def test_import_from_mirror_without_range_support(tmp_path, vector_store_dir_path, snapshot_server):
+    snapshot_server.support_ranges = False
+    source = SnapshotSource(f"http://127.0.0.1:{snapshot_server.server_address[1]}/chroma.snapshot")
+    VectorStoreSnapshot(tmp_path / 'imported').import_snapshot(source)
+
+    assert get_files(tmp_path / 'imported') == get_files(vector_store_dir_path)
+    # the whole snapshot is downloaded once and kept in memory
+    assert len(snapshot_server.requests) == 1 and source.full_content is not None